@@ -16,15 +16,29 @@ SRC_CLTN = "Originals"  # Collection of original objects
 TRGT_CLTN = "Copies"  # Collection of copies (to be rendered)
 REF_CLTN = "Reference"  # Collection of reference item, used to sanity check renders
 CAM_CLTN = "Cameras"  # Collection of camera objects
+POOL_CLTN = "Pool"  # Collection of pooled copies, not linked to scene (PooledScenemaker)
 SPAWNBOX_OBJ = "spawnbox"  # Spawnbox object, representing the spawn area
 CAMERA_OBJ_CENTER = "camera_C"  # Name of center camera object, should be same name in Blender file
 CAMERA_OBJ_CENTER_TOP = "camera_C_TOP"  # Name of center camera object, should be same name in Blender file
 CAMERA_OBJ_LEFT = "camera_L"  # Name of left camera object, should be same name in Blender file
 CAMERA_OBJ_RIGHT = "camera_R"  # Name of right camera object, should be same name in Blender file
+CAMERA_DICT = {  # Numerical camera in bboxes_std_multi, other cameras in CAM_CLTN are numbered after
+    CAMERA_OBJ_LEFT: 0,
+    CAMERA_OBJ_RIGHT: 1,
+    CAMERA_OBJ_CENTER: 2,
+    CAMERA_OBJ_CENTER_TOP: 3,
+}
+VIEW_MODE_CAMERAS = {  # Cameras rendered in every view mode, same order as file suffixes
+    "center": (CAMERA_OBJ_CENTER,),
+    "leftright": (CAMERA_OBJ_LEFT, CAMERA_OBJ_RIGHT),
+    "topcenter": (CAMERA_OBJ_CENTER, CAMERA_OBJ_CENTER_TOP),
+    "all": (CAMERA_OBJ_LEFT, CAMERA_OBJ_RIGHT, CAMERA_OBJ_CENTER, CAMERA_OBJ_CENTER_TOP),
+}
 ROT_MUS = [0, 0, -0.5*pi]  # Mean rotation for fishes when generating
 ROT_STDS = [2*pi, 2*pi, 2*pi]  # Std rotation for fishen when generating
 DEFAULT_BBOX_MODE = "full"  # cps xyz full std
 COMMIT_INTERVAL = 32  # How often to commit to database (16 means commit at every 16th sample)
+LABELWRITER_CAPACITY = 1024  # Initial rows per table buffered by LabelWriter, grows if needed
 RAND_SCALE_MU: float = 1
 RAND_SCALE_STD: float = 0.2
 CLASS_DICT = {  # Enforce class dictionary, inverse map: {v: k for k, v in CLASS_DICT.items()}
@@ -36,6 +50,10 @@ CLASS_DICT = {  # Enforce class dictionary, inverse map: {v: k for k, v in CLASS
     "whiting": 5,
 }
 DEFAULT_SPAWNRANGE = (1, 6) # Draw from uniform dist (1, 6) to determine how many fish to spawn
+STD_BBOX_USE_HULL = True  # Project cached convex hulls instead of every vertex for std bboxes
+SCENE_PLAN_DIR = "plans"  # Will be placed in GENERATED_DATA_DIR, scene plans as .npy files
+SCENE_PLAN_FILE = "plan_{}_{}.npy"  # Formatted with first and last imgnr of plan
+SCENE_PLAN_MAX_TRIES = 100  # Max rounds of resampling rejected fish when sampling scene plans
 
 """reconstruct.py"""
 DEFAULT_ALTER_COLOR = (0.2, 1, 0.2, 1) # R G B A
@@ -45,10 +63,15 @@ DEFAULT_MIXSHADER_FAC = 0.3 # Mixing between transparent and texture
 GENERATED_DATA_DIR = "generated_data"
 # BBOX_FILE = 'bboxes.csv'
 IMAGE_DIR = "images"  # Will be placed in GENERATED_DATA_DIR
+ORPHAN_DIR = "orphans"  # Will be placed in GENERATED_DATA_DIR, images without job nor labels
 IMAGE_NAME = "img"
 DEFAULT_FILEFORMAT = "PNG"  # This is what you give to Blender, the actual file extension is:
 DEFAULT_FILEFORMAT_EXTENSION = ".png"  # The actual file extension in file system
 BBOX_DB_FILE = "bboxes.db"
+DB_JOURNAL_MODE = "WAL"  # Readers (e.g. notebook) can query while generation is writing
+DB_SYNCHRONOUS = "NORMAL"  # Safe with WAL, only a power loss can lose the latest commits
+DB_CACHE_SIZE = -65536  # Negative means KiB, so 64 MiB page cache per connection
+DB_MMAP_SIZE = 268435456  # 256 MiB memory mapped I/O for readers
 METADATA_FILE = "metadata.txt"
 BBOX_DB_IMGRNR = "imgnr"  # Column name for image id
 BBOX_DB_CLASS = "class_"  # Column name for classes
@@ -56,10 +79,25 @@ BBOX_MODE_CPS = "cps"  # Cornerponts
 BBOX_MODE_XYZ = "xyz"  # Lengths in x, y, z dimension
 BBOX_MODE_FULL = "full"  # Lengths in x, y, z dimension
 BBOX_MODE_STD = "std"  # Standard 2D bbox for object detection
+BBOX_MODE_POSE = "pose"  # Location, rotation and scale, the other modes are derived from it
+BBOX_MODE_STD_MULTI = "std_multi"  # Standard 2D bbox for every camera in CAM_CLTN
 BBOX_DB_TABLE_XYZ = "bboxes_xyz"  # Length width height
 BBOX_DB_TABLE_CPS = "bboxes_cps"  # Corner points
 BBOX_DB_TABLE_STD = "bboxes_std"  # Standard bounding boxes
 BBOX_DB_TABLE_FULL = "bboxes_full"  # Standard bounding boxes
+BBOX_DB_TABLE_POSE = "poses"  # Location, euler rotation and scale in world space
+BBOX_DB_TABLE_STD_MULTI = "bboxes_std_multi"  # Standard bounding boxes of every camera
+SOURCE_DB_TABLE = "sources"  # Bounding box and convex hull of source objects, for deriving
+CAMERA_DB_TABLE = "cameras"  # Camera parameters, for deriving
+SPAWNBOX_DB_TABLE = "spawnbox"  # Spawnbox location and dimensions, for deriving
+METRICS_DB_TABLE = "metrics"  # Per image stage timings of render runs
+MANIFEST_DB_TABLE = "jobs"  # Job manifest, state and RNG seed of every imgnr
+MANIFEST_DB_SEED = "seed"
+MANIFEST_DB_STATE = "state"
+JOB_PLANNED = "planned"  # Job states, in order
+JOB_RENDERED = "rendered"
+JOB_LABELED = "labeled"
+JOB_COMMITTED = "committed"
 FILE_SUFFIX_CENTER = "_C"
 FILE_SUFFIX_LEFT = "_L"  # Rendering only from one direction will not generate file suffixes
 FILE_SUFFIX_RIGHT = "_R"
@@ -74,6 +112,41 @@ LABELCHECK_DB_TABLE = "rendered"
 LABELCHECK_DB_IMGNR = "imgnr" 
 LABELCHECK_DB_FILE = "recon.db"
 
+"""farm.py"""
+FARM_BLENDER_EXECUTABLE = "blender"  # Blender binary used to spawn workers
+FARM_BLEND_FILE = "Fish.blend"
+FARM_SHARD_DB_FILE = "bboxes_shard_{}_{}.db"  # Formatted with hostname and worker index
+FARM_SHARD_DB_GLOB = "bboxes_shard_*.db"
+FARM_LOG_DIR = "farm_logs"  # Will be placed in GENERATED_DATA_DIR
+
+"""export.py"""
+EXPORT_DIR = "columnar"  # Will be placed in GENERATED_DATA_DIR
+EXPORT_SHARD_SIZE = 10000  # Max number of images per shard
+
+"""evaluate.py"""
+EVAL_IOU_THRESHOLD = 0.5  # Min 3D IoU for a prediction to match a ground truth box
+EVAL_SCORE_COLUMN = "confidence"  # Optional column in predictions, ranks predictions for AP
+EVAL_CHUNK_IMGS = 10000  # Images evaluated at a time
+EVAL_STAGE_ROWS = 100000  # Rows of predictions CSV read at a time when staging
+
+"""derive.py"""
+DERIVE_CHUNK_IMGS = 10000  # Images derived from poses at a time
+
+"""shards.py"""
+SHARD_DIR = "shards"  # Will be placed in GENERATED_DATA_DIR
+SHARD_SIZE = 1000  # Max number of images per tar shard
+SHARD_FILE = "shard{:06d}.tar"  # Formatted with shard number
+SHARD_INDEX_FILE = "shard{:06d}.json"  # Byte offsets of members of shard
+
+"""encode.py"""
+ENCODE_RAW_FILEFORMAT = "BMP"  # Uncompressed format Blender writes when images are encoded async
+ENCODE_RAW_EXTENSION = ".bmp"
+ENCODE_FORMATS = {"PNG": ".png", "WEBP": ".webp", "JPEG": ".jpg"}  # Format -> file extension
+ENCODE_PNG_LEVEL = 6  # zlib level of encoded PNGs
+ENCODE_QUALITY = 90  # Quality of encoded WebP and JPEG
+ENCODE_WORKERS = 4  # Encoder threads of the render loop
+ENCODE_MAX_PENDING = 16  # Max files waiting to be encoded, the render loop blocks when reached
+
 """CLI"""
 # options suffixed with _SHORT are the shortened version of the big one
 # none of the OPT_* stuff is used in code as of 09/01/2021
@@ -97,6 +170,22 @@ OPT_STDBBOXCAM = "--stdbboxcam"
 ARGS_DEFAULT_ENGINE = "CYCLES"  # [BLENDER_EEVEE, CYCLES]
 ARGS_DEFAULT_DEVICE = "CUDA"
 ARGS_DEFAULT_RENDER_SAMPLES = 96
+ARGS_DEFAULT_NOISE_THRESHOLD = 0.01  # Cycles adaptive sampling threshold when --adaptive is given
+ADAPTIVE_MIN_SAMPLES = 16  # Lower bound of samples with adaptive sampling and time budget
+SAMPLE_CONTROLLER_WINDOW = 32  # Renders the time model of SampleController is fitted to
+ARGS_DEFAULT_MULTICAM = "multiview"  # [multiview, sequential, auto], how views are rendered
+MULTICAM_BENCH_ROUNDS = 2  # Timed renders per strategy when --multicam auto benchmarks them
+EEVEE_FAST_SETTINGS = {  # scene.eevee attributes set by --eevee-fast, missing ones are skipped
+    "use_gtao": False,
+    "use_ssr": False,
+    "use_bloom": False,
+    "use_motion_blur": False,
+    "use_volumetric_lights": False,
+    "use_soft_shadows": False,
+    "shadow_cube_size": "512",
+    "shadow_cascade_size": "1024",
+}
+WARMUP_RESOLUTION_PERCENTAGE = 10  # Resolution of the shader warm-up render
 ARGS_DEFAULT_BBOX_MODE = "all"  # [BBOX_MODE_CPS, BBOX_MODE_XYZ, 'all']
 ARGS_DEFAULT_VIEW_MODE = "leftright"  # [leftright, center, topside]
 ARGS_DEFAULT_STDBBOX_CAM = "left"
@@ -0,0 +1,589 @@
+"""
+Derives bbox tables from the canonical pose table
+
+With --bbox pose, main.py only stores the pose of every fish, that is world location, euler
+rotation and scale, in the poses table. Everything that is the same for every image is stored
+once: bounding box and convex hull of every source object, camera parameters and the spawnbox.
+The cps, xyz, full, std and std_multi tables are functions of those, this file computes them
+for images that are not derived yet, in vectorized batches of images.
+
+This file does not depend on Blender, generate.py uses the projections from here.
+It is NOT meant to be run through Blender:
+
+python derive.py generated_data --tables bboxes_full bboxes_std
+
+Written by Naphat Amundsen
+"""
+
+import argparse
+import os
+import sqlite3 as db
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+import config as cng
+import iou3d
+from setup_db import LabelWriter, connect
+
+# Columns of the poses table after imgnr and class
+POSE_COLUMNS = ("x", "y", "z", "rx", "ry", "rz", "sx", "sy", "sz")
+
+CameraParams = Tuple[np.ndarray, np.ndarray, bool]  # See generate.get_camera_params
+
+
+class SceneConstants(NamedTuple):
+    """
+    Everything besides poses that is needed to derive labels, arrays of sources are row aligned
+    """
+
+    classes: np.ndarray  # (n_src,), numerical class of every source object
+    bbox_min: np.ndarray  # (n_src, 3), min corner of obj.bound_box, object local space
+    bbox_max: np.ndarray  # (n_src, 3), max corner of obj.bound_box, object local space
+    hulls: List[np.ndarray]  # (n_hull_points, 3) per source, object local space
+    cameras: Dict[str, CameraParams]  # Camera name -> parameters
+    spawnbox_location: np.ndarray  # (3,)
+    spawnbox_dimensions: np.ndarray  # (3,)
+
+
+def project_to_camera_frames(
+    co: np.ndarray, frames: np.ndarray, camera_persp: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    project_to_camera_frame for several cameras at once
+
+    Parameters
+    ----------
+    co : np.ndarray
+        (n_cameras, n, 3) coordinates in camera space of every camera
+    frames : np.ndarray
+        (n_cameras, 3, 3) frame of every camera, see project_to_camera_frame
+    camera_persp : np.ndarray
+        (n_cameras,) True if perspective camera, False if orthographic
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        x and y coordinates, relative to camera frame, both of size (n_cameras, n)
+    """
+    z = -co[..., 2]
+    persp = np.asarray(camera_persp, dtype=bool)[:, None]
+    frames = frames[:, None]  # Broadcasts over points
+
+    # Perspective frame point v is scaled by z / v.z, orthographic frames are used as they are
+    with np.errstate(divide="ignore", invalid="ignore"):
+        min_x = np.where(persp, frames[..., 1, 0] * z / frames[..., 1, 2], frames[..., 1, 0])
+        max_x = np.where(persp, frames[..., 2, 0] * z / frames[..., 2, 2], frames[..., 2, 0])
+        min_y = np.where(persp, frames[..., 0, 1] * z / frames[..., 0, 2], frames[..., 0, 1])
+        max_y = np.where(persp, frames[..., 1, 1] * z / frames[..., 1, 2], frames[..., 1, 1])
+        x = (co[..., 0] - min_x) / (max_x - min_x)
+        y = (co[..., 1] - min_y) / (max_y - min_y)
+
+    # Points in camera plane goes to center
+    at_camera = persp & (z == 0.0)
+    x[at_camera] = 0.5
+    y[at_camera] = 0.5
+    return x, y
+
+
+def project_to_camera_frame(
+    co: np.ndarray, frame: np.ndarray, camera_persp: bool
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized version of the per vertex projection in camera_view_bounds_2d
+
+    Parameters
+    ----------
+    co : np.ndarray
+        (n, 3) coordinates in camera space
+    frame : np.ndarray
+        (3, 3) first three points of camera.view_frame, negated, one point per row
+    camera_persp : bool
+        True if perspective camera, False if orthographic
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        x and y coordinates, relative to camera frame, both of size (n,)
+    """
+    x, y = project_to_camera_frames(co[None], frame[None], np.array([camera_persp]))
+    return x[0], y[0]
+
+
+def bounds_to_camera_frames(
+    co: np.ndarray, frames: np.ndarray, camera_persp: np.ndarray, starts: np.ndarray
+) -> np.ndarray:
+    """
+    2D bounding boxes of objects in several cameras, same as camera_view_bounds_2d for every
+    object and camera
+
+    camera_view_bounds_2d rescales its frame to the depth of every vertex in turn. A vertex in
+    the camera plane of a perspective camera adds the center of the frame, and is also projected
+    with the frame of the previous vertex of the object, or the frame as given if it is the first.
+    Those vertices are rare, so they are projected once more on their own.
+
+    Parameters
+    ----------
+    co : np.ndarray
+        (n_cameras, n, 3) coordinates in camera space of every camera, points of every object
+        after another
+    frames : np.ndarray
+        (n_cameras, 3, 3) frame of every camera, see project_to_camera_frame
+    camera_persp : np.ndarray
+        (n_cameras,) True if perspective camera, False if orthographic
+    starts : np.ndarray
+        (n_objects,) index of first point of every object
+
+    Returns
+    -------
+    np.ndarray
+        (n_cameras, n_objects, 4), rows are x, y, width, height, same as camera_view_bounds_2d
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    x, y = project_to_camera_frames(co, frames, camera_persp)
+    min_x = np.minimum.reduceat(x, starts, axis=1)
+    max_x = np.maximum.reduceat(x, starts, axis=1)
+    min_y = np.minimum.reduceat(y, starts, axis=1)
+    max_y = np.maximum.reduceat(y, starts, axis=1)
+
+    z = -co[..., 2]
+    in_plane = np.asarray(camera_persp, dtype=bool)[:, None] & (z == 0.0)
+    if in_plane.any():
+        n = z.shape[1]
+        objects = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, n)))
+        # Last point before every point that is not in the camera plane, within the object
+        previous = np.maximum.accumulate(np.where(in_plane, -1, np.arange(n)), axis=1)
+        cams, points = np.nonzero(in_plane)
+        previous = previous[cams, points]
+        has_previous = previous >= starts[objects[points]]
+
+        # Frame point v scaled by depth / v.z, the frame as given has scale 1
+        frame = frames[cams]
+        depth = z[cams, np.maximum(previous, 0)]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scale = np.where(has_previous[:, None], depth[:, None] / frame[:, :, 2], 1.0)
+        frame = frame * scale[:, :, None]
+        px = (co[cams, points, 0] - frame[:, 1, 0]) / (frame[:, 2, 0] - frame[:, 1, 0])
+        py = (co[cams, points, 1] - frame[:, 0, 1]) / (frame[:, 1, 1] - frame[:, 0, 1])
+
+        index = (cams, objects[points])
+        np.minimum.at(min_x, index, px)
+        np.maximum.at(max_x, index, px)
+        np.minimum.at(min_y, index, py)
+        np.maximum.at(max_y, index, py)
+
+    min_x = np.clip(min_x, 0.0, 1.0)
+    max_x = np.clip(max_x, 0.0, 1.0)
+    min_y = np.clip(min_y, 0.0, 1.0)
+    max_y = np.clip(max_y, 0.0, 1.0)
+
+    # Relative values
+    return np.stack((min_x, 1 - max_y, max_x - min_x, max_y - min_y), axis=2).round(4)
+
+
+def camera_numbers(names: Iterable[str]) -> Dict[str, int]:
+    """
+    Numerical camera in bboxes_std_multi of every camera name. Cameras in CAMERA_DICT keep
+    their number, other cameras are numbered after them in name order.
+
+    Returns
+    -------
+    Dict[str, int]
+        Camera name -> number, ordered by number
+    """
+    names = set(names)
+    numbers = {name: number for name, number in cng.CAMERA_DICT.items() if name in names}
+    start = max(cng.CAMERA_DICT.values()) + 1
+    for i, name in enumerate(sorted(names - numbers.keys())):
+        numbers[name] = start + i
+    return dict(sorted(numbers.items(), key=lambda item: item[1]))
+
+
+def object_indexes(imgnrs: np.ndarray) -> np.ndarray:
+    """
+    Index of every row within its image, rows of an image must be next to each other
+
+    Returns
+    -------
+    np.ndarray
+        (n,) 0 for the first row of every image, 1 for the second and so on
+    """
+    starts = np.flatnonzero(np.concatenate(([True], imgnrs[1:] != imgnrs[:-1])))
+    counts = np.diff(np.append(starts, len(imgnrs)))
+    return np.arange(len(imgnrs)) - np.repeat(starts, counts)
+
+
+def store_constants(cursor: db.Cursor, constants: SceneConstants) -> None:
+    """
+    Store constants, constants that are already stored must be equal to the given ones, since
+    labels of earlier images would otherwise be derived wrong. Does not commit.
+
+    Raises
+    ------
+    ValueError
+        If a stored constant differs from the given one
+    """
+    for class_, lo, hi, hull in zip(
+        constants.classes.tolist(), constants.bbox_min, constants.bbox_max, constants.hulls
+    ):
+        cursor.execute(
+            f"INSERT OR IGNORE INTO {cng.SOURCE_DB_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (class_, *lo.tolist(), *hi.tolist(), np.asarray(hull, dtype=np.float64).tobytes()),
+        )
+    for name, (cam_inv, frame, persp) in constants.cameras.items():
+        cursor.execute(
+            f"INSERT OR IGNORE INTO {cng.CAMERA_DB_TABLE} VALUES (?, ?, ?, ?)",
+            (name, cam_inv.astype(np.float64).tobytes(), frame.astype(np.float64).tobytes(), persp),
+        )
+    cursor.execute(
+        f"INSERT OR IGNORE INTO {cng.SPAWNBOX_DB_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (
+            cng.SPAWNBOX_OBJ,
+            *constants.spawnbox_location.tolist(),
+            *constants.spawnbox_dimensions.tolist(),
+        ),
+    )
+
+    stored = load_constants(cursor.connection)
+    order = np.searchsorted(stored.classes, constants.classes)
+    mismatches = []
+    if not (
+        np.allclose(stored.bbox_min[order], constants.bbox_min)
+        and np.allclose(stored.bbox_max[order], constants.bbox_max)
+        and all(
+            stored.hulls[i].shape == hull.shape and np.allclose(stored.hulls[i], hull)
+            for i, hull in zip(order, constants.hulls)
+        )
+    ):
+        mismatches.append("source objects")
+    for name, params in constants.cameras.items():
+        if not all(np.allclose(a, b) for a, b in zip(stored.cameras[name], params)):
+            mismatches.append(f"camera {name}")
+    if not (
+        np.allclose(stored.spawnbox_location, constants.spawnbox_location)
+        and np.allclose(stored.spawnbox_dimensions, constants.spawnbox_dimensions)
+    ):
+        mismatches.append("spawnbox")
+
+    if mismatches:
+        raise ValueError(
+            f"{', '.join(mismatches)} differ from the ones stored in the database, labels of "
+            "earlier images would be derived wrong. Use another --dir or --dbfile"
+        )
+
+
+def load_constants(con: db.Connection) -> SceneConstants:
+    """
+    Load constants stored by store_constants, sources are sorted by class
+    """
+    sources = con.execute(
+        f"SELECT * FROM {cng.SOURCE_DB_TABLE} ORDER BY {cng.BBOX_DB_CLASS}"
+    ).fetchall()
+    cameras = con.execute(f"SELECT * FROM {cng.CAMERA_DB_TABLE}").fetchall()
+    spawnbox = load_spawnbox(con)
+    if not sources or spawnbox is None:
+        raise ValueError("Database has no scene constants, were poses stored with --bbox pose?")
+
+    bboxes = np.array([row[1:7] for row in sources], dtype=np.float64)
+    return SceneConstants(
+        classes=np.array([row[0] for row in sources], dtype=np.int64),
+        bbox_min=bboxes[:, :3],
+        bbox_max=bboxes[:, 3:],
+        hulls=[np.frombuffer(row[7], dtype=np.float64).reshape(-1, 3) for row in sources],
+        cameras={
+            name: (
+                np.frombuffer(cam_inv, dtype=np.float64).reshape(4, 4),
+                np.frombuffer(frame, dtype=np.float64).reshape(3, 3),
+                bool(persp),
+            )
+            for name, cam_inv, frame, persp in cameras
+        },
+        spawnbox_location=spawnbox[0],
+        spawnbox_dimensions=spawnbox[1],
+    )
+
+
+def load_spawnbox(con: db.Connection) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Load spawnbox stored by store_constants
+
+    Returns
+    -------
+    Optional[Tuple[np.ndarray, np.ndarray]]
+        Location and dimensions of spawnbox, None if database has no spawnbox
+    """
+    try:
+        spawnbox = con.execute(
+            f"SELECT * FROM {cng.SPAWNBOX_DB_TABLE} WHERE name = ?", (cng.SPAWNBOX_OBJ,)
+        ).fetchone()
+    except db.OperationalError:
+        # Database from before spawnbox was stored
+        return None
+    if spawnbox is None:
+        return None
+    return (
+        np.array(spawnbox[1:4], dtype=np.float64),
+        np.array(spawnbox[4:7], dtype=np.float64),
+    )
+
+
+def source_rows(constants: SceneConstants, classes: np.ndarray) -> np.ndarray:
+    """Row of source object of every class in classes"""
+    rows = np.searchsorted(constants.classes, classes)
+    rows = np.minimum(rows, len(constants.classes) - 1)
+    unknown = constants.classes[rows] != classes
+    if unknown.any():
+        raise ValueError(f"Classes {np.unique(classes[unknown])} have no source object")
+    return rows
+
+
+def derive_cps(poses: np.ndarray, constants: SceneConstants) -> np.ndarray:
+    """
+    Corner points as in DatadumpVisitor.extract_labels_cps, that is obj.bound_box, which is
+    in object local space and only depends on the source object
+
+    Parameters
+    ----------
+    poses : np.ndarray
+        (n, 11) rows of the poses table
+
+    Returns
+    -------
+    np.ndarray
+        (n, 24)
+    """
+    rows = source_rows(constants, poses[:, 1].astype(np.int64))
+    lo, hi = constants.bbox_min[rows], constants.bbox_max[rows]
+    # UNIT_CORNERS is in bound_box order, -1 picks min and 1 picks max
+    corners = lo[:, None] + (iou3d.UNIT_CORNERS + 1) / 2 * (hi - lo)[:, None]
+    return corners.reshape(len(poses), 24)
+
+
+def derive_xyz(poses: np.ndarray, constants: SceneConstants) -> np.ndarray:
+    """
+    obj.dimensions, bound box extents scaled by object scale
+
+    Returns
+    -------
+    np.ndarray
+        (n, 3)
+    """
+    rows = source_rows(constants, poses[:, 1].astype(np.int64))
+    return np.abs((constants.bbox_max[rows] - constants.bbox_min[rows]) * poses[:, 8:11])
+
+
+def derive_full(poses: np.ndarray, constants: SceneConstants) -> np.ndarray:
+    """
+    Location relative to spawnbox, dimensions and normalized rotations as in
+    DatadumpVisitor.extract_labels_full, see generate.change_to_spawnbox_coords and
+    generate.normalize_rotations
+
+    Returns
+    -------
+    np.ndarray
+        (n, 9)
+    """
+    locs = (poses[:, 2:5] - constants.spawnbox_location) / constants.spawnbox_dimensions * 2
+    rots = (poses[:, 5:8] / (2 * np.pi)) % 1
+    return np.concatenate((locs, derive_xyz(poses, constants), rots), axis=1)
+
+
+def derive_std_cameras(
+    poses: np.ndarray, constants: SceneConstants, cameras: Sequence[str]
+) -> np.ndarray:
+    """
+    2D bounding boxes as in DatadumpVisitor.extract_labels_std, by projecting the convex hull
+    of the source object of every fish. Fish of the same class are projected in one go, to every
+    camera at once with stacked camera matrices.
+
+    Parameters
+    ----------
+    cameras : Sequence[str]
+        Names of camera objects, must be in the cameras table
+
+    Returns
+    -------
+    np.ndarray
+        (n_cameras, n, 4), rows are x, y, width, height, same as camera_view_bounds_2d
+    """
+    for camera in cameras:
+        if camera not in constants.cameras:
+            raise ValueError(f"Camera {camera} is not stored, got {list(constants.cameras)}")
+    cam_invs, frames, camera_persp = (
+        np.array(params) for params in zip(*(constants.cameras[camera] for camera in cameras))
+    )
+
+    # matrix_world is translation @ rotation @ scale
+    linear = iou3d.euler_to_matrix(poses[:, 5:8]) * poses[:, None, 8:11]
+
+    rows = source_rows(constants, poses[:, 1].astype(np.int64))
+    boxes = np.empty((len(cameras), len(poses), 4))
+    for row in np.unique(rows):
+        mask = rows == row
+        hull = constants.hulls[row]
+        world = np.einsum("kj,nij->nki", hull, linear[mask]) + poses[mask, None, 2:5]
+        co = np.einsum("cij,nkj->cnki", cam_invs[:, :3, :3], world) + cam_invs[:, None, None, :3, 3]
+        starts = np.arange(0, mask.sum() * len(hull), len(hull))
+        boxes[:, mask] = bounds_to_camera_frames(
+            co.reshape(len(cameras), -1, 3), frames, camera_persp, starts
+        )
+
+    return boxes
+
+
+def derive_std(poses: np.ndarray, constants: SceneConstants, camera: str) -> np.ndarray:
+    """
+    2D bounding boxes in given camera, see derive_std_cameras
+
+    Returns
+    -------
+    np.ndarray
+        (n, 4), rows are x, y, width, height, same as camera_view_bounds_2d
+    """
+    return derive_std_cameras(poses, constants, (camera,))[0]
+
+
+def derive_std_multi(poses: np.ndarray, constants: SceneConstants) -> np.ndarray:
+    """
+    2D bounding boxes in every stored camera, as in the std_multi mode of DatadumpVisitor
+
+    Returns
+    -------
+    np.ndarray
+        (n_cameras, n, 6), numerical camera, object index within image, x, y, width, height
+    """
+    numbers = camera_numbers(constants.cameras)
+    boxes = np.empty((len(numbers), len(poses), 6))
+    boxes[:, :, 0] = np.array(list(numbers.values()))[:, None]
+    boxes[:, :, 1] = object_indexes(poses[:, 0])
+    boxes[:, :, 2:] = derive_std_cameras(poses, constants, list(numbers))
+    return boxes
+
+
+def derivers(camera: str) -> Dict[str, Callable[[np.ndarray, SceneConstants], np.ndarray]]:
+    """Derive function of every derivable table"""
+    return {
+        cng.BBOX_DB_TABLE_CPS: derive_cps,
+        cng.BBOX_DB_TABLE_XYZ: derive_xyz,
+        cng.BBOX_DB_TABLE_FULL: derive_full,
+        cng.BBOX_DB_TABLE_STD: lambda poses, constants: derive_std(poses, constants, camera),
+        cng.BBOX_DB_TABLE_STD_MULTI: derive_std_multi,
+    }
+
+
+def pending_imgnrs(con: db.Connection, table: str) -> np.ndarray:
+    """
+    Returns
+    -------
+    np.ndarray
+        Sorted imgnrs that have poses but no rows in table
+    """
+    imgnr = cng.BBOX_DB_IMGRNR
+    res = con.execute(
+        f"SELECT DISTINCT {imgnr} FROM {cng.BBOX_DB_TABLE_POSE} "
+        f"WHERE {imgnr} NOT IN (SELECT {imgnr} FROM {table}) ORDER BY {imgnr}"
+    ).fetchall()
+    return np.array([x[0] for x in res], dtype=np.int64)
+
+
+def derive_tables(
+    con: db.Connection,
+    tables: Sequence[str],
+    camera: str = cng.CAMERA_OBJ_LEFT,
+    chunk_imgs: int = cng.DERIVE_CHUNK_IMGS,
+) -> Dict[str, int]:
+    """
+    Derive rows of given tables for images that have poses but are missing in the table.
+    Every chunk of images is written in one transaction.
+
+    Parameters
+    ----------
+    con : db.Connection
+        Writable connection, tables must exist
+    tables : Sequence[str]
+        Tables to derive, any of bboxes_cps, bboxes_xyz, bboxes_full, bboxes_std,
+        bboxes_std_multi
+    camera : str, optional
+        Camera for bboxes_std, by default the left camera
+    chunk_imgs : int, optional
+        Images derived at a time
+
+    Returns
+    -------
+    Dict[str, int]
+        Number of rows derived per table
+    """
+    constants = load_constants(con)
+    funcs = derivers(camera)
+    pending = {table: pending_imgnrs(con, table) for table in tables}
+    imgnrs = np.unique(np.concatenate([np.empty(0, dtype=np.int64), *pending.values()]))
+
+    writer = LabelWriter(con)
+    n_rows = {table: 0 for table in tables}
+    for start in range(0, len(imgnrs), chunk_imgs):
+        chunk = imgnrs[start : start + chunk_imgs]
+        poses = con.execute(
+            f"SELECT * FROM {cng.BBOX_DB_TABLE_POSE} "
+            f"WHERE {cng.BBOX_DB_IMGRNR} BETWEEN ? AND ?",
+            (int(chunk[0]), int(chunk[-1])),
+        ).fetchall()
+        poses = np.array(poses, dtype=np.float64).reshape(-1, 2 + len(POSE_COLUMNS))
+
+        for table in tables:
+            rows = poses[np.isin(poses[:, 0], pending[table])]
+            if len(rows) == 0:
+                continue
+            values = funcs[table](rows, constants)
+            # bboxes_std_multi has a row per camera and fish, values are (n_cameras, n, ...)
+            repeats = 1 if values.ndim == 2 else len(values)
+            writer.add(
+                table,
+                np.tile(rows[:, 0].astype(np.int64), repeats),
+                np.tile(rows[:, 1], repeats),
+                values.reshape(-1, values.shape[-1]),
+            )
+            n_rows[table] += len(rows) * repeats
+        writer.flush()
+        print(f"Derived images {chunk[0]} to {chunk[-1]}")
+
+    return n_rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Derive bbox tables from poses table")
+    parser.add_argument(
+        "dir",
+        help=f"Directory of generated data, default: {cng.GENERATED_DATA_DIR}",
+        nargs="?",
+        default=cng.GENERATED_DATA_DIR,
+    )
+    parser.add_argument(
+        "--dbfile",
+        help=f"Name of sqlite3 database file in dir, default: {cng.BBOX_DB_FILE}",
+        default=cng.BBOX_DB_FILE,
+    )
+    parser.add_argument(
+        "--tables",
+        help="Tables to derive, default: every derivable table",
+        nargs="*",
+        choices=tuple(derivers("").keys()),
+        default=tuple(derivers("").keys()),
+    )
+    parser.add_argument(
+        "--camera",
+        help=f"Name of camera for {cng.BBOX_DB_TABLE_STD}, default: {cng.CAMERA_OBJ_LEFT}",
+        default=cng.CAMERA_OBJ_LEFT,
+    )
+    parser.add_argument(
+        "--chunk-imgs",
+        help=f"Images derived at a time, default: {cng.DERIVE_CHUNK_IMGS}",
+        type=int,
+        default=cng.DERIVE_CHUNK_IMGS,
+    )
+    args = parser.parse_args()
+
+    con = connect(os.path.join(args.dir, args.dbfile))
+    n_rows = derive_tables(con, args.tables, args.camera, args.chunk_imgs)
+    for table, n in n_rows.items():
+        print(f"Derived {n} rows into {table}")
+    con.close()
@@ -0,0 +1,300 @@
+"""
+Asynchronous encoding of rendered images
+
+With --encode, Blender writes uncompressed BMP files, which is close to free, and the render
+loop hands them to an EncodePool. The pool decodes them and encodes them to PNG, WebP or JPEG
+in background workers while the next images are rendered, so render throughput does not depend
+on image encoding. The pool holds a bounded number of pending files, the render loop blocks when
+it is full instead of piling up raw images on disk.
+
+PNG is encoded with NumPy and zlib only. WebP and JPEG need Pillow, which is only imported when
+those formats are used.
+
+Files are written to a temporary name and renamed when complete, so an image either exists
+fully or not at all. Raw files left behind by a crash can be encoded afterwards, this file is
+NOT meant to be run through Blender:
+
+python encode.py generated_data/images --format WEBP
+
+Written by Naphat Amundsen
+"""
+
+import argparse
+import glob
+import io
+import os
+import struct
+import threading
+import zlib
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Optional
+
+import numpy as np
+
+import config as cng
+
+
+def read_bmp(path: str) -> np.ndarray:
+    """
+    Read uncompressed 24 or 32 bit BMP file, as written by Blender
+
+    Returns
+    -------
+    np.ndarray
+        (height, width, 3 or 4) uint8, RGB(A), top row first
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:2] != b"BM":
+        raise ValueError(f"{path} is not a BMP file")
+
+    offset = struct.unpack_from("<I", data, 10)[0]
+    width, height = struct.unpack_from("<ii", data, 18)
+    bpp, compression = struct.unpack_from("<HI", data, 28)
+    # Compression 3 (bitfields) is used for 32 bit BGRA, which is laid out as uncompressed
+    if bpp not in (24, 32) or compression not in (0, 3):
+        raise ValueError(f"{path} is not an uncompressed 24 or 32 bit BMP")
+
+    channels = bpp // 8
+    stride = (width * channels + 3) & ~3  # Rows are padded to 4 bytes
+    n_rows = abs(height)
+    rows = np.frombuffer(data, dtype=np.uint8, count=stride * n_rows, offset=offset)
+    pixels = rows.reshape(n_rows, stride)[:, : width * channels].reshape(n_rows, width, channels)
+
+    # Positive height means bottom row first, pixels are BGR(A)
+    if height > 0:
+        pixels = pixels[::-1]
+    order = [2, 1, 0, 3][:channels]
+    return np.ascontiguousarray(pixels[:, :, order])
+
+
+def encode_png(pixels: np.ndarray, level: int = cng.ENCODE_PNG_LEVEL) -> bytes:
+    """
+    Encode 8 bit RGB or RGBA pixels as PNG. Every row uses the Sub filter, which is vectorized
+    over the whole image and compresses rendered images well.
+
+    Parameters
+    ----------
+    pixels : np.ndarray
+        (height, width, 3 or 4) uint8
+    level : int, optional
+        zlib compression level
+
+    Returns
+    -------
+    bytes
+        PNG file
+    """
+    height, width, channels = pixels.shape
+    color_type = {3: 2, 4: 6}[channels]
+
+    # Sub filter: every byte minus the byte of the same channel in the pixel to the left
+    rows = pixels.reshape(height, width * channels)
+    filtered = np.empty((height, width * channels + 1), dtype=np.uint8)
+    filtered[:, 0] = 1  # Filter type of row
+    filtered[:, 1 : channels + 1] = rows[:, :channels]
+    np.subtract(rows[:, channels:], rows[:, :-channels], out=filtered[:, channels + 1 :])
+
+    def chunk(tag: bytes, body: bytes) -> bytes:
+        return struct.pack(">I", len(body)) + tag + body + struct.pack(">I", zlib.crc32(tag + body))
+
+    return b"".join(
+        (
+            b"\x89PNG\r\n\x1a\n",
+            chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)),
+            chunk(b"IDAT", zlib.compress(filtered.tobytes(), level)),
+            chunk(b"IEND", b""),
+        )
+    )
+
+
+def check_format(fileformat: str) -> None:
+    """
+    Raises ValueError for unknown formats, and ImportError if the format needs Pillow and Pillow
+    is not installed, so missing dependencies are found before rendering
+    """
+    if fileformat not in cng.ENCODE_FORMATS:
+        raise ValueError(f"Got invalid format {fileformat}, available: {list(cng.ENCODE_FORMATS)}")
+    if fileformat != "PNG":
+        try:
+            import PIL.Image  # noqa: F401
+        except ImportError as e:
+            raise ImportError(
+                f"Encoding {fileformat} needs Pillow, install it for the Python interpreter "
+                "running the render loop (for Blender, the Python bundled with Blender)"
+            ) from e
+
+
+def encode_image(pixels: np.ndarray, fileformat: str, quality: int = cng.ENCODE_QUALITY) -> bytes:
+    """
+    Encode pixels as given format, see cng.ENCODE_FORMATS
+
+    Parameters
+    ----------
+    pixels : np.ndarray
+        (height, width, 3 or 4) uint8
+    quality : int, optional
+        Quality of WebP and JPEG, PNG is lossless
+
+    Returns
+    -------
+    bytes
+        Encoded file
+    """
+    if fileformat == "PNG":
+        return encode_png(pixels)
+
+    import PIL.Image
+
+    if fileformat == "JPEG":
+        pixels = pixels[:, :, :3]  # JPEG has no alpha
+    buffer = io.BytesIO()
+    PIL.Image.fromarray(pixels).save(buffer, format=fileformat, quality=quality)
+    return buffer.getvalue()
+
+
+def encode_file(raw_path: str, path: str, fileformat: str, quality: int = cng.ENCODE_QUALITY) -> str:
+    """
+    Encode raw file to path and remove raw file. Runs in the workers of EncodePool.
+
+    Returns
+    -------
+    str
+        path
+    """
+    data = encode_image(read_bmp(raw_path), fileformat, quality)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    os.remove(raw_path)
+    return path
+
+
+class EncodePool:
+    """
+    Encodes raw files in background workers with a bounded number of pending files. submit
+    blocks while max_pending files are pending, so a slow encoder slows down the render loop
+    instead of filling the disk with raw files.
+
+    Threads are used by default, zlib and Pillow release the GIL while encoding so they run in
+    parallel with each other and with Blender. Processes can be used outside of Blender, where
+    sys.executable is a Python interpreter.
+    """
+
+    def __init__(
+        self,
+        fileformat: str,
+        workers: Optional[int] = None,
+        max_pending: Optional[int] = None,
+        quality: int = cng.ENCODE_QUALITY,
+        processes: bool = False,
+    ):
+        """
+        Parameters
+        ----------
+        fileformat : str
+            PNG, WEBP or JPEG
+        workers : Optional[int]
+            Number of workers, defaults to value in config file
+        max_pending : Optional[int]
+            Max files submitted but not encoded, defaults to value in config file
+        quality : int, optional
+            Quality of WebP and JPEG
+        processes : bool, optional
+            Use a process pool instead of threads
+        """
+        check_format(fileformat)
+        self.fileformat: str = fileformat
+        self.quality: int = quality
+        workers = cng.ENCODE_WORKERS if workers is None else workers
+        max_pending = cng.ENCODE_MAX_PENDING if max_pending is None else max_pending
+
+        self.executor: Executor = (
+            ProcessPoolExecutor(workers) if processes else ThreadPoolExecutor(workers)
+        )
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.futures: List[Future] = []
+        self.n_encoded: int = 0
+
+    @property
+    def extension(self) -> str:
+        """File extension of encoded files"""
+        return cng.ENCODE_FORMATS[self.fileformat]
+
+    def _release(self, future: Future) -> None:
+        self.slots.release()
+
+    def check(self) -> None:
+        """
+        Raise error of the first failed encoding that is done, and forget finished futures
+        """
+        pending = []
+        for future in self.futures:
+            if future.done():
+                future.result()
+                self.n_encoded += 1
+            else:
+                pending.append(future)
+        self.futures = pending
+
+    def submit(self, raw_path: str, path: str) -> None:
+        """
+        Encode raw_path to path in background, blocks while the pool is full
+        """
+        self.check()
+        self.slots.acquire()
+        future = self.executor.submit(encode_file, raw_path, path, self.fileformat, self.quality)
+        future.add_done_callback(self._release)
+        self.futures.append(future)
+
+    def drain(self) -> None:
+        """
+        Wait until every submitted file is encoded, raises error of failed encodings
+        """
+        for future in self.futures:
+            future.result()
+        self.check()
+
+    def close(self) -> None:
+        """Drain and shut down workers"""
+        try:
+            self.drain()
+        finally:
+            self.executor.shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Encode raw images left in image directory")
+    parser.add_argument(
+        "dir",
+        help=f"Image directory, default: {os.path.join(cng.GENERATED_DATA_DIR, cng.IMAGE_DIR)}",
+        nargs="?",
+        default=os.path.join(cng.GENERATED_DATA_DIR, cng.IMAGE_DIR),
+    )
+    parser.add_argument(
+        "--format",
+        help="Format to encode to, default: PNG",
+        choices=tuple(cng.ENCODE_FORMATS),
+        default="PNG",
+    )
+    parser.add_argument(
+        "--quality",
+        help=f"WebP and JPEG quality, default: {cng.ENCODE_QUALITY}",
+        type=int,
+        default=cng.ENCODE_QUALITY,
+    )
+    parser.add_argument(
+        "--workers",
+        help="Number of worker processes, default: number of CPUs",
+        type=int,
+        default=os.cpu_count(),
+    )
+    args = parser.parse_args()
+
+    pool = EncodePool(args.format, args.workers, 4 * args.workers, args.quality, processes=True)
+    raw_paths = sorted(glob.glob(os.path.join(args.dir, "*" + cng.ENCODE_RAW_EXTENSION)))
+    for raw_path in raw_paths:
+        pool.submit(raw_path, raw_path[: -len(cng.ENCODE_RAW_EXTENSION)] + pool.extension)
+    pool.close()
+    print(f"Encoded {pool.n_encoded} raw image(s) in {args.dir} to {args.format}")
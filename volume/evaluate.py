@@ -0,0 +1,375 @@
+"""
+Headless evaluation of 3D predictions against bboxes_full ground truth
+
+Predictions are a CSV file (or sqlite3 database with a bboxes_full table) with the columns
+of bboxes_full, that is imgnr, class_, x, y, z, w, l, h, rx, ry, rz, and optionally a
+confidence column used to rank predictions. Predictions are staged into a temporary SQLite
+table, then predictions and ground truth are streamed in chunks of images. Boxes are
+matched per image and class with 3D IoU (see iou3d.py), greedily in order of confidence,
+and AP and recall are computed per class.
+
+This file is NOT meant to be run through Blender:
+
+python evaluate.py predictions.csv --dir generated_data --iou 0.5
+
+Written by Naphat Amundsen
+"""
+
+import argparse
+import json
+import os
+import sqlite3 as db
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+import config as cng
+import derive
+import iou3d
+from setup_db import connect
+
+FULL_COLUMNS = ("x", "y", "z", "w", "l", "h", "rx", "ry", "rz")
+PRED_TABLE = "predictions"  # Temporary table holding staged predictions
+
+
+def stage_predictions(con: db.Connection, predfile: str, chunksize: int) -> bool:
+    """
+    Copy predictions into temporary table PRED_TABLE, indexed on imgnr
+
+    Returns
+    -------
+    bool
+        True if predictions have a confidence column
+    """
+    columns = (cng.BBOX_DB_IMGRNR, cng.BBOX_DB_CLASS, *FULL_COLUMNS)
+    con.execute(
+        f"CREATE TEMP TABLE {PRED_TABLE} ("
+        f"{cng.BBOX_DB_IMGRNR} INTEGER, {cng.BBOX_DB_CLASS} INTEGER, "
+        + ", ".join(f"{c} REAL" for c in FULL_COLUMNS)
+        + f", {cng.EVAL_SCORE_COLUMN} REAL)"
+    )
+    insert = f"INSERT INTO {PRED_TABLE} VALUES ({', '.join('?' * (len(columns) + 1))})"
+
+    if predfile.endswith(".db"):
+        src = db.connect(f"file:{predfile}?mode=ro", uri=True)
+        src_columns = [x[1] for x in src.execute(f"PRAGMA table_info({cng.BBOX_DB_TABLE_FULL})")]
+        has_score = cng.EVAL_SCORE_COLUMN in src_columns
+        score = cng.EVAL_SCORE_COLUMN if has_score else "1.0"
+        cursor = src.execute(f"SELECT {', '.join(columns)}, {score} FROM {cng.BBOX_DB_TABLE_FULL}")
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if not rows:
+                break
+            con.executemany(insert, rows)
+        src.close()
+    else:
+        has_score = False
+        for chunk in pd.read_csv(predfile, chunksize=chunksize):
+            has_score = cng.EVAL_SCORE_COLUMN in chunk.columns
+            if not has_score:
+                chunk[cng.EVAL_SCORE_COLUMN] = 1.0
+            chunk = chunk[[*columns, cng.EVAL_SCORE_COLUMN]]
+            con.executemany(insert, chunk.itertuples(index=False, name=None))
+
+    con.execute(f"CREATE INDEX temp.{PRED_TABLE}_imgnr_idx ON {PRED_TABLE} ({cng.BBOX_DB_IMGRNR})")
+    con.commit()
+    return has_score
+
+
+def iter_chunks(
+    con: db.Connection, imgnrs: np.ndarray, chunk_imgs: int
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Yields predictions and ground truth of chunk_imgs images at a time
+
+    Yields
+    ------
+    Tuple[np.ndarray, np.ndarray]
+        (n_pred, 12) and (n_gt, 11) rows, columns as in tables, predictions have confidence last
+    """
+    columns = ", ".join((cng.BBOX_DB_IMGRNR, cng.BBOX_DB_CLASS, *FULL_COLUMNS))
+    for start in range(0, len(imgnrs), chunk_imgs):
+        chunk = imgnrs[start : start + chunk_imgs]
+        lo, hi = int(chunk[0]), int(chunk[-1])
+        where = f"WHERE {cng.BBOX_DB_IMGRNR} BETWEEN ? AND ?"
+        preds = con.execute(
+            f"SELECT {columns}, {cng.EVAL_SCORE_COLUMN} FROM {PRED_TABLE} {where}", (lo, hi)
+        ).fetchall()
+        gts = con.execute(
+            f"SELECT {columns} FROM {cng.BBOX_DB_TABLE_FULL} {where}", (lo, hi)
+        ).fetchall()
+        preds = np.array(preds, dtype=np.float64).reshape(-1, 12)
+        gts = np.array(gts, dtype=np.float64).reshape(-1, 11)
+        # Range may cover images that are not evaluated
+        yield preds[np.isin(preds[:, 0], chunk)], gts[np.isin(gts[:, 0], chunk)]
+
+
+def match_chunk(
+    preds: np.ndarray,
+    gts: np.ndarray,
+    iou_threshold: float,
+    n_classes: int,
+    spawnbox_location: np.ndarray,
+    spawnbox_dimensions: np.ndarray,
+) -> np.ndarray:
+    """
+    Match predictions with ground truth of same image and class, greedily in order of
+    confidence. A prediction is a true positive if it matches an unmatched ground truth box
+    with IoU >= iou_threshold, the ground truth box with highest IoU is used.
+
+    Parameters
+    ----------
+    preds : np.ndarray
+        (n_pred, 12), see iter_chunks
+    gts : np.ndarray
+        (n_gt, 11), see iter_chunks
+    iou_threshold : float
+    n_classes : int
+        Number of classes, larger than every class in preds and gts
+    spawnbox_location, spawnbox_dimensions : np.ndarray
+        Spawnbox used to decode locations, see iou3d.decode_full
+
+    Returns
+    -------
+    np.ndarray
+        (n_pred,) boolean, True for true positives
+    """
+    tp = np.zeros(len(preds), dtype=bool)
+    if len(preds) == 0 or len(gts) == 0:
+        return tp
+
+    # Group key of every box is (imgnr, class)
+    pred_key = preds[:, 0].astype(np.int64) * n_classes + preds[:, 1].astype(np.int64)
+    gt_key = gts[:, 0].astype(np.int64) * n_classes + gts[:, 1].astype(np.int64)
+    gt_order = np.argsort(gt_key, kind="stable")
+    gt_key = gt_key[gt_order]
+
+    # Every prediction paired with every ground truth box in its group
+    lo = np.searchsorted(gt_key, pred_key, side="left")
+    n_pairs = np.searchsorted(gt_key, pred_key, side="right") - lo
+    pair_pred = np.repeat(np.arange(len(preds)), n_pairs)
+    offsets = np.arange(len(pair_pred)) - np.repeat(np.cumsum(n_pairs) - n_pairs, n_pairs)
+    pair_gt = gt_order[np.repeat(lo, n_pairs) + offsets]
+
+    decoded_pred = iou3d.decode_full(preds[:, 2:11], spawnbox_location, spawnbox_dimensions)
+    decoded_gt = iou3d.decode_full(gts[:, 2:], spawnbox_location, spawnbox_dimensions)
+    ious = iou3d.paired_iou(
+        tuple(x[pair_pred] for x in decoded_pred), tuple(x[pair_gt] for x in decoded_gt)
+    )
+
+    # Rank of every prediction within its group, by descending confidence
+    order = np.lexsort((-preds[:, 11], pred_key))
+    sorted_key = pred_key[order]
+    group_start = np.searchsorted(sorted_key, sorted_key, side="left")
+    rank = np.empty(len(preds), dtype=np.int64)
+    rank[order] = np.arange(len(preds)) - group_start
+
+    # Round r matches the r-th prediction of every group, there is at most one prediction
+    # per group in a round, so predictions in a round never compete for the same box
+    candidate = ious >= iou_threshold
+    gt_matched = np.zeros(len(gts), dtype=bool)
+    for r in range(int(rank.max()) + 1):
+        active = np.flatnonzero(candidate & (rank[pair_pred] == r) & ~gt_matched[pair_gt])
+        if len(active) == 0:
+            continue
+        # Highest IoU per prediction
+        active = active[np.lexsort((-ious[active], pair_pred[active]))]
+        first = np.unique(pair_pred[active], return_index=True)[1]
+        best = active[first]
+        tp[pair_pred[best]] = True
+        gt_matched[pair_gt[best]] = True
+
+    return tp
+
+
+def average_precision(scores: np.ndarray, tp: np.ndarray, n_gt: int) -> Tuple[float, float]:
+    """
+    All point interpolated average precision (area under precision envelope) and recall
+
+    Returns
+    -------
+    Tuple[float, float]
+        AP and recall, both nan if there is no ground truth
+    """
+    if n_gt == 0:
+        return float("nan"), float("nan")
+    if len(scores) == 0:
+        return 0.0, 0.0
+
+    order = np.argsort(-scores, kind="stable")
+    cum_tp = np.cumsum(tp[order])
+    # Only evaluate at the last prediction of every distinct score, ties are one threshold
+    sorted_scores = scores[order]
+    ends = np.append(np.flatnonzero(np.diff(sorted_scores)), len(order) - 1)
+    precision = cum_tp[ends] / (ends + 1)
+    recall = cum_tp[ends] / n_gt
+
+    # Precision envelope, max precision at any higher recall
+    precision = np.maximum.accumulate(precision[::-1])[::-1]
+    recall_steps = np.diff(np.concatenate(([0.0], recall)))
+    return float((recall_steps * precision).sum()), float(recall[-1])
+
+
+def evaluate(
+    gt_file: str,
+    predfile: str,
+    iou_threshold: float = cng.EVAL_IOU_THRESHOLD,
+    imgrange: Optional[Tuple[int, int]] = None,
+    spawnbox_location: Optional[np.ndarray] = None,
+    spawnbox_dimensions: Optional[np.ndarray] = None,
+    chunk_imgs: int = cng.EVAL_CHUNK_IMGS,
+) -> Dict[str, Dict[str, float]]:
+    """
+    Evaluate predictions against ground truth, see module docstring
+
+    Parameters
+    ----------
+    gt_file : str
+        sqlite3 database with bboxes_full table
+    predfile : str
+        CSV file or sqlite3 database with predictions
+    iou_threshold : float, optional
+    imgrange : Optional[Tuple[int, int]], optional
+        Evaluate images in [imgrange[0], imgrange[1]), images without predictions count as
+        well. By default, only images with predictions are evaluated
+    spawnbox_location, spawnbox_dimensions : Optional[np.ndarray], optional
+        Spawnbox used to decode locations, see iou3d.decode_full. By default, the spawnbox
+        stored in gt_file is used
+    chunk_imgs : int, optional
+        Images evaluated at a time
+
+    Returns
+    -------
+    Dict[str, Dict[str, float]]
+        class name -> {"ap", "recall", "n_gt", "n_pred"}, and "mean" -> {"ap", "recall"}
+    """
+    con = connect(gt_file, readonly=True)
+    if spawnbox_location is None or spawnbox_dimensions is None:
+        spawnbox = derive.load_spawnbox(con)
+        if spawnbox is None:
+            con.close()
+            raise ValueError(
+                f"{gt_file} has no stored spawnbox, give spawnbox location and dimensions "
+                "(--spawnbox-location and --spawnbox-dimensions)"
+            )
+        if spawnbox_location is None:
+            spawnbox_location = spawnbox[0]
+        if spawnbox_dimensions is None:
+            spawnbox_dimensions = spawnbox[1]
+    print(f"Spawnbox location {spawnbox_location}, dimensions {spawnbox_dimensions}")
+
+    has_score = stage_predictions(con, predfile, cng.EVAL_STAGE_ROWS)
+    if not has_score:
+        print(f"Predictions have no {cng.EVAL_SCORE_COLUMN} column, AP will be precision * recall")
+
+    if imgrange is None:
+        query = f"SELECT DISTINCT {cng.BBOX_DB_IMGRNR} FROM {PRED_TABLE}"
+        params: Sequence[int] = ()
+    else:
+        query = (
+            f"SELECT {cng.BBOX_DB_IMGRNR} FROM {cng.BBOX_DB_TABLE_FULL} "
+            f"WHERE {cng.BBOX_DB_IMGRNR} >= ? AND {cng.BBOX_DB_IMGRNR} < ? "
+            f"UNION SELECT {cng.BBOX_DB_IMGRNR} FROM {PRED_TABLE} "
+            f"WHERE {cng.BBOX_DB_IMGRNR} >= ? AND {cng.BBOX_DB_IMGRNR} < ?"
+        )
+        params = (*imgrange, *imgrange)
+    imgnrs = np.sort(np.array([x[0] for x in con.execute(query, params)], dtype=np.int64))
+    print(f"Evaluating {len(imgnrs)} images with IoU threshold {iou_threshold}")
+
+    n_classes = max(cng.CLASS_DICT.values()) + 1
+    scores: List[List[np.ndarray]] = [[] for _ in range(n_classes)]
+    tps: List[List[np.ndarray]] = [[] for _ in range(n_classes)]
+    n_gt = np.zeros(n_classes, dtype=np.int64)
+
+    for preds, gts in iter_chunks(con, imgnrs, chunk_imgs):
+        tp = match_chunk(
+            preds, gts, iou_threshold, n_classes, spawnbox_location, spawnbox_dimensions
+        )
+        pred_classes = preds[:, 1].astype(np.int64)
+        for c in range(n_classes):
+            mask = pred_classes == c
+            scores[c].append(preds[mask, 11])
+            tps[c].append(tp[mask])
+        n_gt += np.bincount(gts[:, 1].astype(np.int64), minlength=n_classes)[:n_classes]
+    con.close()
+
+    results: Dict[str, Dict[str, float]] = {}
+    for name, c in cng.CLASS_DICT.items():
+        class_scores = np.concatenate(scores[c]) if scores[c] else np.empty(0)
+        class_tp = np.concatenate(tps[c]) if tps[c] else np.empty(0, dtype=bool)
+        ap, recall = average_precision(class_scores, class_tp, int(n_gt[c]))
+        results[name] = {"ap": ap, "recall": recall, "n_gt": int(n_gt[c]), "n_pred": len(class_scores)}
+
+    results["mean"] = {
+        "ap": float(np.nanmean([results[name]["ap"] for name in cng.CLASS_DICT])),
+        "recall": float(np.nanmean([results[name]["recall"] for name in cng.CLASS_DICT])),
+    }
+    return results
+
+
+def print_results(results: Dict[str, Dict[str, float]]) -> None:
+    print(f"{'class':<12}{'AP':>8}{'recall':>8}{'n_gt':>10}{'n_pred':>10}")
+    for name in cng.CLASS_DICT:
+        r = results[name]
+        print(f"{name:<12}{r['ap']:>8.3f}{r['recall']:>8.3f}{r['n_gt']:>10}{r['n_pred']:>10}")
+    print(f"{'mean':<12}{results['mean']['ap']:>8.3f}{results['mean']['recall']:>8.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate 3D predictions against bboxes_full")
+    parser.add_argument("predfile", help="Predictions, .csv or .db (sqlite3) file")
+    parser.add_argument(
+        "--dir",
+        help=f"Directory of generated data, default: {cng.GENERATED_DATA_DIR}",
+        default=cng.GENERATED_DATA_DIR,
+    )
+    parser.add_argument(
+        "--iou",
+        help=f"IoU threshold, default: {cng.EVAL_IOU_THRESHOLD}",
+        type=float,
+        default=cng.EVAL_IOU_THRESHOLD,
+    )
+    parser.add_argument(
+        "--imgrange",
+        help="Evaluate every image in [start, end), default: only images with predictions",
+        type=int,
+        nargs=2,
+    )
+    parser.add_argument(
+        "--spawnbox-location",
+        help=f"Center of spawnbox, default: from {cng.SPAWNBOX_DB_TABLE} table of ground truth",
+        type=float,
+        nargs=3,
+    )
+    parser.add_argument(
+        "--spawnbox-dimensions",
+        help=f"Dimensions of spawnbox, default: from {cng.SPAWNBOX_DB_TABLE} table of ground truth",
+        type=float,
+        nargs=3,
+    )
+    parser.add_argument(
+        "--chunk-imgs",
+        help=f"Images evaluated at a time, default: {cng.EVAL_CHUNK_IMGS}",
+        type=int,
+        default=cng.EVAL_CHUNK_IMGS,
+    )
+    parser.add_argument("--out", help="Write results to JSON file", type=str)
+    args = parser.parse_args()
+
+    results = evaluate(
+        os.path.join(args.dir, cng.BBOX_DB_FILE),
+        args.predfile,
+        iou_threshold=args.iou,
+        imgrange=args.imgrange,
+        spawnbox_location=None if args.spawnbox_location is None else np.array(args.spawnbox_location),
+        spawnbox_dimensions=None
+        if args.spawnbox_dimensions is None
+        else np.array(args.spawnbox_dimensions),
+        chunk_imgs=args.chunk_imgs,
+    )
+    print_results(results)
+    if args.out is not None:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=4)
+        print(f"Results written to {args.out}")
@@ -0,0 +1,237 @@
+"""
+Export of bbox tables to memory mapped columnar NumPy shards
+
+Every table gets a directory with shards, every shard covers up to shard_size images and
+contains:
+    imgnr.npy   (n_rows,) int64
+    class_.npy  (n_rows,) int64
+    values.npy  (n_rows, n_values) float32, the remaining columns of the table, float64 for
+                tables in FULL_PRECISION_TABLES
+    index.npy   (n_imgs, 3) int64, rows are imgnr, start row, end row
+
+Shards are only ever appended. Exporting again exports every image that is in no shard index,
+including images merged or resumed after the last export with lower imgnrs than already
+exported images, so a shard may contain imgnrs lower than those of earlier shards. Data loaders
+can then slice labels of any image from the memory mapped arrays without copying and without SQL.
+
+This file is NOT meant to be run through Blender:
+
+python export.py generated_data
+
+Written by Naphat Amundsen
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import re
+import shutil
+from typing import List, Tuple
+
+import numpy as np
+
+import config as cng
+from setup_db import BBOX_TABLES, FULL_PRECISION_TABLES, connect
+
+
+def shard_dirs(table_dir: str) -> List[pathlib.Path]:
+    """Sorted shard directories of table directory"""
+    table_dir = pathlib.Path(table_dir)
+    if not table_dir.is_dir():
+        return []
+    pattern = re.compile(r"^shard\d+$")
+    return sorted(p for p in table_dir.iterdir() if p.is_dir() and pattern.match(p.name))
+
+
+def exported_imgnrs(table_dir: str) -> np.ndarray:
+    """
+    Returns
+    -------
+    np.ndarray
+        Sorted imgnrs in the indexes of every shard of table
+    """
+    indexes = [np.load(shard / "index.npy")[:, 0] for shard in shard_dirs(table_dir)]
+    return np.sort(np.concatenate(indexes)) if indexes else np.empty(0, dtype=np.int64)
+
+
+def write_shard(directory: pathlib.Path, rows: np.ndarray, dtype: type = np.float32) -> None:
+    """Write rows, sorted by imgnr, as a shard
+
+    Parameters
+    ----------
+    directory : pathlib.Path
+        Shard directory, will be created
+    rows : np.ndarray
+        (n_rows, n_cols), columns are imgnr, class, values ...
+    dtype : type, optional
+        dtype of values
+    """
+    # Write into temporary directory first, a shard is either complete or missing. A temporary
+    # directory left by a crash is incomplete and started over.
+    tmp = directory.with_name(directory.name + ".tmp")
+    if tmp.exists():
+        shutil.rmtree(tmp)
+    tmp.mkdir(parents=True)
+
+    imgnrs = rows[:, 0].astype(np.int64)
+    np.save(tmp / "imgnr.npy", imgnrs)
+    np.save(tmp / "class_.npy", rows[:, 1].astype(np.int64))
+    np.save(tmp / "values.npy", rows[:, 2:].astype(dtype))
+
+    # imgnrs are sorted, so an image starts wherever the imgnr changes
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(imgnrs)) + 1))
+    ends = np.append(starts[1:], len(imgnrs))
+    np.save(tmp / "index.npy", np.stack((imgnrs[starts], starts, ends), axis=1))
+
+    os.replace(tmp, directory)
+
+
+def export_table(
+    con, table: str, out_dir: str, shard_size: int, chunk_size: int = 500
+) -> Tuple[int, int]:
+    """Export rows of images of table that are not exported yet
+
+    Parameters
+    ----------
+    con : db.Connection
+    table : str
+    out_dir : str
+        Root directory of export, the table gets a subdirectory
+    shard_size : int
+        Max number of images per shard
+    chunk_size : int
+        Images fetched from database at a time
+
+    Returns
+    -------
+    Tuple[int, int]
+        Number of rows and number of shards written
+    """
+    table_dir = pathlib.Path(out_dir) / table
+    table_dir.mkdir(parents=True, exist_ok=True)
+
+    columns = [x[1] for x in con.execute(f"PRAGMA table_info({table})")]
+    with open(table_dir / "columns.json", "w") as f:
+        json.dump(columns, f)
+
+    n_shards = len(shard_dirs(table_dir))
+    # Uses the imgnr index of the table, see DatabaseMaker.create_imgnr_indexes
+    imgnrs = np.array(
+        [x[0] for x in con.execute(f"SELECT DISTINCT {cng.BBOX_DB_IMGRNR} FROM {table}")],
+        dtype=np.int64,
+    )
+    missing = np.setdiff1d(imgnrs, exported_imgnrs(table_dir))
+
+    n_rows = 0
+    n_new_shards = 0
+    for start in range(0, len(missing), shard_size):
+        shard_imgnrs = missing[start : start + shard_size]
+        chunks = []
+        for i in range(0, len(shard_imgnrs), chunk_size):
+            chunk = shard_imgnrs[i : i + chunk_size].tolist()
+            fetched = con.execute(
+                f"SELECT * FROM {table} WHERE {cng.BBOX_DB_IMGRNR} IN "
+                f"({','.join('?' * len(chunk))}) ORDER BY {cng.BBOX_DB_IMGRNR}",
+                chunk,
+            ).fetchall()
+            chunks.append(np.array(fetched, dtype=np.float64))
+        rows = np.concatenate(chunks)
+        dtype = np.float64 if table in FULL_PRECISION_TABLES else np.float32
+        write_shard(table_dir / f"shard{n_shards:06d}", rows, dtype)
+        n_rows += len(rows)
+        n_shards += 1
+        n_new_shards += 1
+
+    return n_rows, n_new_shards
+
+
+class ColumnarLabels:
+    """
+    Read access to an exported table, labels of an image are sliced from memory mapped arrays
+    """
+
+    def __init__(self, out_dir: str, table: str = cng.BBOX_DB_TABLE_FULL):
+        """
+        Parameters
+        ----------
+        out_dir : str
+            Root directory of export
+        table : str, optional
+            Table name, by default bboxes_full
+        """
+        table_dir = pathlib.Path(out_dir) / table
+        with open(table_dir / "columns.json") as f:
+            self.columns: List[str] = json.load(f)
+
+        self.classes: List[np.ndarray] = []
+        self.values: List[np.ndarray] = []
+        indexes = []
+        for i, shard in enumerate(shard_dirs(table_dir)):
+            self.classes.append(np.load(shard / "class_.npy", mmap_mode="r"))
+            self.values.append(np.load(shard / "values.npy", mmap_mode="r"))
+            index = np.load(shard / "index.npy")
+            indexes.append(np.column_stack((index, np.full(len(index), i))))
+
+        # rows are imgnr, start row, end row, shard, sorted by imgnr across shards
+        self.index: np.ndarray = np.empty((0, 4), dtype=np.int64)
+        if indexes:
+            self.index = np.concatenate(indexes)
+            self.index = self.index[np.argsort(self.index[:, 0], kind="stable")]
+
+    @property
+    def imgnrs(self) -> np.ndarray:
+        return self.index[:, 0]
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, imgnr: int) -> bool:
+        i = np.searchsorted(self.index[:, 0], imgnr)
+        return i < len(self.index) and self.index[i, 0] == imgnr
+
+    def __getitem__(self, imgnr: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            classes of size (n,) and values of size (n, n_values), views of memory maps
+        """
+        if imgnr not in self:
+            raise KeyError(f"imgnr {imgnr} is not exported")
+        _, start, end, shard = self.index[np.searchsorted(self.index[:, 0], imgnr)]
+        return self.classes[shard][start:end], self.values[shard][start:end]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export bbox tables to columnar NumPy shards")
+    parser.add_argument(
+        "dir",
+        help=f"Directory of generated data, default: {cng.GENERATED_DATA_DIR}",
+        nargs="?",
+        default=cng.GENERATED_DATA_DIR,
+    )
+    parser.add_argument(
+        "--out", help=f"Output directory, default: <dir>/{cng.EXPORT_DIR}", type=str
+    )
+    parser.add_argument(
+        "--tables", help="Tables to export, default: every bbox table", nargs="*", default=BBOX_TABLES
+    )
+    parser.add_argument(
+        "--shard-size",
+        help=f"Max images per shard, default: {cng.EXPORT_SHARD_SIZE}",
+        type=int,
+        default=cng.EXPORT_SHARD_SIZE,
+    )
+    args = parser.parse_args()
+
+    out_dir = args.out if args.out is not None else os.path.join(args.dir, cng.EXPORT_DIR)
+    con = connect(os.path.join(args.dir, cng.BBOX_DB_FILE), readonly=True)
+    existing = {x[0] for x in con.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    for table in args.tables:
+        if table not in existing:
+            print(f"Table {table} not found, skipping")
+            continue
+        n_rows, n_shards = export_table(con, table, out_dir, args.shard_size)
+        print(f"Exported {n_rows} rows from {table} into {n_shards} new shard(s) at {out_dir}")
+    con.close()
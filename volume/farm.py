@@ -0,0 +1,200 @@
+"""
+Render farm coordinator, spawns multiple Blender worker processes running main.py
+
+Every worker gets a disjoint imgnr range and writes labels to its own shard database, so
+workers never race on the database nor on get_max_imgid. When all workers are done the
+shards are merged into the main database.
+
+This file is NOT meant to be run through Blender, run it with a regular Python interpreter:
+
+python farm.py 10000 --workers 4 --gpus 0 1 -- --device CUDA --view-mode all
+
+Arguments after '--' are passed on to main.py
+
+Written by Naphat Amundsen
+"""
+
+import argparse
+import glob
+import os
+import pathlib
+import socket
+import subprocess
+import sys
+from typing import List, Optional, Sequence, Tuple
+
+import config as cng
+from setup_db import get_max_imgnr, merge_databases
+
+dirpath = pathlib.Path(os.path.dirname(os.path.abspath(__file__)))
+
+
+def split_range(start: int, n: int, workers: int) -> List[Tuple[int, int]]:
+    """Split n imgnrs starting at start into contiguous chunks
+
+    Returns
+    -------
+    List[Tuple[int, int]]
+        [(start, n), (start, n), ...], chunks with n = 0 are dropped
+    """
+    size, rest = divmod(n, workers)
+    chunks = []
+    for i in range(workers):
+        n_chunk = size + (i < rest)
+        if n_chunk > 0:
+            chunks.append((start, n_chunk))
+        start += n_chunk
+    return chunks
+
+
+def merge_leftover_shards(directory: str) -> None:
+    """
+    Merge shards left behind by an earlier run (e.g. a worker crashed or the coordinator
+    was killed) so the start index is computed from every rendered image
+    """
+    target = str(dirpath / directory / cng.BBOX_DB_FILE)
+    shards = sorted(glob.glob(str(dirpath / directory / cng.FARM_SHARD_DB_GLOB)))
+    if shards:
+        print(f"Found {len(shards)} leftover shard(s), merging into {target}")
+        n_rows = merge_databases(target, shards)
+        print(f"Merged {n_rows} rows")
+
+
+def spawn_workers(
+    n: int,
+    workers: int,
+    directory: str,
+    start: Optional[int],
+    gpus: Optional[Sequence[str]],
+    blender: str,
+    blendfile: str,
+    passthrough: Sequence[str],
+) -> List[str]:
+    """Spawn Blender workers and wait for them to finish
+
+    Returns
+    -------
+    List[str]
+        Shard database files of the workers
+    """
+    if start is None:
+        start = get_max_imgnr(str(dirpath / directory / cng.BBOX_DB_FILE)) + 1
+
+    log_dir = dirpath / directory / cng.FARM_LOG_DIR
+    log_dir.mkdir(parents=True, exist_ok=True)
+
+    procs = []
+    shards = []
+    for i, (chunk_start, chunk_n) in enumerate(split_range(start, n, workers)):
+        # Hostname in shard name so shards from several nodes can be copied to one directory
+        shard = cng.FARM_SHARD_DB_FILE.format(socket.gethostname(), i)
+        cmd = [
+            blender,
+            "--background",
+            blendfile,
+            "--python",
+            "main.py",
+            "--",
+            "--no-wait",
+            "--dir",
+            directory,
+            "--start",
+            str(chunk_start),
+            "--dbfile",
+            shard,
+            *passthrough,
+            str(chunk_n),
+        ]
+
+        env = os.environ.copy()
+        if gpus:
+            env["CUDA_VISIBLE_DEVICES"] = gpus[i % len(gpus)]
+
+        logfile = open(log_dir / f"worker{i}.log", "w")
+        print(f"Worker {i}: imgnrs [{chunk_start}, {chunk_start+chunk_n}), log at {logfile.name}")
+        proc = subprocess.Popen(cmd, cwd=dirpath, env=env, stdout=logfile, stderr=subprocess.STDOUT)
+        procs.append((proc, logfile))
+        shards.append(str(dirpath / directory / shard))
+
+    failed = []
+    for i, (proc, logfile) in enumerate(procs):
+        returncode = proc.wait()
+        logfile.close()
+        if returncode != 0:
+            failed.append(i)
+            print(f"Worker {i} exited with return code {returncode}")
+
+    if failed:
+        print(f"Workers {failed} failed, their shards are still merged (rendered images are kept)")
+
+    return [shard for shard in shards if os.path.isfile(shard)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render farm for main.py")
+    parser.add_argument(
+        "n_imgs", help="Total number of images to generate, default 1", type=int, nargs="?", default=1
+    )
+    parser.add_argument(
+        "-w", "--workers", help="Number of Blender processes, default: 1", type=int, default=1
+    )
+    parser.add_argument(
+        "--gpus",
+        help="CUDA device ids, workers are assigned to them round robin",
+        type=str,
+        nargs="*",
+    )
+    parser.add_argument(
+        "--dir",
+        help=f"Specify dir for generated data, default: {cng.GENERATED_DATA_DIR}",
+        default=cng.GENERATED_DATA_DIR,
+    )
+    parser.add_argument(
+        "--start",
+        help="First imgnr, defaults to continuing from the database. "
+        "Give disjoint ranges when running the farm on several nodes",
+        type=int,
+    )
+    parser.add_argument(
+        "--blender",
+        help=f"Blender executable, default: {cng.FARM_BLENDER_EXECUTABLE}",
+        default=cng.FARM_BLENDER_EXECUTABLE,
+    )
+    parser.add_argument(
+        "--blendfile",
+        help=f"Blend file to render, default: {cng.FARM_BLEND_FILE}",
+        default=cng.FARM_BLEND_FILE,
+    )
+    parser.add_argument(
+        "--merge-only",
+        help="Only merge shards in --dir (e.g. copied from other nodes) into the main database",
+        action="store_true",
+    )
+
+    # Everything after -- goes to main.py
+    argv = sys.argv[1:]
+    passthrough = []
+    if "--" in argv:
+        idx = argv.index("--")
+        argv, passthrough = argv[:idx], argv[idx + 1 :]
+
+    args = parser.parse_args(argv)
+
+    merge_leftover_shards(args.dir)
+    if args.merge_only:
+        sys.exit()
+
+    shards = spawn_workers(
+        n=args.n_imgs,
+        workers=args.workers,
+        directory=args.dir,
+        start=args.start,
+        gpus=args.gpus,
+        blender=args.blender,
+        blendfile=args.blendfile,
+        passthrough=passthrough,
+    )
+
+    target = str(dirpath / args.dir / cng.BBOX_DB_FILE)
+    print(f"Merging {len(shards)} shard(s) into {target}")
+    print(f"Merged {merge_databases(target, shards)} rows")
@@ -6,12 +6,13 @@ Written by Naphat Amundsen
 import abc
 import os
 import pathlib
-import random
+import re
 import sys
 import time
 from importlib import reload
-from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
 
+import bmesh
 import bpy
 import numpy as np
 import sqlite3 as db
@@ -25,12 +26,21 @@ dirpath = pathlib.Path(dir_)
 import config as cng
 import utils
 from debug import debug, debugs, debugt
+from derive import (
+    SceneConstants,
+    bounds_to_camera_frames,
+    camera_numbers,
+)
+from scene_plan import Rejector, sample_scene_plan
+from setup_db import FULL_PRECISION_TABLES, LabelWriter, connect
 
 reload(utils)
 reload(cng)
 
 
-def get_spawn_locs(n: int, spawnbox: Optional[str] = None) -> np.ndarray:
+def get_spawn_locs(
+    n: int, spawnbox: Optional[str] = None, rng: Optional[np.random.Generator] = None
+) -> np.ndarray:
     """
     Helper function get spawn location for objects
 
@@ -41,23 +51,37 @@ def get_spawn_locs(n: int, spawnbox: Optional[str] = None) -> np.ndarray:
     spawnbox: name is the spawning box, that is the cube that the fishes can spawn
               within
 
+    rng: random generator to draw from, defaults to a freshly seeded one
+
     Returns:
     --------
     points: np.ndarray of size (n,3), each row representing a 3D location for one
             object.
     """
+    loc, scale = get_spawnbox(spawnbox)
+
+    if rng is None:
+        rng = np.random.default_rng()
+
+    points = rng.uniform(low=-scale, high=scale, size=(n, 3)) + loc
+    return points
+
+
+def get_spawnbox(spawnbox: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        center location and scale (half extents) of spawnbox, defaults to "spawnbox"
+    """
     if spawnbox is None:
         spawnbox = cng.SPAWNBOX_OBJ
 
     box = bpy.data.objects[spawnbox]
-    loc = np.array(box.location)  # Center location
-    scale = np.array(box.scale)
-
-    points = np.random.uniform(low=-scale, high=scale, size=(n, 3)) + loc
-    return points
+    return np.array(box.location), np.array(box.scale)
 
 
-def get_euler_rotations(n: int) -> np.ndarray:
+def get_euler_rotations(n: int, rng: Optional[np.random.Generator] = None) -> np.ndarray:
     """
     Helper function to get euler rotations for objects
 
@@ -65,6 +89,8 @@ def get_euler_rotations(n: int) -> np.ndarray:
     -----------
     n: rows of matrix
 
+    rng: random generator to draw from, defaults to a freshly seeded one
+
     Returns:
     --------
     rotations: np.ndarray of size (n,3), each row representing a euler rotation for
@@ -72,11 +98,18 @@ def get_euler_rotations(n: int) -> np.ndarray:
     """
     mus = cng.ROT_MUS
     stds = cng.ROT_STDS
-    rotations = np.random.normal(loc=mus, scale=stds, size=(n, 3))
+    if rng is None:
+        rng = np.random.default_rng()
+
+    rotations = rng.normal(loc=mus, scale=stds, size=(n, 3))
     return rotations
 
 
-def change_to_spawnbox_coords(loc: np.ndarray) -> np.ndarray:
+def change_to_spawnbox_coords(
+    loc: np.ndarray,
+    spawnbox_location: Optional[np.ndarray] = None,
+    spawnbox_dimensions: Optional[np.ndarray] = None,
+) -> np.ndarray:
     """Helper function to change locations to spawnbox locations, will normalize wil
     respect to spawnbox dimensions. Assumes that spawnbox does not have no rotation, that
     is the spawnbox sides is parallell to axes. Numerical range will now be [-]
@@ -84,12 +117,18 @@ def change_to_spawnbox_coords(loc: np.ndarray) -> np.ndarray:
     Parameters
     ----------
     loc : Sequence[float]
-        Location vector
+        Location vector, or matrix of location vectors (one per row)
+    spawnbox_location : Optional[np.ndarray]
+        Center of spawnbox, read from Blender if None
+    spawnbox_dimensions : Optional[np.ndarray]
+        Dimensions of spawnbox, read from Blender if None
     """
-    spawnbox: bpy.types.Object = bpy.data.objects[cng.SPAWNBOX_OBJ]
-    new_origo = np.array(spawnbox.location)  # spawnbox location is center point
-    new_loc = loc - np.array(new_origo)
-    return new_loc / np.array(spawnbox.dimensions) * 2
+    if spawnbox_location is None or spawnbox_dimensions is None:
+        spawnbox: bpy.types.Object = bpy.data.objects[cng.SPAWNBOX_OBJ]
+        spawnbox_location = np.array(spawnbox.location)  # spawnbox location is center point
+        spawnbox_dimensions = np.array(spawnbox.dimensions)
+    new_loc = loc - spawnbox_location
+    return new_loc / spawnbox_dimensions * 2
 
 
 def normalize_rotations(rots: Union[np.ndarray, float]):
@@ -150,6 +189,31 @@ def get_max_imgid(cursor: db.Cursor, table: str) -> int:
         return maxid
 
 
+def generate_scene_from_seed(
+    maker: "Scenemaker",
+    seed: int,
+    nspawnrange: Tuple[int, int],
+    spawnbox: Optional[str] = None,
+    rejectors: Sequence[Rejector] = (),
+) -> List[bpy.types.Object]:
+    """
+    Generate scene that is fully determined by seed, the number of fish is drawn from
+    ~U(nspawnrange) with the same generator as the rest of the scene. Any scene can thereby be
+    regenerated from its seed (given the same blend file, config and nspawnrange). Scenes of
+    scene plans are regenerated by giving the rejectors they were sampled with, see
+    sample_scene_plan.
+
+    Does not clear the scene beforehand.
+    """
+    if rejectors:
+        plan, _ = sample_scene_plan(
+            [0], [seed], nspawnrange, maker.src_classes, *get_spawnbox(spawnbox), rejectors
+        )
+        return maker.generate_scene_from_plan(plan)
+    rng = np.random.default_rng(seed)
+    return maker.generate_scene(int(rng.integers(*nspawnrange)), spawnbox, rng=rng)
+
+
 def camera_view_bounds_2d(
     scene: bpy.types.Scene, cam_ob: bpy.types.Object, me_ob: bpy.types.Object
 ) -> Tuple[int, int, int, int]:
@@ -252,6 +316,245 @@ def camera_view_bounds_2d(
     )
 
 
+def get_mesh_coords(obj: bpy.types.Object, depsgraph: bpy.types.Depsgraph) -> np.ndarray:
+    """
+    Get vertex coordinates of evaluated mesh of object in local space
+
+    Returns
+    -------
+    np.ndarray of size (n_vertices, 3)
+    """
+    mesh_eval = obj.evaluated_get(depsgraph)
+    me = mesh_eval.to_mesh()
+    # foreach_get with a float32 buffer is a memcpy, float64 would fall back to per item access
+    co = np.empty(len(me.vertices) * 3, dtype=np.float32)
+    me.vertices.foreach_get("co", co)
+    mesh_eval.to_mesh_clear()
+    return co.reshape(-1, 3).astype(np.float64)
+
+
+def convex_hull_points(co: np.ndarray) -> np.ndarray:
+    """
+    Get the points of co that are on its convex hull
+
+    Parameters
+    ----------
+    co : np.ndarray
+        (n, 3) points
+
+    Returns
+    -------
+    np.ndarray
+        (k, 3) points, k <= n. Returns co as is if the hull could not be made (e.g. flat mesh)
+    """
+    bm = bmesh.new()
+    for point in co:
+        bm.verts.new(point)
+    result = bmesh.ops.convex_hull(bm, input=bm.verts)
+    hull = np.array([tuple(v.co) for v in result["geom"] if isinstance(v, bmesh.types.BMVert)])
+    bm.free()
+
+    if len(hull) == 0:
+        return co
+    return hull
+
+
+class ConvexHullCache:
+    """
+    Cache of convex hull points of evaluated meshes in object local space. Copies of an
+    original share the entry of the original, the keys are mesh data names without Blender's
+    copy suffix, e.g. mackerel.004 -> mackerel.
+
+    The 2D bounding box of the hull is the same as the 2D bounding box of the whole mesh as long
+    as the object is in front of the camera, so only the hull points have to be projected.
+    """
+
+    RE_COPY_SUFFIX = re.compile(r"\.\d{3,}$")
+
+    def __init__(self):
+        self.hulls: Dict[str, np.ndarray] = {}
+        self.fingerprints: Dict[str, tuple] = {}
+
+    def key(self, obj: bpy.types.Object) -> str:
+        return self.RE_COPY_SUFFIX.sub("", obj.data.name)
+
+    @staticmethod
+    def fingerprint(obj: bpy.types.Object) -> tuple:
+        """
+        Cheap description of the mesh, an entry is recomputed if this changes
+        """
+        return (len(obj.data.vertices), tuple(tuple(corner) for corner in obj.bound_box))
+
+    def get(self, obj: bpy.types.Object, depsgraph: bpy.types.Depsgraph) -> np.ndarray:
+        """
+        Get hull points of object, computes them if not cached or if the mesh has changed
+
+        Returns
+        -------
+        np.ndarray of size (n_hull_points, 3), in object local space
+        """
+        key = self.key(obj)
+        fingerprint = self.fingerprint(obj)
+        if self.fingerprints.get(key) != fingerprint:
+            self.hulls[key] = convex_hull_points(get_mesh_coords(obj, depsgraph))
+            self.fingerprints[key] = fingerprint
+        return self.hulls[key]
+
+    def invalidate(self, key: Optional[str] = None) -> None:
+        """
+        Drop cached entry of key, or every entry if key is None
+        """
+        if key is None:
+            self.hulls.clear()
+            self.fingerprints.clear()
+        else:
+            self.hulls.pop(key, None)
+            self.fingerprints.pop(key, None)
+
+
+def get_camera_params(
+    scene: bpy.types.Scene, cam_ob: bpy.types.Object
+) -> Tuple[np.ndarray, np.ndarray, bool]:
+    """
+    Read what project_to_camera_frame needs from camera, so projections can be done without
+    Blender
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, bool]
+        (4, 4) world to camera matrix, frame for project_to_camera_frame, and True if
+        perspective camera
+    """
+    cam_inv = np.array(cam_ob.matrix_world.normalized().inverted())
+    camera: bpy.types.Camera = cam_ob.data
+    frame = -np.array([tuple(v) for v in camera.view_frame(scene=scene)[:3]])
+    return cam_inv, frame, camera.type != "ORTHO"
+
+
+def object_world_coords(
+    objects: Sequence[bpy.types.Object], hullcache: Optional[ConvexHullCache] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Read vertices of objects in world space, every object is read once no matter how many
+    cameras the points are projected to
+
+    Parameters
+    ----------
+    objects : Sequence[bpy.types.Object]
+        Mesh objects
+    hullcache : Optional[ConvexHullCache]
+        If given, only read convex hull points of objects instead of every vertex
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        (n_points, 3) points of every object after another, and (n_objects,) index of first
+        point of every object
+    """
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+
+    coords = []
+    for obj in objects:
+        mat = np.array(obj.matrix_world)
+        if hullcache is None:
+            co = get_mesh_coords(obj, depsgraph)
+        else:
+            co = hullcache.get(obj, depsgraph)
+        assert len(co) > 0, f"Object {obj.name} has no vertices"
+        coords.append(co @ mat[:3, :3].T + mat[:3, 3])
+
+    starts = np.cumsum([0] + [len(co) for co in coords[:-1]])
+    return np.concatenate(coords), starts
+
+
+def camera_view_bounds_2d_multi(
+    scene: bpy.types.Scene,
+    cam_obs: Sequence[bpy.types.Object],
+    objects: Sequence[bpy.types.Object],
+    hullcache: Optional[ConvexHullCache] = None,
+) -> np.ndarray:
+    """
+    2D bounding boxes of objects in several cameras. Vertices are read once and projected to
+    every camera in one go with stacked camera matrices.
+
+    Parameters
+    ----------
+    scene : bpy.types.Scene
+        Scene to use for frame size
+    cam_obs : Sequence[bpy.types.Object]
+        Camera objects
+    objects : Sequence[bpy.types.Object]
+        Mesh objects
+    hullcache : Optional[ConvexHullCache]
+        If given, only project convex hull points of objects instead of every vertex
+
+    Returns
+    -------
+    np.ndarray
+        (n_cameras, n_objects, 4), rows are x, y, width, height, same as camera_view_bounds_2d
+    """
+    if len(objects) == 0 or len(cam_obs) == 0:
+        return np.empty((len(cam_obs), len(objects), 4))
+
+    cam_invs, frames, camera_persp = (
+        np.array(params) for params in zip(*(get_camera_params(scene, cam) for cam in cam_obs))
+    )
+    co, starts = object_world_coords(objects, hullcache)
+    co = np.einsum("cij,pj->cpi", cam_invs[:, :3, :3], co) + cam_invs[:, None, :3, 3]
+    return bounds_to_camera_frames(co, frames, camera_persp, starts)
+
+
+def camera_view_bounds_2d_batch(
+    scene: bpy.types.Scene,
+    cam_ob: bpy.types.Object,
+    objects: Sequence[bpy.types.Object],
+    hullcache: Optional[ConvexHullCache] = None,
+) -> np.ndarray:
+    """
+    Vectorized version of camera_view_bounds_2d for many objects at once. Vertices are read
+    with foreach_get, projections and min max are done in one go for every object.
+
+    Parameters
+    ----------
+    scene : bpy.types.Scene
+        Scene to use for frame size
+    cam_ob : bpy.types.Object
+        Camera object
+    objects : Sequence[bpy.types.Object]
+        Mesh objects
+    hullcache : Optional[ConvexHullCache]
+        If given, only project convex hull points of objects instead of every vertex
+
+    Returns
+    -------
+    np.ndarray
+        (n_objects, 4), rows are x, y, width, height, same as camera_view_bounds_2d
+    """
+    return camera_view_bounds_2d_multi(scene, (cam_ob,), objects, hullcache)[0]
+
+
+class LabelSnapshot(NamedTuple):
+    """
+    Plain array copy of everything the label extractors need from a scene. Used to extract
+    labels and store them outside of Blender's main thread, so nothing in here touches bpy.
+
+    Arrays are row aligned, row i is object i in the target collection
+    """
+
+    classes: np.ndarray  # (n,), numerical class
+    corners: np.ndarray  # (n, 8, 3), obj.bound_box
+    dimensions: np.ndarray  # (n, 3), obj.dimensions
+    locations: np.ndarray  # (n, 3), obj.location
+    rotations: np.ndarray  # (n, 3), obj.rotation_euler in radians
+    scales: np.ndarray  # (n, 3), obj.scale
+    spawnbox_location: np.ndarray  # (3,)
+    spawnbox_dimensions: np.ndarray  # (3,)
+    std: Optional[np.ndarray]  # (n, 4), 2D boxes, None if std mode is not requested
+    # (n_cameras, n, 6), numerical camera, object index and 2D box, None if std_multi mode is
+    # not requested
+    std_multi: Optional[np.ndarray]
+
+
 class Scenevisitor(metaclass=abc.ABCMeta):
     """
     Scenevisitor interface
@@ -275,6 +578,7 @@ class DatadumpVisitor(Scenevisitor):
         stdbboxcam: bpy.types.Object,
         bbox_modes: Optional[Sequence[str]] = None,
         cursor: Optional[db.Cursor] = None,
+        writer: Optional[LabelWriter] = None,
     ) -> None:
         """
         Parameters:
@@ -282,7 +586,8 @@ class DatadumpVisitor(Scenevisitor):
         stdbboxcam: bpy.types.Object, camera object that should be used to calculate standard
                     bounding boxes. The function needs a reference
 
-        bbox_mode: Optional[str], mode to save to SQL. Available: cps, xyz, full, std
+        bbox_mode: Optional[str], mode to save to SQL. Available: cps, xyz, full, std, pose,
+                   std_multi
 
         table: Optional str, name of table, if None, then use table specified
                in config file
@@ -293,11 +598,15 @@ class DatadumpVisitor(Scenevisitor):
              If cursor is given, the SQL executions will be done the cursor. No comitting
              will be done. In other words, the user will have more control over what
              happens with the database when the ```cursor``` parameter is specified.
+
+        writer: Optional LabelWriter, if given labels are buffered in the writer instead of
+                inserted right away, the writer must be flushed by the user.
         """
         self.con = None
+        self.writer = writer
         self.cursor = cursor
         if self.cursor is None:
-            self.con = db.connect(str(dirpath / cng.GENERATED_DATA_DIR / cng.BBOX_DB_FILE))
+            self.con = connect(str(dirpath / cng.GENERATED_DATA_DIR / cng.BBOX_DB_FILE))
             self.cursor = self.con.cursor()
 
         self.bbox_modes = bbox_modes
@@ -305,31 +614,25 @@ class DatadumpVisitor(Scenevisitor):
             self.bbox_modes = (cng.DEFAULT_BBOX_MODE,)
 
         self.stdbboxcam = stdbboxcam
-
-        # THE CODE BELOW DOES NOT WORK SINCE WHEN YOU GIVE A VARIABLE IN A FUNCTION CALL
-        # PYTHON WILL REMEMBER IT AS A POINTER TO THE VARIBLE INSTEAD OF DEREFERENCING THE POINTER
-
-        # self.strategy_map = {
-        # choice: lambda s: self._db_store(f(s), table)
-        # for choice, table, f in (
-        # (cng.BBOX_MODE_CPS, cng.BBOX_DB_TABLE_CPS, self.extract_labels_cps),
-        # (cng.BBOX_MODE_XYZ, cng.BBOX_DB_TABLE_XYZ, self.extract_labels_xyz),
-        # )
-        # }
-
-        self.strategy_map = {
-            cng.BBOX_MODE_CPS: lambda s: self._db_store(
-                self.extract_labels_cps(s), cng.BBOX_DB_TABLE_CPS
-            ),
-            cng.BBOX_MODE_XYZ: lambda s: self._db_store(
-                self.extract_labels_xyz(s), cng.BBOX_DB_TABLE_XYZ
-            ),
-            cng.BBOX_MODE_FULL: lambda s: self._db_store(
-                self.extract_labels_full(s), cng.BBOX_DB_TABLE_FULL
-            ),
-            cng.BBOX_MODE_STD: lambda s: self._db_store(
-                self.extract_labels_std(s), cng.BBOX_DB_TABLE_STD
-            ),
+        # Cameras of std_multi, every camera in the camera collection ordered by number
+        cameras = {
+            obj.name: obj
+            for obj in bpy.data.collections[cng.CAM_CLTN].all_objects
+            if obj.type == "CAMERA"
+        }
+        self.multicam_numbers: Dict[str, int] = camera_numbers(cameras)
+        self.multicams: List[bpy.types.Object] = [cameras[name] for name in self.multicam_numbers]
+        self.hullcache: Optional[ConvexHullCache] = None
+        if cng.STD_BBOX_USE_HULL:
+            self.hullcache = ConvexHullCache()
+
+        self.mode2table = {
+            cng.BBOX_MODE_CPS: cng.BBOX_DB_TABLE_CPS,
+            cng.BBOX_MODE_XYZ: cng.BBOX_DB_TABLE_XYZ,
+            cng.BBOX_MODE_FULL: cng.BBOX_DB_TABLE_FULL,
+            cng.BBOX_MODE_STD: cng.BBOX_DB_TABLE_STD,
+            cng.BBOX_MODE_POSE: cng.BBOX_DB_TABLE_POSE,
+            cng.BBOX_MODE_STD_MULTI: cng.BBOX_DB_TABLE_STD_MULTI,
         }
 
         self.n: int = None
@@ -342,7 +645,9 @@ class DatadumpVisitor(Scenevisitor):
         self.n_is_set = True
         self.n = n
 
-    def _db_store(self, labels: Sequence[Tuple[int, np.ndarray]], table: str) -> None:
+    def _db_store(
+        self, labels: Sequence[Tuple[int, np.ndarray]], table: str, imgnr: Optional[int] = None
+    ) -> None:
         """Store labels in given table. Must be correct table or things will crash
 
         Parameters
@@ -351,7 +656,18 @@ class DatadumpVisitor(Scenevisitor):
             Sequence of tuples: [(class, things), (class, things), ...]
         table : str
             Table name in SQL database
+        imgnr : Optional[int]
+            Image number to store labels under, by default self.n
         """
+        if imgnr is None:
+            imgnr = self.n
+
+        if self.writer is not None:
+            classes = [class_ for class_, _ in labels]
+            values = np.array([points.ravel() for _, points in labels])
+            self.writer.add(table, imgnr, classes, values)
+            return
+
         # Labels are expected to be
         # [
         #   (class, points),
@@ -365,7 +681,10 @@ class DatadumpVisitor(Scenevisitor):
 
         n_points = np.prod(labels[0][1].shape)
 
-        gen = ((self.n, class_, *points.ravel().round(3)) for class_, points in labels)
+        # Poses are stored as they are, labels derived from them are rounded when stored
+        if table not in FULL_PRECISION_TABLES:
+            labels = [(class_, points.round(3)) for class_, points in labels]
+        gen = ((imgnr, class_, *points.ravel()) for class_, points in labels)
 
         # First two "?" are for image id and class respectively, rest are for points
         sql_command = (
@@ -386,7 +705,7 @@ class DatadumpVisitor(Scenevisitor):
         -------
         boxes_list = [(class, box), (class, box), ...]
         """
-        objects = utils.select_collection(scene.target_collection)
+        objects = tuple(scene.target_collection.all_objects)
         boxes_list = []
 
         for obj in objects:
@@ -411,7 +730,7 @@ class DatadumpVisitor(Scenevisitor):
         -------
         boxes_list = [(class, box), (class, box), ...]
         """
-        objects = utils.select_collection(scene.target_collection)
+        objects = tuple(scene.target_collection.all_objects)
         boxes_list = []
 
         for obj in objects:
@@ -441,7 +760,7 @@ class DatadumpVisitor(Scenevisitor):
         location is relative to spawnbox, that is origo is at spawnbox center,
         and the values are normalized with respect to spawnbox dimensions.
         """
-        objects = utils.select_collection(scene.target_collection)
+        objects = tuple(scene.target_collection.all_objects)
         boxes_list = []
 
         for obj in objects:
@@ -464,26 +783,190 @@ class DatadumpVisitor(Scenevisitor):
         -------
         boxes_list = [(class, box), (class, box), ...]
         """
-        objects = utils.select_collection(scene.target_collection)
-        camera = self.stdbboxcam
+        objects = tuple(scene.target_collection.all_objects)
+        boxes = camera_view_bounds_2d_batch(
+            bpy.context.scene, self.stdbboxcam, objects, self.hullcache
+        )
         boxes_list = []
-        for obj in objects:
+        for obj, box in zip(objects, boxes):
             objclass = obj.name.split(".")[0]  # eg mackerel.002 -> mackerel
-            box = camera_view_bounds_2d(scene=bpy.context.scene, cam_ob=camera, me_ob=obj)
-            boxes_list.append((scene.name2num[objclass], np.array(box)))
+            boxes_list.append((scene.name2num[objclass], box))
 
         return boxes_list
 
+    @staticmethod
+    def extract_labels_pose(scene: "Scenemaker") -> List[Tuple[int, np.ndarray]]:
+        """
+        Gets labels as location, euler rotation (radians) and scale in world space. The other
+        modes can be derived from these offline, see derive.py
+
+        Returns
+        -------
+        boxes_list = [(class, box), (class, box), ...]
+
+        where box: np.ndarray, box.shape: (9,), consists of [location, rotation, scale]
+        """
+        objects = tuple(scene.target_collection.all_objects)
+        boxes_list = []
+
+        for obj in objects:
+            objclass = obj.name.split(".")[0]
+            pose = np.concatenate((obj.location, obj.rotation_euler, obj.scale))
+            boxes_list.append((scene.name2num[objclass], pose))
+
+        return boxes_list
+
+    def scene_constants(
+        self, scene: "Scenemaker", cameras: Sequence[bpy.types.Object]
+    ) -> SceneConstants:
+        """
+        Get everything besides poses that derive.py needs to derive labels, from the source
+        objects of scene, given cameras and the spawnbox
+        """
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        hullcache = self.hullcache if self.hullcache is not None else ConvexHullCache()
+        corners = np.array([[tuple(v) for v in obj.bound_box] for obj in scene.src_objects])
+        spawnbox: bpy.types.Object = bpy.data.objects[cng.SPAWNBOX_OBJ]
+
+        return SceneConstants(
+            classes=np.array(scene.src_classes),
+            bbox_min=corners.min(axis=1),
+            bbox_max=corners.max(axis=1),
+            hulls=[hullcache.get(obj, depsgraph) for obj in scene.src_objects],
+            cameras={cam.name: get_camera_params(bpy.context.scene, cam) for cam in cameras},
+            spawnbox_location=np.array(spawnbox.location),
+            spawnbox_dimensions=np.array(spawnbox.dimensions),
+        )
+
+    def snapshot(self, scene: "Scenemaker") -> LabelSnapshot:
+        """
+        Copy label information of scene into plain arrays, see LabelSnapshot. Every bbox mode
+        is filled from these, so the objects are traversed once and no operators are called.
+
+        2D bounding boxes are computed here since they need the evaluated meshes
+        """
+        objects = tuple(scene.target_collection.all_objects)
+        spawnbox: bpy.types.Object = bpy.data.objects[cng.SPAWNBOX_OBJ]
+
+        n = len(objects)
+        classes = np.empty(n, dtype=np.int64)
+        corners = np.empty((n, 8, 3))
+        dimensions = np.empty((n, 3))
+        locations = np.empty((n, 3))
+        rotations = np.empty((n, 3))
+        scales = np.empty((n, 3))
+        for i, obj in enumerate(objects):
+            classes[i] = scene.name2num[obj.name.split(".")[0]]
+            corners[i] = [tuple(corner) for corner in obj.bound_box]
+            dimensions[i] = tuple(obj.dimensions)
+            locations[i] = tuple(obj.location)
+            rotations[i] = tuple(obj.rotation_euler)
+            scales[i] = tuple(obj.scale)
+
+        # 2D boxes of every camera that needs them are computed from one read of the vertices
+        cams: List[bpy.types.Object] = []
+        if cng.BBOX_MODE_STD_MULTI in self.bbox_modes:
+            cams.extend(self.multicams)
+        if cng.BBOX_MODE_STD in self.bbox_modes and self.stdbboxcam not in cams:
+            cams.append(self.stdbboxcam)
+        boxes = camera_view_bounds_2d_multi(bpy.context.scene, cams, objects, self.hullcache)
+
+        std = None
+        if cng.BBOX_MODE_STD in self.bbox_modes:
+            std = boxes[cams.index(self.stdbboxcam)]
+        std_multi = None
+        if cng.BBOX_MODE_STD_MULTI in self.bbox_modes:
+            std_multi = np.empty((len(self.multicams), n, 6))
+            std_multi[:, :, 0] = np.array(list(self.multicam_numbers.values()))[:, None]
+            std_multi[:, :, 1] = np.arange(n)
+            std_multi[:, :, 2:] = boxes[: len(self.multicams)]
+
+        return LabelSnapshot(
+            classes=classes,
+            corners=corners,
+            dimensions=dimensions,
+            locations=locations,
+            rotations=rotations,
+            scales=scales,
+            spawnbox_location=np.array(spawnbox.location),
+            spawnbox_dimensions=np.array(spawnbox.dimensions),
+            std=std,
+            std_multi=std_multi,
+        )
+
+    @staticmethod
+    def arrays_from_snapshot(snapshot: LabelSnapshot, bbox_mode: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Gets labels of given bbox_mode from snapshot as arrays. Does not touch bpy.
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            classes of size (n,) and boxes of size (n, ...)
+        """
+        if bbox_mode == cng.BBOX_MODE_CPS:
+            boxes = snapshot.corners
+        elif bbox_mode == cng.BBOX_MODE_XYZ:
+            boxes = snapshot.dimensions
+        elif bbox_mode == cng.BBOX_MODE_FULL:
+            locs = change_to_spawnbox_coords(
+                snapshot.locations, snapshot.spawnbox_location, snapshot.spawnbox_dimensions
+            )
+            rots = normalize_rotations(snapshot.rotations)
+            boxes = np.concatenate((locs, snapshot.dimensions, rots), axis=1)
+        elif bbox_mode == cng.BBOX_MODE_STD:
+            boxes = snapshot.std
+        elif bbox_mode == cng.BBOX_MODE_POSE:
+            boxes = np.concatenate((snapshot.locations, snapshot.rotations, snapshot.scales), axis=1)
+        elif bbox_mode == cng.BBOX_MODE_STD_MULTI:
+            # One row per camera and object, camera major
+            classes = np.tile(snapshot.classes, len(snapshot.std_multi))
+            return classes, snapshot.std_multi.reshape(-1, 6)
+        else:
+            raise ValueError(f"Got invalid bbox mode, got {bbox_mode}")
+
+        return snapshot.classes, boxes
+
+    @classmethod
+    def labels_from_snapshot(
+        cls, snapshot: LabelSnapshot, bbox_mode: str
+    ) -> List[Tuple[int, np.ndarray]]:
+        """
+        Gets labels of given bbox_mode from snapshot, same format as the extract_labels_*
+        methods. Does not touch bpy.
+
+        Returns
+        -------
+        boxes_list = [(class, box), (class, box), ...]
+        """
+        classes, boxes = cls.arrays_from_snapshot(snapshot, bbox_mode)
+        return list(zip(classes.tolist(), boxes))
+
+    def store_snapshot(self, imgnr: int, snapshot: LabelSnapshot) -> None:
+        """
+        Store labels of every bbox mode from snapshot. Does not touch bpy, so it can be called
+        from another thread than Blender's while the next image is set up and rendered.
+        """
+        for bbox_mode in self.bbox_modes:
+            if self.writer is not None:
+                classes, boxes = self.arrays_from_snapshot(snapshot, bbox_mode)
+                self.writer.add(self.mode2table[bbox_mode], imgnr, classes, boxes)
+            else:
+                self._db_store(
+                    self.labels_from_snapshot(snapshot, bbox_mode),
+                    self.mode2table[bbox_mode],
+                    imgnr=imgnr,
+                )
+
     def visit(self, scene: "Scenemaker") -> None:
         """
-        Visit scene
+        Visit scene, labels of every bbox mode are filled from one snapshot
         """
         assert (
             self.n_is_set
         ), "The value of self.n must be updated using self.set_n before visiting a scene"
 
-        for bbox_mode in self.bbox_modes:
-            self.strategy_map[bbox_mode](scene)
+        self.store_snapshot(self.n, self.snapshot(scene))
 
         self.n_is_set = False
 
@@ -513,11 +996,37 @@ class Scenemaker:
         self.src_collection: bpy.types.Object = bpy.data.collections[src_collection]
         self.target_collection: bpy.types.Object = bpy.data.collections[target_collection]
         self.src_objects = tuple(bpy.data.collections[src_collection].all_objects)
+        self.registry = utils.DatablockRegistry()  # Datablocks made by generate_scene
 
         # Will update classdict in-place
         self.create_classdict()
 
-    def generate_scene(self, n: int = 3, spawnbox: Optional[str] = None) -> List[bpy.types.Object]:
+    def sample_scene(
+        self, n: int, spawnbox: Optional[str] = None, rng: Optional[np.random.Generator] = None
+    ) -> Tuple[List[bpy.types.Object], np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Draws everything random about a scene, in a fixed order so that a scene only depends
+        on the state of rng
+
+        Returns
+        -------
+        Tuple[List[bpy.types.Object], np.ndarray, np.ndarray, np.ndarray]
+            source objects, locations (n, 3), euler rotations (n, 3), scale factors (n,)
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+
+        locs = get_spawn_locs(n, spawnbox, rng)
+        rots = get_euler_rotations(n, rng)
+
+        self.src_objects: Tuple[bpy.types.Object]
+        src_samples = [self.src_objects[i] for i in rng.integers(len(self.src_objects), size=n)]
+        scales = rng.normal(loc=cng.RAND_SCALE_MU, scale=cng.RAND_SCALE_STD, size=n)
+        return src_samples, locs, rots, scales
+
+    def generate_scene(
+        self, n: int = 3, spawnbox: Optional[str] = None, rng: Optional[np.random.Generator] = None
+    ) -> List[bpy.types.Object]:
         """
         Copy fishes from src_collection and place them within "spawnbox" (a box)
 
@@ -529,24 +1038,86 @@ class Scenemaker:
 
         spawnbox: optional, name of cube that represent spawning region, defaults to
                   "spawnbox"
+
+        rng: random generator the scene is drawn from, defaults to a freshly seeded one
         """
-        locs = get_spawn_locs(n, spawnbox)
-        rots = get_euler_rotations(n)
+        return self.place_objects(*self.sample_scene(n, spawnbox, rng))
 
-        self.src_objects: Tuple[bpy.types.Object]
-        src_samples = random.choices(self.src_objects, k=n)
+    def generate_scene_from_plan(self, rows: np.ndarray) -> List[bpy.types.Object]:
+        """
+        Place fishes as given by rows of a scene plan, see sample_scene_plan
+
+        This will not clear the existing target collection before setting up a new scene
+        """
+        return self.place_objects(
+            [self.src_objects[i] for i in rows["src"]],
+            rows["location"],
+            rows["rotation"],
+            rows["scale"],
+        )
+
+    @property
+    def src_classes(self) -> List[int]:
+        """Class of every source object, indexed like self.src_objects"""
+        return [self.name2num[obj.name.split(".")[0]] for obj in self.src_objects]
+
+    @property
+    def src_boxes(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Bounding boxes of source objects in their own frame, scaled by their scale, indexed
+        like self.src_objects. Used to get oriented bounding boxes of planned fish without
+        placing them, see scene_plan.plan_boxes
 
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            centers relative to object origin (n_src, 3) and half extents (n_src, 3)
+        """
+        centers, half = [], []
+        for obj in self.src_objects:
+            corners = np.array([tuple(v) for v in obj.bound_box]) * np.array(obj.scale)
+            centers.append((corners.min(axis=0) + corners.max(axis=0)) / 2)
+            half.append((corners.max(axis=0) - corners.min(axis=0)) / 2)
+        return np.array(centers), np.array(half)
+
+    def place_objects(
+        self,
+        src_samples: Sequence[bpy.types.Object],
+        locs: np.ndarray,
+        rots: np.ndarray,
+        scales: np.ndarray,
+    ) -> List[bpy.types.Object]:
+        """
+        Copy given source objects and link the copies to target collection
+
+        Parameters
+        ----------
+        src_samples : Sequence[bpy.types.Object]
+            Source object of every fish
+        locs : np.ndarray
+            (n, 3) locations
+        rots : np.ndarray
+            (n, 3) euler rotations in radians
+        scales : np.ndarray
+            (n,) factors multiplied with scale of source object
+
+        Returns
+        -------
+        List[bpy.types.Object]
+            The placed fishes
+        """
         copies = []
-        for obj, loc, rot in zip(src_samples, locs, rots):
+        for obj, loc, rot, scale in zip(src_samples, locs, rots, scales):
             new_obj = obj.copy()  # Creates a "placeholder" that links to same attributes as orignal
             new_obj.data = obj.data.copy()  # VERY IMPORTANT, actually replaces important stuff
+            self.registry.register(new_obj.data)
 
             ##################################
             ### Set object attributes here ###
             ##################################
             new_obj.location = loc
             new_obj.rotation_euler = rot  # Treated as radians
-            new_obj.scale *= np.random.normal(loc=cng.RAND_SCALE_MU, scale=cng.RAND_SCALE_STD)
+            new_obj.scale *= scale
             new_obj.show_bounds = True
             new_obj.show_name = False
             ##################################
@@ -558,11 +1129,16 @@ class Scenemaker:
 
         return copies
 
-    def clear(self) -> None:
+    def clear(self) -> int:
         """
-        Clears objects in target collection
+        Clears objects in target collection and the datablocks made for them
+
+        Returns
+        -------
+        int
+            Number of freed datablocks
         """
-        utils.rm_collection(self.target_collection)
+        return utils.rm_collection(self.target_collection, registry=self.registry)
 
     def create_classdict(self) -> Dict[str, int]:
         """
@@ -584,6 +1160,117 @@ class Scenemaker:
         return self.name2num
 
 
+class PooledScenemaker(Scenemaker):
+    """
+    Scenemaker that reuses a preallocated set of fish instances instead of copying and removing
+    objects and meshes every image. Every image only links the instances it needs to the
+    target collection and sets their transforms.
+
+    Instances that are not in use are only linked to a pool collection that is not part of the
+    scene, so they are neither rendered nor labeled.
+    """
+
+    def __init__(
+        self,
+        pool_size: int,
+        src_collection: Optional[str] = None,
+        target_collection: Optional[str] = None,
+        pool_collection: Optional[str] = None,
+    ):
+        """
+        Parameters
+        ----------
+        pool_size: number of instances per class, should be at least the max number of
+                   fish in a scene
+
+        src_collection: name of collection containing source objects to be copied,
+                        defaults to "Originals"
+
+        target_collection: name of collection to contain copied objects
+
+        pool_collection: name of collection to keep instances in, will be created if not
+                         existing, defaults to "Pool"
+        """
+        super().__init__(src_collection, target_collection)
+
+        if pool_collection is None:
+            pool_collection = cng.POOL_CLTN
+
+        if pool_collection in bpy.data.collections:
+            self.pool_collection: bpy.types.Collection = bpy.data.collections[pool_collection]
+            utils.rm_collection(self.pool_collection)
+        else:
+            self.pool_collection = bpy.data.collections.new(pool_collection)
+        # Not linked to the scene, so it needs a fake user to not be purged
+        self.pool_collection.use_fake_user = True
+
+        # Start from a clean target collection, clear will only unlink pooled instances
+        utils.rm_collection(self.target_collection)
+
+        self.pool_size: int = pool_size
+        self.pool: Dict[str, List[bpy.types.Object]] = {}
+        for src in self.src_objects:
+            instances = []
+            for _ in range(pool_size):
+                new_obj = src.copy()
+                new_obj.data = src.data.copy()
+                new_obj.show_bounds = True
+                new_obj.show_name = False
+                self.pool_collection.objects.link(new_obj)
+                instances.append(new_obj)
+            self.pool[src.name] = instances
+
+        self.active: List[bpy.types.Object] = []
+
+    def place_objects(
+        self,
+        src_samples: Sequence[bpy.types.Object],
+        locs: np.ndarray,
+        rots: np.ndarray,
+        scales: np.ndarray,
+    ) -> List[bpy.types.Object]:
+        """
+        Link pooled instances of given source objects to target collection and set their
+        transforms, see Scenemaker.place_objects
+        """
+        n_used = {src.name: 0 for src in self.src_objects}
+        for obj in self.active:
+            n_used[obj.name.split(".")[0]] += 1
+
+        instances = []
+        for src, loc, rot, scale in zip(src_samples, locs, rots, scales):
+            if n_used[src.name] >= self.pool_size:
+                raise ValueError(
+                    f"Pool has {self.pool_size} instances of {src.name}, but scene needs more"
+                )
+            obj = self.pool[src.name][n_used[src.name]]
+            n_used[src.name] += 1
+
+            obj.location = loc
+            obj.rotation_euler = rot  # Treated as radians
+            obj.scale = np.array(src.scale) * scale
+
+            self.target_collection.objects.link(obj)
+            self.active.append(obj)
+            instances.append(obj)
+
+        return instances
+
+    def clear(self) -> int:
+        """
+        Unlinks instances from target collection, nothing is removed
+
+        Returns
+        -------
+        int
+            Number of freed datablocks, always 0
+        """
+        for obj in self.active:
+            self.target_collection.objects.unlink(obj)
+        self.active = []
+        return 0
+
+
 if __name__ == "__main__":
 
     rots = np.array(
@@ -595,3 +1282,18 @@ if __name__ == "__main__":
     )
 
     normalize_rotations(rots)
+
+    # Sanity check vectorized 2D bounding boxes against the per vertex version on whatever is
+    # in the target collection, e.g. blender --background Fish.blend --python generate.py
+    objects = tuple(bpy.data.collections[cng.TRGT_CLTN].all_objects)
+    cam = bpy.data.objects[cng.CAMERA_OBJ_LEFT]
+    reference = np.array(
+        [camera_view_bounds_2d(scene=bpy.context.scene, cam_ob=cam, me_ob=obj) for obj in objects]
+    ).reshape(-1, 4)
+    vectorized = camera_view_bounds_2d_batch(bpy.context.scene, cam, objects)
+    assert np.allclose(reference, vectorized, atol=1e-4), (reference, vectorized)
+    print(f"camera_view_bounds_2d_batch matches camera_view_bounds_2d for {len(objects)} objects")
+
+    hulled = camera_view_bounds_2d_batch(bpy.context.scene, cam, objects, ConvexHullCache())
+    assert np.allclose(reference, hulled, atol=1e-4), (reference, hulled)
+    print(f"Convex hull bounding boxes matches camera_view_bounds_2d for {len(objects)} objects")
@@ -1,2 +1,469 @@
-import pandas as pd 
-from matplotlib import pyplot as plt    
\ No newline at end of file
+"""
+Oriented 3D bounding boxes, vectorized with NumPy
+
+A box is given by its center, half extents along its own axes, and a rotation matrix whose
+columns are the box axes in world coordinates. Every function broadcasts over leading
+dimensions, so pairwise tests between all fish in many scenes is one call.
+
+This file does not depend on Blender.
+
+Written by Naphat Amundsen
+"""
+
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+def euler_to_matrix(euler: np.ndarray) -> np.ndarray:
+    """
+    Rotation matrices from euler angles in Blender's default XYZ mode, that is
+    R = Rz @ Ry @ Rx
+
+    Parameters
+    ----------
+    euler : np.ndarray
+        (..., 3) angles in radians
+
+    Returns
+    -------
+    np.ndarray
+        (..., 3, 3) rotation matrices
+    """
+    euler = np.asarray(euler, dtype=np.float64)
+    cx, cy, cz = np.moveaxis(np.cos(euler), -1, 0)
+    sx, sy, sz = np.moveaxis(np.sin(euler), -1, 0)
+
+    mat = np.empty(euler.shape[:-1] + (3, 3))
+    mat[..., 0, 0] = cy * cz
+    mat[..., 0, 1] = sx * sy * cz - cx * sz
+    mat[..., 0, 2] = cx * sy * cz + sx * sz
+    mat[..., 1, 0] = cy * sz
+    mat[..., 1, 1] = sx * sy * sz + cx * cz
+    mat[..., 1, 2] = cx * sy * sz - sx * cz
+    mat[..., 2, 0] = -sy
+    mat[..., 2, 1] = sx * cy
+    mat[..., 2, 2] = cx * cy
+    return mat
+
+
+# Corners of the unit cube [-1, 1]^3, same order as Blender's bound_box
+UNIT_CORNERS = np.array(
+    [
+        [-1, -1, -1],
+        [-1, -1, 1],
+        [-1, 1, 1],
+        [-1, 1, -1],
+        [1, -1, -1],
+        [1, -1, 1],
+        [1, 1, 1],
+        [1, 1, -1],
+    ],
+    dtype=np.float64,
+)
+
+
+def box_corners(centers: np.ndarray, half: np.ndarray, rotmats: np.ndarray) -> np.ndarray:
+    """
+    Parameters
+    ----------
+    centers : np.ndarray
+        (..., 3)
+    half : np.ndarray
+        (..., 3) half extents
+    rotmats : np.ndarray
+        (..., 3, 3)
+
+    Returns
+    -------
+    np.ndarray
+        (..., 8, 3) corners in world coordinates
+    """
+    local = UNIT_CORNERS * half[..., None, :]
+    return local @ np.swapaxes(rotmats, -1, -2) + centers[..., None, :]
+
+
+def obb_intersect(
+    centers_a: np.ndarray,
+    half_a: np.ndarray,
+    rot_a: np.ndarray,
+    centers_b: np.ndarray,
+    half_b: np.ndarray,
+    rot_b: np.ndarray,
+    eps: float = 1e-9,
+) -> np.ndarray:
+    """
+    Exact intersection test of oriented boxes with the separating axis theorem (15 axes),
+    boxes that only touch count as intersecting
+
+    Parameters are broadcast against each other, see box_corners for shapes
+
+    Returns
+    -------
+    np.ndarray
+        (...) boolean, True where box a and box b intersect
+    """
+    # Rotation and translation of b expressed in a's frame
+    R = np.swapaxes(rot_a, -1, -2) @ rot_b
+    t = (np.swapaxes(rot_a, -1, -2) @ (centers_b - centers_a)[..., None])[..., 0]
+    absR = np.abs(R) + eps  # eps handles parallel edges, where cross products vanish
+
+    ha = half_a[..., :, None]  # (..., 3, 1)
+    hb = half_b[..., None, :]  # (..., 1, 3)
+
+    # Axes of a
+    separated = (np.abs(t) > half_a + (absR * hb).sum(-1)).any(-1)
+    # Axes of b
+    t_b = (t[..., None, :] @ R)[..., 0, :]
+    separated |= (np.abs(t_b) > (absR * ha).sum(-2) + half_b).any(-1)
+
+    # Cross products a_i x b_j
+    i1, i2 = [1, 2, 0], [2, 0, 1]
+    ra = half_a[..., i1, None] * absR[..., i2, :] + half_a[..., i2, None] * absR[..., i1, :]
+    rb = half_b[..., None, i1] * absR[..., :, i2] + half_b[..., None, i2] * absR[..., :, i1]
+    dist = np.abs(t[..., i2, None] * R[..., i1, :] - t[..., i1, None] * R[..., i2, :])
+    separated |= (dist > ra + rb).any((-1, -2))
+
+    return ~separated
+
+
+def unit_grid(k: int) -> np.ndarray:
+    """
+    Returns
+    -------
+    np.ndarray
+        (k**3, 3) cell centers of a k x k x k grid over [-1, 1]^3
+    """
+    ticks = (np.arange(k) + 0.5) / k * 2 - 1
+    return np.stack(np.meshgrid(ticks, ticks, ticks, indexing="ij"), axis=-1).reshape(-1, 3)
+
+
+def inside_fraction(
+    centers_a: np.ndarray,
+    half_a: np.ndarray,
+    rot_a: np.ndarray,
+    centers_b: np.ndarray,
+    half_b: np.ndarray,
+    rot_b: np.ndarray,
+    k: int = 4,
+) -> np.ndarray:
+    """
+    Approximate fraction of the volume of box a that is inside box b, estimated from a
+    k x k x k grid of points in box a
+
+    Parameters are broadcast against each other, see box_corners for shapes
+
+    Returns
+    -------
+    np.ndarray
+        (...) fractions in [0, 1]
+    """
+    points = unit_grid(k) * half_a[..., None, :] @ np.swapaxes(rot_a, -1, -2)
+    points = points + (centers_a - centers_b)[..., None, :]  # Relative to center of b
+    local = points @ rot_b  # Into b's frame, rot_b is orthonormal
+    inside = (np.abs(local) <= half_b[..., None, :]).all(-1)
+    return inside.mean(-1)
+
+
+def decode_boxes(
+    centers: np.ndarray, dims: np.ndarray, euler: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Convenience for boxes given as location, dimensions and euler rotation, like
+    Blender's obj.location, obj.dimensions and obj.rotation_euler
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, np.ndarray]
+        centers, half extents and rotation matrices
+    """
+    return np.asarray(centers, dtype=np.float64), np.asarray(dims) / 2, euler_to_matrix(euler)
+
+
+# Corner indices of the 12 edges of UNIT_CORNERS
+UNIT_EDGES = np.array(
+    [[0, 1], [1, 2], [2, 3], [3, 0], [4, 5], [5, 6], [6, 7], [7, 4], [0, 4], [1, 5], [2, 6], [3, 7]]
+)
+
+
+def box_volume(half: np.ndarray) -> np.ndarray:
+    return 8 * np.prod(half, axis=-1)
+
+
+def _edge_plane_points(
+    corners: np.ndarray, normals: np.ndarray, offsets: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Intersections between the 12 edges of boxes and planes n . x = d
+
+    Parameters
+    ----------
+    corners : np.ndarray
+        (P, 8, 3)
+    normals : np.ndarray
+        (P, 6, 3)
+    offsets : np.ndarray
+        (P, 6)
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        points (P, 72, 3) and whether the edge actually crosses the plane (P, 72)
+    """
+    p0 = corners[:, UNIT_EDGES[:, 0], None]  # (P, 12, 1, 3)
+    edge = corners[:, UNIT_EDGES[:, 1], None] - p0
+    denom = (edge * normals[:, None]).sum(-1)  # (P, 12, 6)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        s = (offsets[:, None] - (p0 * normals[:, None]).sum(-1)) / denom
+    ok = np.isfinite(s) & (s >= 0) & (s <= 1)
+    s = np.where(ok, s, 0.0)
+    points = p0 + s[..., None] * edge
+    return points.reshape(len(corners), -1, 3), ok.reshape(len(corners), -1)
+
+
+def _polygon_areas(points: np.ndarray, on_plane: np.ndarray, normals: np.ndarray) -> np.ndarray:
+    """
+    Areas of convex polygons given by unordered points on planes
+
+    Parameters
+    ----------
+    points : np.ndarray
+        (P, K, 3) candidate points
+    on_plane : np.ndarray
+        (P, F, K) boolean, which points are vertices of the polygon on plane F
+    normals : np.ndarray
+        (P, F, 3) unit normals of planes
+
+    Returns
+    -------
+    np.ndarray
+        (P, F) areas, 0 where there are less than 3 vertices
+    """
+    count = on_plane.sum(-1)  # (P, F)
+    # Move vertices of every face to the front, only the first k candidates are needed then
+    k = max(int(count.max()), 1)
+    first = np.argsort(~on_plane, axis=-1, kind="stable")[..., :k]  # (P, F, k)
+    is_vertex = np.take_along_axis(on_plane, first, axis=-1)
+    pts = points[np.arange(len(points))[:, None, None], first]  # (P, F, k, 3)
+
+    center = (pts * is_vertex[..., None]).sum(2) / np.maximum(count, 1)[..., None]
+    rel = pts - center[:, :, None]
+
+    # Orthonormal basis (u, v) of every plane
+    helper = np.where(np.abs(normals[..., :1]) < 0.9, [1.0, 0.0, 0.0], [0.0, 1.0, 0.0])
+    u = np.cross(normals, helper)
+    u /= np.linalg.norm(u, axis=-1, keepdims=True)
+    v = np.cross(normals, u)
+
+    x = (rel * u[:, :, None]).sum(-1)  # (P, F, k), coordinates in plane
+    y = (rel * v[:, :, None]).sum(-1)
+    angles = np.where(is_vertex, np.arctan2(y, x), np.inf)
+    order = np.argsort(angles, axis=-1)
+    x = np.take_along_axis(x, order, axis=-1)
+    y = np.take_along_axis(y, order, axis=-1)
+    # Points that are not vertices are moved onto the first vertex, so they add no area and
+    # the polygon is still closed from the last vertex to the first
+    is_vertex = np.take_along_axis(is_vertex, order, axis=-1)
+    x = np.where(is_vertex, x, x[..., :1])
+    y = np.where(is_vertex, y, y[..., :1])
+
+    # Shoelace formula
+    areas = 0.5 * np.abs((x * np.roll(y, -1, axis=-1) - np.roll(x, -1, axis=-1) * y).sum(-1))
+    return np.where(count >= 3, areas, 0.0)
+
+
+def intersection_volume(
+    centers_a: np.ndarray,
+    half_a: np.ndarray,
+    rot_a: np.ndarray,
+    centers_b: np.ndarray,
+    half_b: np.ndarray,
+    rot_b: np.ndarray,
+) -> np.ndarray:
+    """
+    Exact intersection volume of pairs of oriented boxes
+
+    The intersection is a convex polytope. Its vertices are corners of either box inside
+    the other box and intersections between edges of one box and faces of the other. Every
+    face of it lies on a face of a box, so the volume is 1/3 sum(face area * plane offset).
+
+    Parameters
+    ----------
+    centers_a, half_a, rot_a : np.ndarray
+        (P, 3), (P, 3) and (P, 3, 3), see box_corners
+    centers_b, half_b, rot_b : np.ndarray
+        Same shapes as for a, box i of a is intersected with box i of b
+
+    Returns
+    -------
+    np.ndarray
+        (P,) intersection volumes
+    """
+    n_pairs = len(centers_a)
+    # Work in the frame of a, where a is axis aligned and centered at origin
+    R = np.swapaxes(rot_a, -1, -2) @ rot_b
+    t = (np.swapaxes(rot_a, -1, -2) @ (centers_b - centers_a)[..., None])[..., 0]
+    scale = np.maximum(np.maximum(half_a.max(-1), half_b.max(-1)), np.abs(t).max(-1))
+    tol = (1e-9 * scale)[:, None]
+
+    corners_a = UNIT_CORNERS * half_a[:, None]
+    corners_b = (UNIT_CORNERS * half_b[:, None]) @ np.swapaxes(R, -1, -2) + t[:, None]
+
+    # Planes of faces as n . x = d, normals point outwards
+    signs = np.array([1.0, 1.0, 1.0, -1.0, -1.0, -1.0])
+    axes = np.array([0, 1, 2, 0, 1, 2])
+    normals_a = np.broadcast_to(np.eye(3)[axes] * signs[:, None], (n_pairs, 6, 3))
+    offsets_a = half_a[:, axes]
+    normals_b = np.swapaxes(R, -1, -2)[:, axes] * signs[:, None]
+    offsets_b = (normals_b * t[:, None]).sum(-1) + half_b[:, axes]
+
+    points_ab, ok_ab = _edge_plane_points(corners_a, normals_b, offsets_b)
+    points_ba, ok_ba = _edge_plane_points(corners_b, normals_a, offsets_a)
+    points = np.concatenate((corners_a, corners_b, points_ab, points_ba), axis=1)
+    ok = np.concatenate((np.ones((n_pairs, 16), dtype=bool), ok_ab, ok_ba), axis=1)
+
+    in_a = (np.abs(points) <= half_a[:, None] + tol[..., None]).all(-1)
+    local_b = (points - t[:, None]) @ R
+    in_b = (np.abs(local_b) <= half_b[:, None] + tol[..., None]).all(-1)
+    vertex = ok & in_a & in_b  # (P, 160)
+    # Drop candidates that are not vertices in any pair, there are rarely more than ~30
+    first = np.argsort(~vertex, axis=-1, kind="stable")[:, : max(int(vertex.sum(-1).max()), 1)]
+    points = np.take_along_axis(points, first[..., None], axis=1)
+    vertex = np.take_along_axis(vertex, first, axis=1)
+
+    normals = np.concatenate((normals_a, normals_b), axis=1)  # (P, 12, 3)
+    offsets = np.concatenate((offsets_a, offsets_b), axis=1)  # (P, 12)
+    # A face of b that coincides with a face of a would be counted twice
+    same = (normals_b[:, :, None] * normals_a[:, None]).sum(-1) > 1 - 1e-9
+    same &= np.abs(offsets_b[:, :, None] - offsets_a[:, None]) <= tol[..., None]
+    use_plane = np.concatenate((np.ones((n_pairs, 6), dtype=bool), ~same.any(-1)), axis=1)
+
+    dist = np.abs((points[:, None] * normals[:, :, None]).sum(-1) - offsets[..., None])
+    on_plane = vertex[:, None] & (dist <= tol[..., None]) & use_plane[..., None]
+
+    areas = _polygon_areas(points, on_plane, normals)
+    return np.maximum((areas * offsets).sum(-1) / 3, 0.0)
+
+
+def decode_full(
+    values: np.ndarray,
+    spawnbox_location: Optional[np.ndarray] = None,
+    spawnbox_dimensions: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Decode rows of the bboxes_full table, see DatadumpVisitor.extract_labels_full
+
+    The location is the origin of the fish, which is used as box center since the table
+    does not store where the bounding box is relative to the origin.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        (n, 9) columns x, y, z, w, l, h, rx, ry, rz, that is location relative to spawnbox,
+        dimensions, and rotations normalized to [0, 1]
+    spawnbox_location : Optional[np.ndarray]
+        Center of spawnbox, defaults to origin
+    spawnbox_dimensions : Optional[np.ndarray]
+        Dimensions of spawnbox, defaults to 2 (locations are then used as is)
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, np.ndarray]
+        centers, half extents and rotation matrices
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if spawnbox_location is None:
+        spawnbox_location = np.zeros(3)
+    if spawnbox_dimensions is None:
+        spawnbox_dimensions = np.full(3, 2.0)
+    centers = values[:, :3] * np.asarray(spawnbox_dimensions) / 2 + spawnbox_location
+    return decode_boxes(centers, values[:, 3:6], values[:, 6:9] * 2 * np.pi)
+
+
+def paired_iou(
+    boxes_a: Tuple[np.ndarray, np.ndarray, np.ndarray],
+    boxes_b: Tuple[np.ndarray, np.ndarray, np.ndarray],
+    chunk_size: int = 512,
+) -> np.ndarray:
+    """
+    IoU of box i in boxes_a with box i in boxes_b, for any number of pairs
+
+    Only pairs that intersect (see obb_intersect) get their intersection volume computed,
+    in chunks of chunk_size pairs to bound memory usage
+
+    Parameters
+    ----------
+    boxes_a : Tuple[np.ndarray, np.ndarray, np.ndarray]
+        centers (P, 3), half extents (P, 3) and rotation matrices (P, 3, 3)
+    boxes_b : Tuple[np.ndarray, np.ndarray, np.ndarray]
+        Same as boxes_a
+
+    Returns
+    -------
+    np.ndarray
+        (P,) IoUs
+    """
+    hit = np.flatnonzero(obb_intersect(*boxes_a, *boxes_b))
+    inter = np.zeros(len(boxes_a[0]))
+    for start in range(0, len(hit), chunk_size):
+        idx = hit[start : start + chunk_size]
+        inter[idx] = intersection_volume(*(x[idx] for x in boxes_a), *(x[idx] for x in boxes_b))
+    union = box_volume(boxes_a[1]) + box_volume(boxes_b[1]) - inter
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(union > 0, inter / union, 0.0)
+
+
+def iou_matrix(
+    boxes_a: Tuple[np.ndarray, np.ndarray, np.ndarray],
+    boxes_b: Tuple[np.ndarray, np.ndarray, np.ndarray],
+    chunk_size: int = 512,
+) -> np.ndarray:
+    """
+    IoU between every box in boxes_a and every box in boxes_b
+
+    Parameters
+    ----------
+    boxes_a : Tuple[np.ndarray, np.ndarray, np.ndarray]
+        N boxes as centers, half extents and rotation matrices, see decode_full
+    boxes_b : Tuple[np.ndarray, np.ndarray, np.ndarray]
+        M boxes
+
+    Returns
+    -------
+    np.ndarray
+        (N, M) IoUs
+    """
+    n, m = len(boxes_a[0]), len(boxes_b[0])
+    ia, ib = np.divmod(np.arange(n * m), m)
+    ious = paired_iou(
+        tuple(x[ia] for x in boxes_a), tuple(x[ib] for x in boxes_b), chunk_size=chunk_size
+    )
+    return ious.reshape(n, m)
+
+
+if __name__ == "__main__":
+    # Timing, the reference checks are in test_iou3d.py, run with: python iou3d.py
+    import time
+
+    rng = np.random.default_rng(0)
+
+    def random_boxes(
+        n: int, spread: float = 0.5, size: Tuple[float, float] = (0.1, 0.8)
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        return (
+            rng.uniform(-spread, spread, (n, 3)),
+            rng.uniform(*size, (n, 3)),
+            euler_to_matrix(rng.uniform(-7, 7, (n, 3))),
+        )
+
+    # 100k images with 5 ground truth and 5 predicted fish each, fish sized boxes
+    # in a unit spawnbox
+    n_imgs, n_fish = 100_000, 5
+    gt = random_boxes(n_imgs * n_fish, spread=1.0, size=(0.05, 0.3))
+    pred = tuple(x + rng.normal(0, 0.05, x.shape) if i == 0 else x for i, x in enumerate(gt))
+    # Every pair within the same image
+    ia = (np.arange(n_imgs)[:, None, None] * n_fish + np.arange(n_fish)[:, None]).repeat(n_fish, -1)
+    ib = ia.transpose(0, 2, 1)
+    t = time.perf_counter()
+    ious = paired_iou(tuple(x[ia.ravel()] for x in pred), tuple(x[ib.ravel()] for x in gt))
+    print(f"{len(ious)} box pairs ({n_imgs} images) in {time.perf_counter() - t:.1f} s")
@@ -26,7 +26,7 @@ import utils
 import pandas as pd
 import numpy as np
 from debug import debug, debugs, debugt
-from setup_db import DatabaseMaker
+from setup_db import DatabaseMaker, connect
 import reconstruct as recon
 import main as mainfile
 
@@ -230,7 +230,7 @@ class LabelRenderer(mainfile.BaseBlenderRender):
         self.imgpath = str(  
             dirpath / cng.LABELCHECK_DATA_DIR / cng.LABELCHECK_IMAGE_DIR / cng.LABELCHECK_IMAGE_NAME
         )
-        self.con = db.connect(str(dirpath / cng.LABELCHECK_DATA_DIR / cng.LABELCHECK_DB_FILE))
+        self.con = connect(str(dirpath / cng.LABELCHECK_DATA_DIR / cng.LABELCHECK_DB_FILE))
         self.cursor = self.con.cursor()
 
         self.iter_callback = self.sql_insert
@@ -310,7 +310,7 @@ def main(
     imgpath = str(
         dirpath / cng.LABELCHECK_DATA_DIR / cng.LABELCHECK_IMAGE_DIR / cng.LABELCHECK_IMAGE_NAME
     )
-    con = db.connect(str(dirpath / cng.LABELCHECK_DATA_DIR / cng.LABELCHECK_DB_FILE))
+    con = connect(str(dirpath / cng.LABELCHECK_DATA_DIR / cng.LABELCHECK_DB_FILE))
     cursor = con.cursor()
 
     output_info = []
@@ -4,10 +4,28 @@ Main python file to control Blender application
 Written by Naphat Amundsen
 """
 
+import glob
 import os
 import pathlib
+import re
+import struct
 import sys
-from typing import Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import (
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 import abc
 
 import bpy
@@ -26,8 +44,19 @@ import sqlite3 as db
 import config as cng
 import utils
 
+import derive
 import generate as gen
-from setup_db import DatabaseMaker
+import scene_plan
+from encode import EncodePool, encode_file
+from setup_db import (
+    BBOX_TABLES,
+    METRIC_STAGES,
+    DatabaseMaker,
+    JobManifest,
+    LabelWriter,
+    MetricsRecorder,
+    connect,
+)
 
 
 @utils.section("Data directory")
@@ -54,21 +83,95 @@ def check_or_create_datadir(directory: str, db_file: str) -> None:
             f()
     else:
         print(f"Found database file: {utils.yellow(db_path)}")
+        # Databases made before the manifest, poses, std_multi and imgnr indexes gets them here,
+        # does nothing otherwise
+        maker = DatabaseMaker(db_path)
+        maker.create_manifest_table()
+        maker.create_pose_tables()
+        maker.create_metrics_table()
+        maker.create_bboxes_std_multi_table()
+        maker.create_imgnr_indexes()
 
 
-def assert_image_saved(filepath: str, view_mode: str) -> None:
+def view_suffixes(view_mode: str) -> Tuple[str, ...]:
+    """
+    File suffixes of images rendered in given view mode, in order of cng.VIEW_MODE_CAMERAS
+    """
+    if view_mode == "center":
+        return ("",)
+    elif view_mode == "leftright":
+        return (cng.FILE_SUFFIX_LEFT, cng.FILE_SUFFIX_RIGHT)
+    elif view_mode == "topcenter":
+        return (cng.FILE_SUFFIX_CENTER, cng.FILE_SUFFIX_CENTER_TOP)
+    return (
+        cng.FILE_SUFFIX_LEFT,
+        cng.FILE_SUFFIX_RIGHT,
+        cng.FILE_SUFFIX_CENTER,
+        cng.FILE_SUFFIX_CENTER_TOP,
+    )
+
+
+def expected_image_paths(
+    filepath: str, view_mode: str, extension: Optional[str] = None
+) -> List[str]:
+    """
+    Paths of images a render of filepath produces in given view mode, extension defaults to
+    cng.DEFAULT_FILEFORMAT_EXTENSION
+    """
+    if extension is None:
+        extension = cng.DEFAULT_FILEFORMAT_EXTENSION
+    return [filepath + suffix + extension for suffix in view_suffixes(view_mode)]
+
+
+def image_extensions() -> List[str]:
+    """
+    Extensions rendered images can have on disk, whatever --encode earlier runs used. Final
+    formats come first, the raw format of --encode last.
+    """
+    extensions = (
+        cng.DEFAULT_FILEFORMAT_EXTENSION,
+        *cng.ENCODE_FORMATS.values(),
+        cng.ENCODE_RAW_EXTENSION,
+    )
+    return list(dict.fromkeys(extensions))
+
+
+def find_image_files(img_dir: str, base_img_name: str) -> Dict[int, List[str]]:
+    """
+    Scan image directory for rendered images of every extension in image_extensions
+
+    Returns
+    -------
+    Dict[int, List[str]]
+        imgnr -> paths of every image file of that imgnr
+    """
+    extensions = "|".join(re.escape(extension) for extension in image_extensions())
+    pattern = re.compile(rf"^{re.escape(base_img_name)}(\d+)(_[A-Z_]+)?({extensions})$")
+    found: Dict[int, List[str]] = {}
+    if not os.path.isdir(img_dir):
+        return found
+    for entry in os.scandir(img_dir):
+        match = pattern.match(entry.name)
+        if match:
+            found.setdefault(int(match.group(1)), []).append(entry.path)
+    return found
+
+
+def assert_image_saved(filepath: str, view_mode: str, extension: Optional[str] = None) -> None:
     """
     Used to assert that image in filepath exists, will automatically handle stereo and single
-    case
+    case. extension defaults to cng.DEFAULT_FILEFORMAT_EXTENSION
     """
     assert view_mode in ("leftright", "topcenter", "center", "all")
+    if extension is None:
+        extension = cng.DEFAULT_FILEFORMAT_EXTENSION
 
     errormsgs = "Render results are missing:"
 
     if view_mode in ("leftright", "all"):
         print(f"Asserting multiview ({utils.yellow('leftright')}) output")
-        l_path = filepath + f"{cng.FILE_SUFFIX_LEFT}{cng.DEFAULT_FILEFORMAT_EXTENSION}"
-        r_path = filepath + f"{cng.FILE_SUFFIX_RIGHT}{cng.DEFAULT_FILEFORMAT_EXTENSION}"
+        l_path = filepath + f"{cng.FILE_SUFFIX_LEFT}{extension}"
+        r_path = filepath + f"{cng.FILE_SUFFIX_RIGHT}{extension}"
 
         l_exists = os.path.exists(l_path)
         r_exists = os.path.exists(r_path)
@@ -82,9 +185,9 @@ def assert_image_saved(filepath: str, view_mode: str) -> None:
             raise FileNotFoundError(errormsgs)
     if view_mode in ("topcenter", "all"):
         print(f"Asserting multiview ({utils.yellow('topcenter')}) output")
-        center_path = filepath + f"{cng.FILE_SUFFIX_CENTER}{cng.DEFAULT_FILEFORMAT_EXTENSION}"
+        center_path = filepath + f"{cng.FILE_SUFFIX_CENTER}{extension}"
         center_top_path = (
-            filepath + f"{cng.FILE_SUFFIX_CENTER_TOP}{cng.DEFAULT_FILEFORMAT_EXTENSION}"
+            filepath + f"{cng.FILE_SUFFIX_CENTER_TOP}{extension}"
         )
 
         center_exists = os.path.exists(center_path)
@@ -95,11 +198,11 @@ def assert_image_saved(filepath: str, view_mode: str) -> None:
         if not centertop_exists:
             errormsgs += f"\nTop center image not found, expected to find: \n\t{center_top_path}"
 
-        if not (center_path and center_top_path):
+        if not (center_exists and centertop_exists):
             raise FileNotFoundError(errormsgs)
     if view_mode == "center":
         print(f"Asserting singleview ({utils.yellow('center')}) output")
-        path = filepath + cng.DEFAULT_FILEFORMAT_EXTENSION
+        path = filepath + extension
         file_exists = os.path.exists(path)
         if not file_exists:
             raise FileNotFoundError(f"Center image not found, expected to find: \n\t{path}")
@@ -153,11 +256,33 @@ class BaseBlenderRender(abc.ABC):
         self.pre_loop_messages: Optional[Sequence[str]] = None
         self.setup_scene: Optional[Callable] = None  # Called every iteration before rendering
         self.iter_callback: Optional[Callable] = None  # Called after every render
+        # Renders every enabled view, called with image filepath without suffix and extension
+        self.render_image: Callable = utils.render_and_save
+        # Extension of the files render_image writes, asserted after rendering
+        self.saved_extension: str = cng.DEFAULT_FILEFORMAT_EXTENSION
+        # Optional, called with imgnr after the rendered files are asserted
+        self.saved_callback: Optional[Callable] = None
         self.interval_callback: Optional[Callable] = None  # Called in intervals after render
         self.end_callback: Optional[Callable] = None  # Called after render loop is done
+        # Optional, called after every iteration with imgnr, whether it was rendered and
+        # {stage: seconds} of the stages in METRIC_STAGES
+        self.metrics_callback: Optional[Callable] = None
 
         self.setup_scene_kwargs: dict = {}
 
+    def needs_render(self, imgnr: int) -> bool:
+        """
+        Whether imgnr has to be rendered, if not the scene is only set up before the callbacks
+        (e.g. when images already are on disk)
+        """
+        return True
+
+    def existing_extension(self, imgnr: int) -> str:
+        """
+        Extension of the images of imgnr that are on disk, when needs_render is False
+        """
+        return cng.DEFAULT_FILEFORMAT_EXTENSION
+
     @abc.abstractmethod
     def initalize_imgnr_iter(self):
         """
@@ -194,30 +319,58 @@ class BaseBlenderRender(abc.ABC):
 
         len_iter = len(self.imgnr_iter)
         interval_flag: bool = False  # To make Pylance happy
+        imgnr: Optional[int] = None  # In case there is nothing to render
         for iternum, imgnr in enumerate(self.imgnr_iter):
+            timings: Dict[str, float] = dict.fromkeys(METRIC_STAGES, 0.0)
+            t0 = time.perf_counter()
             self.setup_scene(imgnr, **self.setup_scene_kwargs)
+            t1 = time.perf_counter()
+            timings["setup"] = t1 - t0
+
             imgfilepath = self.imgpath + str(imgnr)
-            print(f"Starting to render imgnr {imgnr}")
-            utils.render_and_save(imgfilepath)
-            print(f"Returned from rendering imgnr {imgnr}")
+            rendered = self.needs_render(imgnr)
+            if rendered:
+                print(f"Starting to render imgnr {imgnr}")
+                self.render_image(imgfilepath)
+                print(f"Returned from rendering imgnr {imgnr}")
+            else:
+                print(f"Images of imgnr {imgnr} already exist, skipping render")
+            t0 = time.perf_counter()
+            timings["render"] = t0 - t1
 
             try:
-                assert_image_saved(imgfilepath, self.view_mode)
+                # Images that are not rendered again are already in their final format
+                extension = self.saved_extension if rendered else self.existing_extension(imgnr)
+                assert_image_saved(imgfilepath, self.view_mode, extension)
             except FileNotFoundError as e:
                 print(e)
                 print("Breaking render loop")
                 interval_flag == False  # Will enable callback after the loop
                 break
+            if rendered and self.saved_callback is not None:
+                self.saved_callback(imgnr)
+            t1 = time.perf_counter()
+            timings["assertion"] = t1 - t0
 
             self.iter_callback(imgnr)
+            t0 = time.perf_counter()
+            timings["labels"] = t0 - t1
 
             # Only commit in intervals
             interval_flag = not imgnr % self.interval
 
             if interval_flag:
                 self.interval_callback(imgnr)
+                timings["commit"] = time.perf_counter() - t0
+
+            if self.metrics_callback is not None:
+                self.metrics_callback(imgnr, rendered, timings)
 
-            print("Progress: ", utils.yellow(f"{iternum+1} / {len_iter}"))
+            print(
+                "Progress: ",
+                utils.yellow(f"{iternum+1} / {len_iter}"),
+                f"({sum(timings.values()):.2f} s, render {timings['render']:.2f} s)",
+            )
 
         # If loop exited without commiting remaining stuff
         # This if test is kinda redundant, but idk man
@@ -227,6 +380,162 @@ class BaseBlenderRender(abc.ABC):
         self.end_callback()
 
 
+def render_multiview(filepath: str, view_mode: str, fileformat: Optional[str] = None) -> None:
+    """
+    Render every enabled view with one render call. Blender syncs the scene to the render engine
+    once and renders the views of it after another
+    """
+    utils.render_and_save(filepath, fileformat)
+
+
+def render_sequential(filepath: str, view_mode: str, fileformat: Optional[str] = None) -> None:
+    """
+    Render every camera of view mode with its own render call, the scene camera is switched
+    between the calls. With persistent data (see set_attrs_multicam) Cycles keeps the synced
+    scene between the calls, so only the camera is updated.
+    """
+    scene = bpy.context.scene
+    camera, use_multiview = scene.camera, scene.render.use_multiview
+    scene.render.use_multiview = False
+    try:
+        for cam_name, suffix in zip(cng.VIEW_MODE_CAMERAS[view_mode], view_suffixes(view_mode)):
+            scene.camera = bpy.data.objects[cam_name]
+            utils.render_and_save(filepath + suffix, fileformat)
+    finally:
+        scene.camera = camera
+        scene.render.use_multiview = use_multiview
+
+
+MULTICAM_RENDERERS: Dict[str, Callable[[str, str, Optional[str]], None]] = {
+    "multiview": render_multiview,
+    "sequential": render_sequential,
+}
+
+
+class MulticamRenderer:
+    """
+    Renders every camera of view mode for one scene setup with a multi camera strategy, see
+    MULTICAM_RENDERERS. Strategy auto benchmarks the strategies on the first image and keeps
+    using the fastest one, the benchmark renders count as render time of the first image.
+    """
+
+    def __init__(
+        self,
+        view_mode: str,
+        strategy: str,
+        rounds: Optional[int] = None,
+        fileformat: Optional[str] = None,
+    ):
+        assert strategy == "auto" or strategy in MULTICAM_RENDERERS, f"Invalid strategy {strategy}"
+        self.view_mode: str = view_mode
+        self.strategy: str = strategy
+        self.fileformat: Optional[str] = fileformat  # Defaults to cng.DEFAULT_FILEFORMAT
+        self.rounds: int = cng.MULTICAM_BENCH_ROUNDS if rounds is None else rounds
+        # Strategy -> render seconds of every timed round, filled by benchmark
+        self.timings: Dict[str, List[float]] = {}
+        # True if the last call ran the benchmark, its render time is then not a normal one
+        self.benchmarked: bool = False
+
+    def benchmark(self, filepath: str) -> str:
+        """
+        Render the current scene with every strategy, rounds are interleaved so the strategies
+        see the same caches. The first render is not timed, it pays for shader compilation and
+        the first scene sync.
+
+        Returns
+        -------
+        str
+            Strategy with lowest median render time
+        """
+        render_multiview(filepath, self.view_mode, self.fileformat)
+        self.timings = {strategy: [] for strategy in MULTICAM_RENDERERS}
+        for _ in range(self.rounds):
+            for strategy, render in MULTICAM_RENDERERS.items():
+                t0 = time.perf_counter()
+                render(filepath, self.view_mode, self.fileformat)
+                self.timings[strategy].append(time.perf_counter() - t0)
+
+        medians = {strategy: float(np.median(t)) for strategy, t in self.timings.items()}
+        best = min(medians, key=medians.get)
+        n_cams = len(cng.VIEW_MODE_CAMERAS[self.view_mode])
+        utils.print_boxed(
+            f"Multi camera benchmark, {n_cams} camera(s), {self.rounds} round(s):",
+            *(
+                f"{strategy:>10}: {median:.2f} s per image, {median / n_cams:.2f} s per camera"
+                for strategy, median in medians.items()
+            ),
+            f"Using {utils.yellow(best)}",
+        )
+        return best
+
+    def __call__(self, filepath: str) -> None:
+        self.benchmarked = False
+        if self.strategy == "auto":
+            # Nothing to choose between with one camera
+            if len(cng.VIEW_MODE_CAMERAS[self.view_mode]) > 1:
+                self.strategy = self.benchmark(filepath)
+                self.benchmarked = True
+            else:
+                self.strategy = "multiview"
+        MULTICAM_RENDERERS[self.strategy](filepath, self.view_mode, self.fileformat)
+
+
+class SampleController:
+    """
+    Picks the render sample count of every image so renders stay within a time budget.
+
+    Render time is modelled as overhead + samples * seconds per sample, fitted by least squares
+    to the most recent renders. With Cycles adaptive sampling (see set_attrs_engine) the
+    sample count is an upper bound, pixels stop early when their noise estimate is below the
+    threshold, so simple scenes finish faster and the fit learns that.
+    """
+
+    def __init__(self, max_samples: int, time_budget: float, min_samples: Optional[int] = None):
+        """
+        Parameters
+        ----------
+        max_samples : int
+            Samples used until there is something to fit, and upper bound after
+        time_budget : float
+            Target render seconds per image
+        min_samples : Optional[int], optional
+            Lower bound, by default from config file
+        """
+        self.max_samples: int = max_samples
+        self.min_samples: int = cng.ADAPTIVE_MIN_SAMPLES if min_samples is None else min_samples
+        self.min_samples = min(self.min_samples, max_samples)
+        self.time_budget: float = time_budget
+        self.history: Deque[Tuple[int, float]] = deque(maxlen=cng.SAMPLE_CONTROLLER_WINDOW)
+        self.samples: int = max_samples  # Samples of the current image
+
+    def fit(self) -> Tuple[float, float]:
+        """
+        Returns
+        -------
+        Tuple[float, float]
+            overhead in seconds and seconds per sample
+        """
+        samples, seconds = np.array(self.history, dtype=np.float64).T
+        if np.ptp(samples) > 0:
+            per_sample, overhead = np.polyfit(samples, seconds, 1)
+            if per_sample > 0 and overhead >= 0:
+                return overhead, per_sample
+        # Too little variation for a line, attribute everything to the samples
+        return 0.0, seconds.sum() / samples.sum()
+
+    def next_samples(self) -> int:
+        """Pick samples for the next image"""
+        if self.history:
+            overhead, per_sample = self.fit()
+            samples = (self.time_budget - overhead) / per_sample
+            self.samples = int(np.clip(samples, self.min_samples, self.max_samples))
+        return self.samples
+
+    def observe(self, seconds: float) -> None:
+        """Render time of the current image"""
+        self.history.append((self.samples, seconds))
+
+
 class BlenderRenderGenerater(BaseBlenderRender):
     def __init__(
         self,
@@ -239,7 +548,25 @@ class BlenderRenderGenerater(BaseBlenderRender):
         bbox_modes: Sequence[str],
         stdbboxcam: bpy.types.Object,
         nspawnrange: Tuple[int, int],
+        start: Optional[int] = None,
+        pipelined: bool = False,
+        pooled: bool = False,
+        resume: bool = False,
+        delete_orphans: bool = False,
+        seed: Optional[int] = None,
+        scene_plan: bool = False,
+        min_distance: Optional[float] = None,
+        max_overlap: Optional[float] = None,
+        max_occlusion: Optional[float] = None,
+        time_budget: Optional[float] = None,
+        warm_up: bool = False,
+        multicam: str = cng.ARGS_DEFAULT_MULTICAM,
+        encode: Optional[str] = None,
+        encode_workers: Optional[int] = None,
     ):
+        # Time to first image is measured from here, includes pool creation and warm-up
+        self.t_start: float = time.perf_counter()
+        self.t_first: Optional[float] = None
         super().__init__(data_dir, img_dir, base_img_name, wait, view_mode)
         check_or_create_datadir(cng.GENERATED_DATA_DIR, cng.BBOX_DB_FILE)
 
@@ -247,62 +574,413 @@ class BlenderRenderGenerater(BaseBlenderRender):
         self.bbox_modes: Sequence[str] = bbox_modes
         self.stdbboxcam: bpy.types.Object = stdbboxcam
         self.nspawnrange: Tuple[int, int] = nspawnrange
-
-        self.con = db.connect(str(dirpath / cng.GENERATED_DATA_DIR / cng.BBOX_DB_FILE))
+        # Given start index skips get_max_imgid, used by farm.py to give workers disjoint ranges
+        self.start: Optional[int] = start
+        # Every imgnr gets a seed derived from base seed, stored in the job manifest
+        self.resume: bool = resume
+        self.delete_orphans: bool = delete_orphans
+        self.base_seed: int = np.random.randint(2 ** 31) if seed is None else seed
+        self.seeds: Dict[int, int] = {}
+        # Imgnrs whose images are on disk but labels are not, with extension of their images
+        self.relabel: Dict[int, str] = {}
+        # With scene plan, scenes of the whole run are sampled up front and saved to disk
+        self.scene_plan: bool = scene_plan
+        self.min_distance: Optional[float] = min_distance
+        self.max_overlap: Optional[float] = max_overlap
+        self.max_occlusion: Optional[float] = max_occlusion
+        self.plan: np.ndarray = np.empty(0, dtype=scene_plan.SCENE_PLAN_DTYPE)
+        self.plan_slices: Dict[int, slice] = {}
+        self.plan_acceptance: Optional[float] = None
+
+        # In pipelined mode labels are stored and committed by a background thread while the
+        # next image is set up and rendered. All database work is then done by that thread.
+        self.pipelined: bool = pipelined
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.pending: Optional[Future] = None
+        if pipelined:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+
+        self.con = connect(
+            str(dirpath / cng.GENERATED_DATA_DIR / cng.BBOX_DB_FILE), check_same_thread=not pipelined
+        )
         self.cursor = self.con.cursor()
+        self.writer = LabelWriter(self.con)
+        self.manifest = JobManifest(self.cursor)
 
-        self.maker = gen.Scenemaker()
+        if pooled:
+            self.maker = gen.PooledScenemaker(pool_size=max(nspawnrange))
+        else:
+            self.maker = gen.Scenemaker()
         gen.create_metadata(self.maker)
+        self.warm_up_time: Optional[float] = None
+        self.n_freed: int = 0  # Datablocks freed by clearing scenes since last commit
+        if warm_up:
+            self.warm_up_time = warm_up_shaders(self.maker)
         self.extractor = gen.DatadumpVisitor(
-            stdbboxcam=stdbboxcam, bbox_modes=bbox_modes, cursor=self.cursor
+            stdbboxcam=stdbboxcam, bbox_modes=bbox_modes, cursor=self.cursor, writer=self.writer
         )
+        if cng.BBOX_MODE_POSE in bbox_modes:
+            self.store_scene_constants()
+
+        self.metrics = MetricsRecorder(**get_render_settings())
+        self.sample_controller: Optional[SampleController] = None
+        if time_budget is not None:
+            self.sample_controller = SampleController(get_render_settings()["samples"], time_budget)
+
+        # With encode, Blender writes raw files that are encoded to given format in background
+        self.encoder: Optional[EncodePool] = None
+        fileformat = None
+        if encode is not None:
+            self.encoder = EncodePool(encode, encode_workers)
+            self.saved_extension = cng.ENCODE_RAW_EXTENSION
+            self.saved_callback = self.encode_images
+            fileformat = cng.ENCODE_RAW_FILEFORMAT
 
         self.setup_scene = self._setup_scene
+        self.render_image = MulticamRenderer(view_mode, multicam, fileformat=fileformat)
         self.interval_callback = self.commit
         self.iter_callback = self.extract_labels
         self.end_callback = self.close_con
+        self.metrics_callback = self.record_metrics
 
-    def commit(self, imgnr: Optional[int] = None):
+    def store_scene_constants(self) -> None:
+        """
+        Store what derive.py needs besides poses, raises ValueError if it differs from what is
+        already stored in the database
+        """
+        cameras = {
+            obj.name: obj
+            for obj in bpy.data.collections[cng.CAM_CLTN].all_objects
+            if obj.type == "CAMERA"
+        }
+        cameras[self.stdbboxcam.name] = self.stdbboxcam
+        derive.store_constants(
+            self.cursor, self.extractor.scene_constants(self.maker, list(cameras.values()))
+        )
         self.con.commit()
-        utils.print_boxed(f"Commited to {cng.BBOX_DB_FILE}")
+
+    def submit(self, f: Callable, *args) -> None:
+        """
+        Run f in background thread if pipelined, else run it right away
+
+        Waits for previously submitted work first, so at most one image is queued and errors
+        from the background thread are raised in the render loop
+        """
+        if self.executor is None:
+            f(*args)
+            return
+
+        if self.pending is not None:
+            self.pending.result()
+        self.pending = self.executor.submit(f, *args)
+
+    def _commit(self, metric_rows: Sequence[tuple] = (), n_freed: int = 0):
+        self.manifest.commit_labeled()
+        self.metrics.write(self.cursor, metric_rows)
+        n_rows = self.writer.flush()
+        self.con.commit()
+        utils.print_boxed(
+            f"Commited {n_rows} rows to {cng.BBOX_DB_FILE}",
+            f"Freed {n_freed} datablocks since last commit",
+        )
+
+    def commit(self, imgnr: Optional[int] = None):
+        # Committed jobs are expected to have their images on disk, see plan_resume
+        if self.encoder is not None:
+            self.encoder.drain()
+        # Metric rows are handed over, so the background thread never reads the buffer
+        n_freed, self.n_freed = self.n_freed, 0
+        self.submit(self._commit, self.metrics.take(), n_freed)
+
+    def encode_images(self, imgnr: int):
+        """Hand raw files of imgnr to encoder, blocks while encoder is full"""
+        filepath = self.imgpath + str(imgnr)
+        raw_paths = expected_image_paths(filepath, self.view_mode, cng.ENCODE_RAW_EXTENSION)
+        paths = expected_image_paths(filepath, self.view_mode, self.encoder.extension)
+        for raw_path, path in zip(raw_paths, paths):
+            self.encoder.submit(raw_path, path)
+
+    def record_metrics(self, imgnr: int, rendered: bool, timings: Dict[str, float]):
+        n_fish = len(self.maker.target_collection.all_objects)
+        samples = None
+        if self.sample_controller is not None:
+            samples = self.sample_controller.samples
+            # Benchmark renders of --multicam auto would make the first image look expensive
+            if rendered and not self.render_image.benchmarked:
+                self.sample_controller.observe(timings["render"])
+        self.metrics.add(imgnr, n_fish, rendered, timings, samples)
+
+        if self.t_first is None:
+            self.t_first = time.perf_counter() - self.t_start
+            warm_up = "" if self.warm_up_time is None else f", shader warm-up {self.warm_up_time:.2f} s"
+            print(f"Time to first image: {utils.yellow(f'{self.t_first:.2f}')} s{warm_up}")
+
+    def _store_labels(self, imgnr: int, snapshot: Optional[gen.LabelSnapshot] = None):
+        self.manifest.mark(imgnr, cng.JOB_RENDERED)
+        if snapshot is None:
+            self.extractor.set_n(imgnr)
+            self.extractor.visit(self.maker)
+        else:
+            self.extractor.store_snapshot(imgnr, snapshot)
+        self.manifest.mark(imgnr, cng.JOB_LABELED)
 
     def extract_labels(self, imgnr: int):
-        self.extractor.set_n(imgnr)
-        self.extractor.visit(self.maker)
+        if self.pipelined:
+            # Snapshot must be taken in Blender's thread, the rest can be done in background
+            self.submit(self._store_labels, imgnr, self.extractor.snapshot(self.maker))
+        else:
+            self._store_labels(imgnr)
+
+    def needs_render(self, imgnr: int) -> bool:
+        return imgnr not in self.relabel
+
+    def existing_extension(self, imgnr: int) -> str:
+        return self.relabel[imgnr]
+
+    @property
+    def final_fileformat(self) -> str:
+        """Format images end up in, the encoded format with --encode"""
+        return cng.DEFAULT_FILEFORMAT if self.encoder is None else self.encoder.fileformat
 
     def close_con(self):
+        if self.encoder is not None:
+            self.encoder.close()
+            print(f"Encoded {self.encoder.n_encoded} image file(s) to {self.encoder.fileformat}")
+        if self.executor is not None:
+            if self.pending is not None:
+                self.pending.result()
+            self.executor.shutdown(wait=True)
+        # Metrics of the images after the last commit
+        self.metrics.write(self.cursor, self.metrics.take())
+        self.con.commit()
         utils.print_boxed(f"Closed connection to {cng.BBOX_DB_FILE}")
         self.con.close()
 
     def _setup_scene(self, imgnr: int):
-        self.maker.clear()
-        self.maker.generate_scene(np.random.randint(*self.nspawnrange))
+        if self.sample_controller is not None:
+            samples = self.sample_controller.next_samples()
+            set_render_samples(samples)
+            print(f"Rendering imgnr {imgnr} with {samples} samples")
+        # Scene is fully determined by the plan or seed, so unfinished jobs can be redone exactly
+        self.n_freed += self.maker.clear()
+        if imgnr in self.plan_slices:
+            self.maker.generate_scene_from_plan(self.plan[self.plan_slices[imgnr]])
+        else:
+            gen.generate_scene_from_seed(self.maker, self.seeds[imgnr], self.nspawnrange)
 
-    def initalize_imgnr_iter(self):
-        maxids = [
-            gen.get_max_imgid(self.cursor, table)
-            for table in (cng.BBOX_DB_TABLE_CPS, cng.BBOX_DB_TABLE_XYZ)
+    @property
+    def plan_dir(self) -> pathlib.Path:
+        return dirpath / self.data_dir / cng.SCENE_PLAN_DIR
+
+    def set_plan(self, plan: np.ndarray, imgnrs: Iterable[int]) -> None:
+        """
+        Use plan for given imgnrs, imgnrs without rows in plan get empty scenes
+        """
+        self.plan = plan
+        index = scene_plan.plan_index(plan)
+        self.plan_slices = {imgnr: index.get(imgnr, slice(0, 0)) for imgnr in imgnrs}
+
+    def plan_rejectors(self) -> List[scene_plan.Rejector]:
+        rejectors = []
+        if self.min_distance is not None:
+            rejectors.append(scene_plan.min_distance_rejector(self.min_distance))
+        if self.max_overlap is not None:
+            rejectors.append(scene_plan.overlap_rejector(*self.maker.src_boxes, self.max_overlap))
+        if self.max_occlusion is not None:
+            camera_params = gen.get_camera_params(bpy.context.scene, self.stdbboxcam)
+            rejectors.append(
+                scene_plan.occlusion_rejector(camera_params, *self.maker.src_boxes, self.max_occlusion)
+            )
+        return rejectors
+
+    def sample_plan(self, imgnrs: List[int]) -> None:
+        """
+        Samples scenes of imgnrs in one batch, every scene from the seed of its imgnr in the job
+        manifest, and saves plan to plan_dir
+        """
+        plan, self.plan_acceptance = scene_plan.sample_scene_plan(
+            imgnrs,
+            [self.seeds[imgnr] for imgnr in imgnrs],
+            self.nspawnrange,
+            self.maker.src_classes,
+            *gen.get_spawnbox(),
+            rejectors=self.plan_rejectors(),
+        )
+        self.plan_dir.mkdir(parents=True, exist_ok=True)
+        np.save(self.plan_dir / cng.SCENE_PLAN_FILE.format(imgnrs[0], imgnrs[-1]), plan)
+        self.set_plan(plan, imgnrs)
+
+    def load_plans(self) -> None:
+        """
+        Loads every saved plan, imgnrs covered by a plan are set up from it
+        """
+        pattern = re.compile(r"(\d+)_(\d+)\.npy$")
+        plans = []
+        imgnrs: List[int] = []
+        for file in sorted(glob.glob(str(self.plan_dir / cng.SCENE_PLAN_FILE.format("*", "*")))):
+            match = pattern.search(file)
+            if match:
+                plans.append(np.load(file))
+                imgnrs.extend(range(int(match.group(1)), int(match.group(2)) + 1))
+        if plans:
+            self.set_plan(np.concatenate(plans), imgnrs)
+
+    def labeled_tables(self) -> List[str]:
+        existing = {
+            x[0] for x in self.cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        }
+        return [table for table in BBOX_TABLES if table in existing]
+
+    def labeled_imgnrs(self) -> Set[int]:
+        imgnrs: Set[int] = set()
+        for table in self.labeled_tables():
+            imgnrs.update(
+                x[0] for x in self.cursor.execute(f"SELECT DISTINCT {cng.BBOX_DB_IMGRNR} FROM {table}")
+            )
+        return imgnrs
+
+    @utils.section("Resume")
+    def plan_resume(self) -> List[int]:
+        """
+        Reconciles job manifest with images on disk and returns imgnrs of unfinished jobs
+
+        Unfinished jobs whose images are all on disk only get their labels extracted again.
+        Images without a job and without labels (e.g. from a crash before the manifest existed)
+        cannot be reproduced, they are moved to ORPHAN_DIR, or deleted with delete_orphans.
+
+        Raises RuntimeError if there are farm shard databases besides this database in the data
+        directory, their images would look like orphans to this database.
+        """
+        data_dir = dirpath / self.data_dir
+        shards = [
+            path
+            for path in sorted(glob.glob(str(data_dir / cng.FARM_SHARD_DB_GLOB)))
+            if os.path.basename(path) != cng.BBOX_DB_FILE
         ]
+        if shards:
+            raise RuntimeError(
+                f"Found {len(shards)} farm shard database(s) in {data_dir}, merge them first with "
+                f"python farm.py --merge-only --dir {self.data_dir}"
+            )
+
+        unfinished = self.manifest.unfinished()
+        imgnrs = [imgnr for imgnr, _, _ in unfinished]
+        self.seeds = {imgnr: seed for imgnr, seed, _ in unfinished}
+        self.load_plans()
+
+        # Uncommitted labels never reach the database, this is just to be sure
+        for table in self.labeled_tables():
+            self.cursor.execute(
+                f"DELETE FROM {table} WHERE {cng.BBOX_DB_IMGRNR} IN "
+                f"(SELECT {cng.BBOX_DB_IMGRNR} FROM {cng.MANIFEST_DB_TABLE} "
+                f"WHERE {cng.MANIFEST_DB_STATE} != ?)",
+                (cng.JOB_COMMITTED,),
+            )
+
+        # Images can be in any format, earlier runs may have used another --encode
+        final_extensions = image_extensions()[:-1]
+        for imgnr in imgnrs:
+            filepath = self.imgpath + str(imgnr)
+            raw_paths = expected_image_paths(filepath, self.view_mode, cng.ENCODE_RAW_EXTENSION)
+            rerender = not all(os.path.exists(path) for path in raw_paths)
+            if not rerender:
+                # Rendered with --encode before a crash, but not encoded
+                extension = cng.ENCODE_FORMATS[self.final_fileformat]
+                paths = expected_image_paths(filepath, self.view_mode, extension)
+                try:
+                    for raw_path, path in zip(raw_paths, paths):
+                        encode_file(raw_path, path, self.final_fileformat)
+                except (ValueError, struct.error) as e:
+                    # Raw file was cut short by the crash
+                    print(f"Could not encode raw file of image {imgnr}, rendering it again: {e}")
+                    rerender = True
+            if rerender:
+                # Partly rendered, the image is rendered again
+                for raw_path in raw_paths:
+                    if os.path.exists(raw_path):
+                        os.remove(raw_path)
+
+            for extension in final_extensions:
+                paths = expected_image_paths(filepath, self.view_mode, extension)
+                if all(os.path.exists(path) for path in paths):
+                    self.relabel[imgnr] = extension
+                    break
+
+        found = find_image_files(os.path.dirname(self.imgpath), self.base_img_name)
+        orphans = set(found) - self.manifest.imgnrs() - self.labeled_imgnrs()
+        orphan_dir = data_dir / cng.ORPHAN_DIR
+        for imgnr in sorted(orphans):
+            for path in found[imgnr]:
+                if self.delete_orphans:
+                    os.remove(path)
+                else:
+                    orphan_dir.mkdir(parents=True, exist_ok=True)
+                    os.replace(path, orphan_dir / os.path.basename(path))
+        self.con.commit()
 
-        maxid = max(maxids)
+        print(f"Unfinished jobs: {len(imgnrs)}")
+        print(f"Jobs with images on disk, only labels are extracted: {len(self.relabel)}")
+        if self.delete_orphans:
+            print(f"Deleted images of {len(orphans)} imgnr(s) without job and labels")
+        else:
+            print(f"Moved images of {len(orphans)} imgnr(s) without job and labels to {orphan_dir}")
+        return imgnrs
 
-        if maxid < 0:
-            maxid = 0
+    def plan_new(self) -> List[int]:
+        """
+        Plans n new jobs continuing from the max imgnr in the database, or at self.start
+        """
+        if self.start is not None:
+            maxid = self.start
         else:
-            maxid += 1
+            maxids = [gen.get_max_imgid(self.cursor, table) for table in self.labeled_tables()]
+            maxids.append(self.manifest.max_imgnr())
+
+            maxid = max(maxids)
+
+            if maxid < 0:
+                maxid = 0
+            else:
+                maxid += 1
+
+        n_unfinished = len(self.manifest.unfinished())
+        if n_unfinished:
+            print(
+                f"{utils.red('WARNING:')} {n_unfinished} unfinished job(s) from earlier runs, "
+                "use --resume to finish them"
+            )
+
+        imgnrs = list(range(maxid, maxid + self.n))
+        self.seeds = {imgnr: scene_plan.seed_for_imgnr(self.base_seed, imgnr) for imgnr in imgnrs}
+        if self.scene_plan and imgnrs:
+            self.sample_plan(imgnrs)
+        self.manifest.plan(imgnrs, [self.seeds[imgnr] for imgnr in imgnrs])
+        self.con.commit()
+        return imgnrs
+
+    def initalize_imgnr_iter(self):
+        if self.resume:
+            imgnrs = self.plan_resume()
+        else:
+            imgnrs = self.plan_new()
 
         self.pre_loop_messages = (
-            f"Imgs to render: {self.n}",
-            f"Starting at index: {maxid}",
-            f"Ends at index: {maxid+self.n-1}",
+            f"Imgs to render: {len(imgnrs)}",
+            f"Starting at index: {imgnrs[0] if imgnrs else None}",
+            f"Ends at index: {imgnrs[-1] if imgnrs else None}",
+            f"Base seed: {self.base_seed}" if not self.resume else "Seeds from job manifest",
             f"Saves images at: {utils.yellow(os.path.join(self.data_dir, cng.IMAGE_DIR))}",
             f"Sqlite3 DB at: {utils.yellow(os.path.join(self.data_dir, cng.BBOX_DB_FILE))}",
             f"Metadata at: {utils.yellow(os.path.join(self.data_dir, cng.METADATA_FILE))}",
             f"bbox_modes: {self.bbox_modes}",
         )
+        if self.plan_acceptance is not None:
+            self.pre_loop_messages += (
+                f"Scene plan at: {utils.yellow(str(self.plan_dir))}",
+                f"Scene plan acceptance rate: {self.plan_acceptance:.3f}",
+            )
 
-        self.maxid = maxid
-        self.imgnr_iter = range(maxid, maxid + self.n)
+        self.imgnr_iter = imgnrs
 
 
 def main(
@@ -320,7 +998,7 @@ def main(
     n : int
         Number of images to render
     bbox_modes : Sequence[str]
-        Sequence of modes to save bounding boxes, given as strings. Available: xyz cps full std
+        Sequence of modes to save bounding boxes, given as strings. Available: xyz cps full std pose std_multi
     wait : bool
         Wait for user input before starting rendering process
     stdbboxcam : bpy.types.Object
@@ -332,7 +1010,7 @@ def main(
 
     scene = gen.Scenemaker()
     gen.create_metadata(scene)
-    con = db.connect(str(dirpath / cng.GENERATED_DATA_DIR / cng.BBOX_DB_FILE))
+    con = connect(str(dirpath / cng.GENERATED_DATA_DIR / cng.BBOX_DB_FILE))
     cursor = con.cursor()
 
     datavisitor = gen.DatadumpVisitor(stdbboxcam=stdbboxcam, bbox_modes=bbox_modes, cursor=cursor)
@@ -440,25 +1118,163 @@ def set_attrs_device(target_device: str) -> None:
 
 
 @utils.section("Engine")
-def set_attrs_engine(engine: str, samples: int) -> None:
+def set_attrs_engine(
+    engine: str,
+    samples: int,
+    noise_threshold: Optional[float] = None,
+    time_budget: Optional[float] = None,
+) -> None:
+    """
+    Parameters
+    ----------
+    engine : str
+        BLENDER_EEVEE or CYCLES
+    samples : int
+        Samples per image, max samples per image if noise_threshold or time_budget is given
+    noise_threshold : Optional[float], optional
+        Use Cycles adaptive sampling, pixels stop sampling when their noise estimate is below
+        this. Needs PATH integrator, so BRANCHED_PATH is not used then
+    time_budget : Optional[float], optional
+        Render seconds per image, see SampleController. Also set as Cycles time limit if the
+        Blender version has one
+    """
     assert engine in ("BLENDER_EEVEE", "CYCLES")
 
     bpy.context.scene.render.engine = engine
     print(f"Render engine is now set to: {utils.yellow(bpy.context.scene.render.engine)}")
 
     if engine == "CYCLES":
-        bpy.context.scene.cycles.progressive = "BRANCHED_PATH"
-        bpy.context.scene.cycles.samples = samples  # .samples for PATH tracing, not r eally used
-        bpy.context.scene.cycles.aa_samples = samples  # .aa_samples for BRANCHED_PATH tracing
-        print(f"Cycles is set to: {bpy.context.scene.cycles.progressive}")
-        print(
-            f"Cycles will render with {utils.yellow(str(bpy.context.scene.cycles.aa_samples))} samples"
-        )
+        cycles = bpy.context.scene.cycles
+        if noise_threshold is not None:
+            # Adaptive sampling only works with path tracing
+            cycles.progressive = "PATH"
+            cycles.use_adaptive_sampling = True
+            cycles.adaptive_threshold = noise_threshold
+            cycles.adaptive_min_samples = min(cng.ADAPTIVE_MIN_SAMPLES, samples)
+            print(f"Cycles adaptive sampling with noise threshold {utils.yellow(str(noise_threshold))}")
+        else:
+            cycles.progressive = "BRANCHED_PATH"
+        if time_budget is not None and hasattr(cycles, "time_limit"):
+            cycles.time_limit = time_budget
+            print(f"Cycles time limit per image: {time_budget} s")
+        set_render_samples(samples)
+        print(f"Cycles is set to: {cycles.progressive}")
+        print(f"Cycles will render with {utils.yellow(str(samples))} samples")
     elif engine == "BLENDER_EEVEE":
         # EEVEE only works with GPU, no need to explicitly set GPU usage
-        bpy.context.scene.eevee.taa_render_samples = samples
+        if noise_threshold is not None:
+            print(f"{utils.red('WARNING:')} Eevee has no adaptive sampling, noise threshold is ignored")
+        set_render_samples(samples)
         print(f"Eevee will render with {bpy.context.scene.eevee.taa_render_samples} samples")
 
+    if time_budget is not None:
+        print(f"Samples are picked per image to render within {utils.yellow(str(time_budget))} s")
+
+
+@utils.section("EEVEE fast profile")
+def set_attrs_eevee_fast() -> None:
+    """
+    Turn off EEVEE effects in EEVEE_FAST_SETTINGS, settings that the Blender version does not
+    have are skipped
+    """
+    eevee = bpy.context.scene.eevee
+    for attr, value in cng.EEVEE_FAST_SETTINGS.items():
+        if hasattr(eevee, attr):
+            setattr(eevee, attr, value)
+            print(f"eevee.{attr} = {utils.yellow(str(value))}")
+        else:
+            print(f"eevee.{attr} does not exist in this Blender version, skipping")
+
+
+@utils.section("Shader warm-up")
+def warm_up_shaders(maker: gen.Scenemaker) -> float:
+    """
+    Render one fish of every source object at low resolution without saving, so shaders of
+    every material are compiled before the render loop instead of during the first images.
+
+    Copies share materials with their source objects (object.copy and mesh.copy link the same
+    materials), so nothing is compiled again during the render loop
+
+    Returns
+    -------
+    float
+        Seconds spent
+    """
+    t0 = time.perf_counter()
+    n = len(maker.src_objects)
+    rng = np.random.default_rng(0)
+    maker.clear()
+    copies = maker.place_objects(
+        maker.src_objects, gen.get_spawn_locs(n, rng=rng), np.zeros((n, 3)), np.ones(n)
+    )
+    materials = {slot.material.name for obj in copies for slot in obj.material_slots if slot.material}
+    print(f"Compiling shaders of {len(materials)} material(s) used by {n} source object(s)")
+
+    render = bpy.context.scene.render
+    percentage = render.resolution_percentage
+    render.resolution_percentage = cng.WARMUP_RESOLUTION_PERCENTAGE
+    bpy.ops.render.render(write_still=False)
+    render.resolution_percentage = percentage
+    maker.clear()
+
+    elapsed = time.perf_counter() - t0
+    print(f"Shader warm-up took {utils.yellow(f'{elapsed:.2f}')} s")
+    return elapsed
+
+
+@utils.section("Image encoding")
+def set_attrs_encode(fileformat: Optional[str]) -> None:
+    """
+    Handles --encode option. The format is not stored anywhere, --resume and the converters
+    find images of every format, see image_extensions
+    """
+    if fileformat is None:
+        print(f"Blender writes {cng.DEFAULT_FILEFORMAT} files while rendering")
+        return
+    print(
+        f"Blender writes {cng.ENCODE_RAW_FILEFORMAT} files, they are encoded to "
+        f"{utils.yellow(fileformat)} in background"
+    )
+
+
+@utils.section("Multi camera rendering")
+def set_attrs_multicam(strategy: str) -> None:
+    """
+    Strategies that render a scene more than once keep Cycles render data between renders, so
+    the scene is not synced again for every camera
+    """
+    print(f"Multi camera strategy: {utils.yellow(strategy)}")
+    if strategy in ("sequential", "auto"):
+        bpy.context.scene.render.use_persistent_data = True
+        print("Persistent render data is enabled")
+
+
+def set_render_samples(samples: int) -> None:
+    """Set samples of current engine, called per image by SampleController"""
+    scene = bpy.context.scene
+    if scene.render.engine == "CYCLES":
+        scene.cycles.samples = samples  # .samples for PATH tracing
+        scene.cycles.aa_samples = samples  # .aa_samples for BRANCHED_PATH tracing
+    else:
+        scene.eevee.taa_render_samples = samples
+
+
+def get_render_settings() -> Dict[str, Union[str, int]]:
+    """
+    Returns
+    -------
+    Dict[str, Union[str, int]]
+        engine, samples and device the scene is rendered with
+    """
+    scene = bpy.context.scene
+    if scene.render.engine == "CYCLES" and scene.cycles.progressive == "PATH":
+        samples = scene.cycles.samples
+    elif scene.render.engine == "CYCLES":
+        samples = scene.cycles.aa_samples
+    else:
+        samples = scene.eevee.taa_render_samples
+    return {"engine": scene.render.engine, "samples": samples, "device": scene.cycles.device}
+
 
 @utils.section("View mode")
 def set_attrs_view(mode: str) -> None:
@@ -548,6 +1364,14 @@ def set_attrs_dir(dir_: str) -> None:
     cng.GENERATED_DATA_DIR = dir_
 
 
+def set_attrs_dbfile(dbfile: Optional[str]) -> None:
+    """
+    Handles --dbfile option, render farm workers write to their own shard database
+    """
+    if dbfile is not None:
+        cng.BBOX_DB_FILE = dbfile
+
+
 utils.section("Clear data")
 def handle_clear(clear: bool, clear_exit: bool, directory: str) -> None:
     """
@@ -686,11 +1510,67 @@ if __name__ == "__main__":
     parser.add_argument(
         "-b",
         "--bbox",
-        help=f"Bounding box type to be stored in SQL database, default: {cng.ARGS_DEFAULT_BBOX_MODE}",
-        choices=(cng.BBOX_MODE_CPS, cng.BBOX_MODE_XYZ, cng.BBOX_MODE_STD, "all"),
+        help=f"Bounding box type to be stored in SQL database, {cng.BBOX_MODE_POSE} only stores poses, "
+        f"the other types are then derived with derive.py, {cng.BBOX_MODE_STD_MULTI} stores std "
+        f"bboxes of every camera, default: {cng.ARGS_DEFAULT_BBOX_MODE}",
+        choices=(
+            cng.BBOX_MODE_CPS,
+            cng.BBOX_MODE_XYZ,
+            cng.BBOX_MODE_FULL,
+            cng.BBOX_MODE_STD,
+            cng.BBOX_MODE_POSE,
+            cng.BBOX_MODE_STD_MULTI,
+            "all",
+        ),
         default=cng.ARGS_DEFAULT_BBOX_MODE,
     )
 
+    parser.add_argument(
+        "--adaptive",
+        help="Use Cycles adaptive sampling with given noise threshold, --samples is then the "
+        f"max samples, default threshold: {cng.ARGS_DEFAULT_NOISE_THRESHOLD}",
+        type=float,
+        nargs="?",
+        const=cng.ARGS_DEFAULT_NOISE_THRESHOLD,
+    )
+
+    parser.add_argument(
+        "--eevee-fast",
+        help="EEVEE production profile: cheap EEVEE settings, pooled fish sharing materials of "
+        "their source objects, and shaders compiled before the render loop. Implies "
+        "--engine BLENDER_EEVEE and --pooled",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--time-budget",
+        help="Pick samples per image (at most --samples) to render within given seconds, samples "
+        "of every image are stored in the metrics table",
+        type=float,
+    )
+
+    parser.add_argument(
+        "--multicam",
+        help="How the cameras of --view-mode are rendered: multiview renders every view with one "
+        "render call, sequential renders one camera at a time with persistent render data, auto "
+        f"benchmarks both on the first image and uses the faster, default: {cng.ARGS_DEFAULT_MULTICAM}",
+        choices=tuple(MULTICAM_RENDERERS) + ("auto",),
+        default=cng.ARGS_DEFAULT_MULTICAM,
+    )
+
+    parser.add_argument(
+        "--encode",
+        help=f"Let Blender write uncompressed {cng.ENCODE_RAW_FILEFORMAT} files and encode them to "
+        "given format in background threads while rendering. WEBP and JPEG need Pillow",
+        choices=tuple(cng.ENCODE_FORMATS),
+    )
+
+    parser.add_argument(
+        "--encode-workers",
+        help=f"Encoder threads with --encode, default: {cng.ENCODE_WORKERS}",
+        type=int,
+    )
+
     parser.add_argument(
         "--reference", help="Include reference objects in render", action="store_false"
     )
@@ -728,11 +1608,87 @@ if __name__ == "__main__":
         nargs=2,
     )
 
+    parser.add_argument(
+        "--pipelined",
+        help="Store labels in a background thread while the next image is set up and rendered",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--pooled",
+        help="Reuse a pool of fish instances instead of copying and removing fish every image",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--start",
+        help="Start at given imgnr instead of continuing from the max imgnr in the database",
+        type=int,
+    )
+
+    parser.add_argument(
+        "--resume",
+        help="Finish unfinished jobs of earlier runs instead of generating n new images",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--delete-orphans",
+        help=f"With --resume, delete images without job and labels instead of moving them to "
+        f"--dir/{cng.ORPHAN_DIR}",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--seed",
+        help="Base seed that seeds of new images are derived from, random by default",
+        type=int,
+    )
+
+    parser.add_argument(
+        "--scene-plan",
+        help=f"Sample scenes of all images up front and save the plan in --dir/{cng.SCENE_PLAN_DIR}",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--min-distance",
+        help="With --scene-plan, resample fish that are closer than this to another fish",
+        type=float,
+    )
+
+    parser.add_argument(
+        "--max-overlap",
+        help="With --scene-plan, resample fish whose bounding box overlaps another by more than "
+        "this fraction, 0 rejects any intersection",
+        type=float,
+    )
+
+    parser.add_argument(
+        "--max-occlusion",
+        help="With --scene-plan, resample fish that are not visible from --stdbboxcam or whose "
+        "projected bounding box is covered by nearer fish by more than this fraction",
+        type=float,
+    )
+
+    parser.add_argument(
+        "--dbfile",
+        help=f"Name of sqlite3 database file in --dir, default: {cng.BBOX_DB_FILE}",
+        type=str,
+    )
+
     args = parser.parse_args()
     set_attrs_dir(args.dir)
+    set_attrs_dbfile(args.dbfile)
     set_attrs_device(args.device)
-    set_attrs_engine(args.engine, args.samples)
+    if args.eevee_fast:
+        args.engine = "BLENDER_EEVEE"
+    set_attrs_engine(args.engine, args.samples, args.adaptive, args.time_budget)
+    if args.eevee_fast:
+        set_attrs_eevee_fast()
     set_attrs_view(args.view_mode)
+    set_attrs_multicam(args.multicam)
+    set_attrs_encode(args.encode)
     show_reference(args.reference)
     handle_clear(args.clear, args.clear_exit, args.dir)
 
@@ -756,6 +1712,21 @@ if __name__ == "__main__":
             stdbboxcam=handle_stdbboxcam(args.stdbboxcam, args.view_mode),
             view_mode=args.view_mode,
             nspawnrange=handle_minmax(args.minmax),
+            start=args.start,
+            pipelined=args.pipelined,
+            pooled=args.pooled or args.eevee_fast,
+            resume=args.resume,
+            delete_orphans=args.delete_orphans,
+            seed=args.seed,
+            scene_plan=args.scene_plan,
+            min_distance=args.min_distance,
+            max_overlap=args.max_overlap,
+            max_occlusion=args.max_occlusion,
+            time_budget=args.time_budget,
+            warm_up=args.eevee_fast,
+            multicam=args.multicam,
+            encode=args.encode,
+            encode_workers=args.encode_workers,
         ).render_loop()
     except (KeyboardInterrupt, EOFError) as e:
         print("Got KeyboardInterrupt or EOFError:")
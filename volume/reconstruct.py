@@ -27,6 +27,7 @@ dirpath = pathlib.Path(dir_)
 import config as cng
 import utils
 from debug import debug, debugs, debugt
+from setup_db import connect
 
 reload(utils)
 reload(cng)
@@ -98,6 +99,9 @@ class Sceneloader:
         self.target_collection = bpy.data.collections[target_collection]
         self.src_objects = tuple(bpy.data.collections[src_collection].all_objects)
         self.data_dir = data_dir
+        self.registry = utils.DatablockRegistry()  # Datablocks made by reconstruct_object
+        # Altered copy of every source material, shared by all reconstructed fish
+        self.altered_materials: Dict[str, bpy.types.Material] = {}
 
         # Will be set in self._connect_and_assert
         self.con: Optional[db.Connection] = None
@@ -115,9 +119,7 @@ class Sceneloader:
 
         Initializes self.con, and self.c
         """
-        self.con = db.connect(
-            f"file:{os.path.join(self.data_dir, cng.BBOX_DB_FILE)}?mode=ro", uri=True
-        )
+        self.con = connect(os.path.join(self.data_dir, cng.BBOX_DB_FILE), readonly=True)
         self.c = self.con.cursor()
 
         # Assert that the table "bboxes_full" exists
@@ -281,6 +283,7 @@ class Sceneloader:
         x, y, z, w, l, h, rx, ry, rz = pos_size_rot
         new_obj = original_object.copy()
         new_obj.data = original_object.data.copy()
+        self.registry.register(new_obj.data)
 
         new_obj.location = np.array((x, y, z)) * (spawnbox.dimensions / 2) + spawnbox.location
         new_obj.dimensions = (w, l, h)
@@ -291,21 +294,31 @@ class Sceneloader:
         new_obj.show_name = True
 
         if alter_material:
-            # Assuming original_object has one material slot, the line below is the same as
-            # new_obj.material_slots[0].material = _og_obj.active_material.copy()
-            new_material = original_object.active_material.copy()
-            new_material = make_fish_colored_transparent(new_material)
-            new_obj.active_material = new_material
+            # Assuming original_object has one material slot. The altered material is made once
+            # per source material, a new material per fish would make EEVEE compile its
+            # shader for every fish
+            key = original_object.active_material.name
+            if key not in self.altered_materials:
+                new_material = make_fish_colored_transparent(original_object.active_material.copy())
+                # Kept for the lifetime of the loader, also when a clear removes unused materials
+                new_material.use_fake_user = True
+                self.altered_materials[key] = new_material
+            new_obj.active_material = self.altered_materials[key]
 
         # Link to target collection
         self.target_collection.objects.link(new_obj)
         return new_obj
 
-    def clear(self) -> None:
+    def clear(self) -> int:
         """
-        Clears objects in target collection
+        Clears objects in target collection and the datablocks made for them
+
+        Returns
+        -------
+        int
+            Number of freed datablocks
         """
-        utils.rm_collection(self.target_collection)
+        return utils.rm_collection(self.target_collection, registry=self.registry)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,335 @@
+"""
+Scene plans, the scenes of a whole batch of images sampled at once
+
+A scene plan has one row per fish with source object, location, rotation and scale, see
+SCENE_PLAN_DTYPE. Fish that are too close to, overlap or are occluded by other fish of their
+scene are resampled by rejectors, which test every scene of the batch at once. Everything here
+is plain NumPy, generate.py places planned scenes in Blender and main.py saves plans to disk.
+
+This file does not depend on Blender, it is NOT meant to be run through Blender.
+
+Written by Naphat Amundsen
+"""
+
+from typing import Callable, Dict, Sequence, Tuple
+
+import numpy as np
+
+import config as cng
+import iou3d
+from derive import project_to_camera_frame
+
+
+def seed_for_imgnr(base_seed: int, imgnr: int) -> int:
+    """
+    Derive seed of an image from a base seed, seeds of different imgnrs are independent
+
+    Returns
+    -------
+    int
+        Seed in [0, 2**32), fits in an SQLite INTEGER
+    """
+    return int(np.random.SeedSequence([base_seed, imgnr]).generate_state(1)[0])
+
+
+# One row per fish, rows of an image are contiguous and images are sorted by imgnr
+SCENE_PLAN_DTYPE = np.dtype(
+    [
+        ("imgnr", np.int64),
+        ("src", np.int64),  # Index into Scenemaker.src_objects
+        ("class_", np.int64),
+        ("location", np.float64, 3),
+        ("rotation", np.float64, 3),  # Euler angles in radians
+        ("scale", np.float64),  # Factor multiplied with scale of source object
+    ]
+)
+
+
+# Rejects fish of a padded batch of scenes, called with (locs, rots, srcs, scales, valid), all
+# padded to (n_imgs, max_n, ...). Returns (n_imgs, max_n) boolean, True for fish to resample
+Rejector = Callable[[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray], np.ndarray]
+
+
+def min_distance_violations(
+    locs: np.ndarray, valid: np.ndarray, min_distance: float
+) -> np.ndarray:
+    """
+    Finds fish that are closer than min_distance to a fish that comes before it in the
+    same scene
+
+    Parameters
+    ----------
+    locs : np.ndarray
+        (n_imgs, max_n, 3) locations, padded
+    valid : np.ndarray
+        (n_imgs, max_n) boolean, False for padding
+
+    Returns
+    -------
+    np.ndarray
+        (n_imgs, max_n) boolean, True for fish that should be resampled
+    """
+    max_n = locs.shape[1]
+    dists = np.linalg.norm(locs[:, :, None] - locs[:, None], axis=-1)
+    # Only pairs (i, j) where j < i, so the first fish of a conflicting pair is kept
+    earlier = np.tri(max_n, k=-1, dtype=bool)
+    close = (dists < min_distance) & earlier & valid[:, :, None] & valid[:, None, :]
+    return close.any(axis=2)
+
+
+def min_distance_rejector(min_distance: float) -> Rejector:
+    """Rejects fish closer than min_distance to another fish, see min_distance_violations"""
+
+    def reject(locs, rots, srcs, scales, valid):
+        return min_distance_violations(locs, valid, min_distance)
+
+    return reject
+
+
+def plan_boxes(
+    locs: np.ndarray,
+    rots: np.ndarray,
+    srcs: np.ndarray,
+    scales: np.ndarray,
+    src_centers: np.ndarray,
+    src_half: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Oriented bounding boxes of planned fish, see Scenemaker.src_boxes
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, np.ndarray]
+        centers (..., 3), half extents (..., 3) and rotation matrices (..., 3, 3)
+    """
+    rotmats = iou3d.euler_to_matrix(rots)
+    offsets = src_centers[srcs] * scales[..., None]  # Bounding box center relative to origin
+    centers = locs + (rotmats @ offsets[..., None])[..., 0]
+    return centers, src_half[srcs] * scales[..., None], rotmats
+
+
+def overlap_rejector(
+    src_centers: np.ndarray,
+    src_half: np.ndarray,
+    max_overlap: float,
+    k: int = 4,
+    chunk_size: int = 1024,
+) -> Rejector:
+    """
+    Rejects fish whose oriented bounding box overlaps the box of a fish that comes before it
+    in the same scene by more than max_overlap
+
+    Parameters
+    ----------
+    src_centers : np.ndarray
+        (n_src, 3) bounding box centers of source objects, see Scenemaker.src_boxes
+    src_half : np.ndarray
+        (n_src, 3) bounding box half extents of source objects
+    max_overlap : float
+        Max fraction of either box that can be inside the other box, estimated from a
+        k x k x k grid of points. With 0, any intersection is rejected (exact test).
+    k : int, optional
+        Grid size for overlap estimation
+    chunk_size : int, optional
+        Scenes tested at a time, bounds memory usage
+    """
+
+    def reject(locs, rots, srcs, scales, valid):
+        max_n = locs.shape[1]
+        earlier = np.tri(max_n, k=-1, dtype=bool)
+        rejected = np.zeros(valid.shape, dtype=bool)
+        for start in range(0, len(locs), chunk_size):
+            s = slice(start, start + chunk_size)
+            c, h, r = plan_boxes(locs[s], rots[s], srcs[s], scales[s], src_centers, src_half)
+            # Pairwise within every scene by broadcasting (n, max_n, 1) against (n, 1, max_n)
+            a = (c[:, :, None], h[:, :, None], r[:, :, None])
+            b = (c[:, None], h[:, None], r[:, None])
+            bad = iou3d.obb_intersect(*a, *b)
+            bad &= earlier & valid[s, :, None] & valid[s, None, :]
+            if max_overlap > 0:
+                # Overlap is only estimated for intersecting pairs
+                img, i, j = np.nonzero(bad)
+                a = (c[img, i], h[img, i], r[img, i])
+                b = (c[img, j], h[img, j], r[img, j])
+                frac = np.maximum(
+                    iou3d.inside_fraction(*a, *b, k=k), iou3d.inside_fraction(*b, *a, k=k)
+                )
+                bad[img, i, j] = frac > max_overlap
+            rejected[s] = bad.any(axis=2)
+        return rejected
+
+    return reject
+
+
+def occlusion_rejector(
+    camera_params: Tuple[np.ndarray, np.ndarray, bool],
+    src_centers: np.ndarray,
+    src_half: np.ndarray,
+    max_occlusion: float,
+    k: int = 4,
+) -> Rejector:
+    """
+    Rejects fish that are not visible from camera, or whose projected bounding box is
+    covered by more than max_occlusion by projected boxes of fish nearer the camera.
+
+    Projected boxes of the oriented bounding boxes are larger than the fish silhouettes, so
+    occlusion is overestimated.
+
+    Parameters
+    ----------
+    camera_params : Tuple[np.ndarray, np.ndarray, bool]
+        See get_camera_params
+    src_centers : np.ndarray
+        (n_src, 3) bounding box centers of source objects, see Scenemaker.src_boxes
+    src_half : np.ndarray
+        (n_src, 3) bounding box half extents of source objects
+    max_occlusion : float
+        Max covered fraction, estimated from a k x k grid of points in every projected box
+    """
+    cam_inv, frame, camera_persp = camera_params
+    ticks = (np.arange(k) + 0.5) / k
+    grid = np.stack(np.meshgrid(ticks, ticks, indexing="ij"), axis=-1).reshape(-1, 2)
+
+    def reject(locs, rots, srcs, scales, valid):
+        n_imgs, max_n = valid.shape
+        c, h, r = plan_boxes(locs, rots, srcs, scales, src_centers, src_half)
+        corners = iou3d.box_corners(c, h, r) @ cam_inv[:3, :3].T + cam_inv[:3, 3]
+        x, y = project_to_camera_frame(corners.reshape(-1, 3), frame, camera_persp)
+        x = np.clip(x.reshape(n_imgs, max_n, 8), 0.0, 1.0)
+        y = np.clip(y.reshape(n_imgs, max_n, 8), 0.0, 1.0)
+        boxes = np.stack((x.min(-1), y.min(-1), x.max(-1), y.max(-1)), axis=-1)
+
+        # Camera looks along its negative z axis
+        depth = -(c @ cam_inv[:3, :3].T + cam_inv[:3, 3])[..., 2]
+        invisible = (depth <= 0) | (boxes[..., 2] <= boxes[..., 0]) | (boxes[..., 3] <= boxes[..., 1])
+
+        # Sample points of every box (n_imgs, max_n, k*k, 2)
+        points = boxes[..., None, :2] + grid * (boxes[..., None, 2:] - boxes[..., None, :2])
+        # Covered by box of fish i, (n_imgs, max_n (j), max_n (i), k*k)
+        px = points[:, :, None, :, 0]
+        py = points[:, :, None, :, 1]
+        ob = boxes[:, None, :, None, :]
+        covered = (px >= ob[..., 0]) & (px <= ob[..., 2]) & (py >= ob[..., 1]) & (py <= ob[..., 3])
+        nearer = (depth[:, None, :] < depth[:, :, None]) & valid[:, None, :] & ~invisible[:, None, :]
+        occluded = (covered & nearer[..., None]).any(axis=2).mean(axis=-1)
+
+        return valid & (invisible | (occluded > max_occlusion))
+
+    return reject
+
+
+def sample_scene_plan(
+    imgnrs: Sequence[int],
+    seeds: Sequence[int],
+    nspawnrange: Tuple[int, int],
+    src_classes: Sequence[int],
+    spawnbox_location: np.ndarray,
+    spawnbox_scale: np.ndarray,
+    rejectors: Sequence[Rejector] = (),
+    max_tries: int = cng.SCENE_PLAN_MAX_TRIES,
+) -> Tuple[np.ndarray, float]:
+    """
+    Samples the scenes of a whole batch of images at once, does not touch Blender
+
+    Every scene is drawn from the generator of its own seed, in the same order as
+    generate_scene_from_seed, so a scene does not depend on the other scenes of the batch. Scenes
+    without rejected fish are the same as generate_scene_from_seed gives, scenes with rejected
+    fish are reproduced by generate_scene_from_seed given the same rejectors.
+
+    Parameters
+    ----------
+    imgnrs : Sequence[int]
+        Imgnrs of the scenes
+    seeds : Sequence[int]
+        Seed of every scene, see seed_for_imgnr
+    nspawnrange : Tuple[int, int]
+        Number of fish in a scene is drawn from ~U(*nspawnrange)
+    src_classes : Sequence[int]
+        Class of every source object, fish are drawn uniformly from the source objects
+    spawnbox_location : np.ndarray
+        Center of spawnbox, see get_spawnbox
+    spawnbox_scale : np.ndarray
+        Half extents of spawnbox, see get_spawnbox
+    rejectors : Sequence[Rejector], optional
+        Fish rejected by any rejector get their location and rotation resampled, e.g.
+        min_distance_rejector, overlap_rejector and occlusion_rejector
+    max_tries : int, optional
+        Max rounds of resampling, fish that still are rejected are kept
+
+    Returns
+    -------
+    Tuple[np.ndarray, float]
+        Plan with dtype SCENE_PLAN_DTYPE, and acceptance rate of sampled placements
+    """
+    imgnrs = np.asarray(imgnrs, dtype=np.int64)
+    n_imgs = len(imgnrs)
+    rngs = [np.random.default_rng(seed) for seed in seeds]
+    counts = np.array([int(rng.integers(*nspawnrange)) for rng in rngs], dtype=np.int64)
+    max_n = int(counts.max()) if n_imgs else 0
+    valid = np.arange(max_n) < counts[:, None]
+
+    def draw_placements(rng: np.random.Generator, n: int) -> Tuple[np.ndarray, np.ndarray]:
+        # Same draws as get_spawn_locs and get_euler_rotations
+        locs = rng.uniform(low=-spawnbox_scale, high=spawnbox_scale, size=(n, 3)) + spawnbox_location
+        return locs, rng.normal(loc=cng.ROT_MUS, scale=cng.ROT_STDS, size=(n, 3))
+
+    # Everything is padded to (n_imgs, max_n), padding is dropped at the end. Drawing is done
+    # per scene, rejection is done for every scene at once.
+    locs = np.zeros((n_imgs, max_n, 3))
+    rots = np.zeros((n_imgs, max_n, 3))
+    srcs = np.zeros((n_imgs, max_n), dtype=np.int64)
+    scales = np.zeros((n_imgs, max_n))
+    for i, (rng, n) in enumerate(zip(rngs, counts)):
+        locs[i, :n], rots[i, :n] = draw_placements(rng, n)
+        srcs[i, :n] = rng.integers(len(src_classes), size=n)
+        scales[i, :n] = rng.normal(loc=cng.RAND_SCALE_MU, scale=cng.RAND_SCALE_STD, size=n)
+
+    def rejected(scenes: np.ndarray) -> np.ndarray:
+        args = (locs[scenes], rots[scenes], srcs[scenes], scales[scenes], valid[scenes])
+        result = np.zeros(valid[scenes].shape, dtype=bool)
+        for reject in rejectors:
+            result |= reject(*args)
+        return result & valid[scenes]
+
+    n_fish = int(counts.sum())
+    n_drawn = n_fish
+    if rejectors:
+        # Only scenes that had fish resampled need to be tested again
+        scenes = np.arange(n_imgs)
+        for _ in range(max_tries):
+            resample = rejected(scenes)
+            n_rejected = int(resample.sum())
+            if n_rejected == 0:
+                break
+            for scene, row in zip(scenes, resample):
+                if row.any():
+                    cols = np.flatnonzero(row)
+                    locs[scene, cols], rots[scene, cols] = draw_placements(rngs[scene], len(cols))
+            n_drawn += n_rejected
+            scenes = scenes[resample.any(axis=1)]
+        else:
+            n_left = int(rejected(scenes).any(axis=1).sum())
+            print(f"WARNING: {n_left} scene(s) still have rejected fish after {max_tries} tries")
+
+    plan = np.empty(n_fish, dtype=SCENE_PLAN_DTYPE)
+    plan["imgnr"] = np.repeat(imgnrs, counts)
+    plan["src"] = srcs[valid]
+    plan["class_"] = np.asarray(src_classes, dtype=np.int64)[plan["src"]]
+    plan["location"] = locs[valid]
+    plan["rotation"] = rots[valid]
+    plan["scale"] = scales[valid]
+    return plan, (n_fish / n_drawn if n_drawn else 1.0)
+
+
+def plan_index(plan: np.ndarray) -> Dict[int, slice]:
+    """
+    Returns
+    -------
+    Dict[int, slice]
+        imgnr -> slice of its rows in plan
+    """
+    imgnrs, starts, counts = np.unique(plan["imgnr"], return_index=True, return_counts=True)
+    return {
+        int(imgnr): slice(int(start), int(start + count))
+        for imgnr, start, count in zip(imgnrs, starts, counts)
+    }
@@ -1,12 +1,68 @@
 import pathlib
-from typing import Callable, Optional, Tuple
+import argparse
+import socket
+import tempfile
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
 import config as cng
 import sqlite3 as db
+import numpy as np
 import os
 
 GEN_DIR = pathlib.Path(cng.GENERATED_DATA_DIR)
 LABELCHECK_DIR = pathlib.Path(cng.LABELCHECK_DATA_DIR)
 
+BBOX_TABLES: Tuple[str, ...] = (
+    cng.BBOX_DB_TABLE_CPS,
+    cng.BBOX_DB_TABLE_XYZ,
+    cng.BBOX_DB_TABLE_STD,
+    cng.BBOX_DB_TABLE_FULL,
+    cng.BBOX_DB_TABLE_POSE,
+    cng.BBOX_DB_TABLE_STD_MULTI,
+)
+# Tables of constants needed to derive bbox tables from poses, see derive.py
+CONSTANT_TABLES: Tuple[str, ...] = (
+    cng.SOURCE_DB_TABLE,
+    cng.CAMERA_DB_TABLE,
+    cng.SPAWNBOX_DB_TABLE,
+)
+# Tables that are stored without rounding, derived labels must not suffer rounding twice
+FULL_PRECISION_TABLES: Tuple[str, ...] = (cng.BBOX_DB_TABLE_POSE,)
+# Stages of render_loop that are timed, seconds of stage s are in column s_time of metrics table
+METRIC_STAGES: Tuple[str, ...] = ("setup", "render", "assertion", "labels", "commit")
+IMGNR_TABLES: Tuple[str, ...] = BBOX_TABLES + (cng.MANIFEST_DB_TABLE,)
+
+
+def connect(file: str, readonly: bool = False, **kwargs) -> db.Connection:
+    """Connect to sqlite3 database using the tuning profile in config file
+
+    Writers put the database in WAL mode with relaxed synchronous, so readers can query while
+    data is being generated without blocking the writer. Readers get memory mapped I/O.
+
+    Parameters
+    ----------
+    file : str
+        Database file, will be created if not existing unless readonly
+    readonly : bool, optional
+        Open in read only mode, by default False
+    kwargs :
+        Passed on to sqlite3.connect
+
+    Returns
+    -------
+    db.Connection
+    """
+    if readonly:
+        con = db.connect(f"file:{file}?mode=ro", uri=True, **kwargs)
+        con.execute(f"PRAGMA mmap_size={cng.DB_MMAP_SIZE}")
+    else:
+        con = db.connect(file, **kwargs)
+        # journal_mode is persistent, it is stored in the database file
+        con.execute(f"PRAGMA journal_mode={cng.DB_JOURNAL_MODE}")
+        con.execute(f"PRAGMA synchronous={cng.DB_SYNCHRONOUS}")
+    con.execute(f"PRAGMA cache_size={cng.DB_CACHE_SIZE}")
+    return con
+
 class DatabaseMaker:
     """
     Used for setting up sqlite3 database for generated data
@@ -17,13 +73,18 @@ class DatabaseMaker:
         Connects to .db file on initialization, creates one if not existing
         """
         # This makes the .db file if not existing
-        self.con: db.Connection = db.connect(file)
+        self.con: db.Connection = connect(file)
         self.cursor: db.Cursor = self.con.cursor()
         self.table_create_funcs: Tuple[Callable] = (
             self.create_bboxes_cps_table,
             self.create_bboxes_xyz_table,
             self.create_bboxes_std_table,
             self.create_bboxes_full_table,
+            self.create_manifest_table,
+            self.create_pose_tables,
+            self.create_metrics_table,
+            self.create_bboxes_std_multi_table,
+            self.create_imgnr_indexes,
         )
 
     def __del__(self):
@@ -129,6 +190,158 @@ class DatabaseMaker:
         """
         )
     
+    def create_manifest_table(self) -> None:
+        """
+        Creates job manifest table if not existing, see JobManifest
+        """
+        self.cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {cng.MANIFEST_DB_TABLE} (
+                {cng.BBOX_DB_IMGRNR} INTEGER NOT NULL PRIMARY KEY,
+                {cng.MANIFEST_DB_SEED} INTEGER NOT NULL,
+                {cng.MANIFEST_DB_STATE} TEXT NOT NULL
+            )
+        """
+        )
+
+    def create_pose_tables(self) -> None:
+        """
+        Creates poses table and the tables of constants needed to derive bbox tables from it if
+        not existing, see derive.py
+        """
+        self.cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {cng.BBOX_DB_TABLE_POSE} (
+                {cng.BBOX_DB_IMGRNR} INTEGER NOT NULL,
+                {cng.BBOX_DB_CLASS} INTEGER NOT NULL,
+                x REAL NOT NULL,
+                y REAL NOT NULL,
+                z REAL NOT NULL,
+                rx REAL NOT NULL,
+                ry REAL NOT NULL,
+                rz REAL NOT NULL,
+                sx REAL NOT NULL,
+                sy REAL NOT NULL,
+                sz REAL NOT NULL
+            )
+        """
+        )
+        # Bounding box and convex hull points (float64 bytes) of source objects, local space
+        self.cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {cng.SOURCE_DB_TABLE} (
+                {cng.BBOX_DB_CLASS} INTEGER NOT NULL PRIMARY KEY,
+                min_x REAL NOT NULL,
+                min_y REAL NOT NULL,
+                min_z REAL NOT NULL,
+                max_x REAL NOT NULL,
+                max_y REAL NOT NULL,
+                max_z REAL NOT NULL,
+                hull BLOB NOT NULL
+            )
+        """
+        )
+        # World to camera matrix and frame (float64 bytes), see generate.get_camera_params
+        self.cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {cng.CAMERA_DB_TABLE} (
+                name TEXT NOT NULL PRIMARY KEY,
+                matrix BLOB NOT NULL,
+                frame BLOB NOT NULL,
+                persp INTEGER NOT NULL
+            )
+        """
+        )
+        self.cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {cng.SPAWNBOX_DB_TABLE} (
+                name TEXT NOT NULL PRIMARY KEY,
+                x REAL NOT NULL,
+                y REAL NOT NULL,
+                z REAL NOT NULL,
+                w REAL NOT NULL,
+                l REAL NOT NULL,
+                h REAL NOT NULL
+            )
+        """
+        )
+
+    def create_metrics_table(self) -> None:
+        """
+        Creates metrics table if not existing, see MetricsRecorder
+        """
+        stages = ",\n".join(f"{stage}_time REAL NOT NULL" for stage in METRIC_STAGES)
+        self.cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {cng.METRICS_DB_TABLE} (
+                run TEXT NOT NULL,
+                {cng.BBOX_DB_IMGRNR} INTEGER NOT NULL,
+                finished REAL NOT NULL,
+                n_fish INTEGER NOT NULL,
+                rendered INTEGER NOT NULL,
+                engine TEXT NOT NULL,
+                samples INTEGER NOT NULL,
+                device TEXT NOT NULL,
+                {stages}
+            )
+        """
+        )
+
+    def create_bboxes_std_multi_table(self) -> None:
+        """
+        Creates table of standard bounding boxes of every camera if not existing. Rows are keyed
+        by imgnr, camera and object, camera is the numerical camera (see derive.camera_numbers)
+        and object is the index of the fish within its image, so boxes of a fish can be matched
+        between cameras.
+
+        The key is enforced by a unique index, so merging a shard twice or deriving an image
+        again fails instead of adding duplicate rows. The index is also added to tables made
+        before it, which fails if the table already has duplicates
+        """
+        table = cng.BBOX_DB_TABLE_STD_MULTI
+        self.cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                {cng.BBOX_DB_IMGRNR} INTEGER NOT NULL,
+                {cng.BBOX_DB_CLASS} INTEGER NOT NULL,
+                camera INTEGER NOT NULL,
+                object INTEGER NOT NULL,
+                x REAL NOT NULL,
+                y REAL NOT NULL,
+                w REAL NOT NULL,
+                h REAL NOT NULL
+            )
+        """
+        )
+        try:
+            self.cursor.execute(
+                f"CREATE UNIQUE INDEX IF NOT EXISTS {table}_key_idx "
+                f"ON {table} ({cng.BBOX_DB_IMGRNR}, camera, object)"
+            )
+        except db.IntegrityError as e:
+            raise ValueError(
+                f"{table} has several rows with the same imgnr, camera and object, remove the "
+                "duplicates before migrating"
+            ) from e
+
+    def create_imgnr_indexes(self) -> None:
+        """
+        Creates indexes on imgnr for the bbox tables that exist, existing indexes are left as
+        they are, so this also works as a migration for databases made before the indexes.
+
+        The labelcheck table does not need one since imgnr is its primary key
+        """
+        tables = {
+            x[0] for x in self.cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        }
+        for table in BBOX_TABLES:
+            if table in tables:
+                self.cursor.execute(
+                    f"CREATE INDEX IF NOT EXISTS {table}_{cng.BBOX_DB_IMGRNR}_idx "
+                    f"ON {table} ({cng.BBOX_DB_IMGRNR})"
+                )
+        self.con.commit()
+
     def create_labelcheck_table(self) -> None:
         """
         Creating tables does not require commiting.
@@ -145,12 +358,462 @@ class DatabaseMaker:
         )
 
 
+def get_max_imgnr(file: str, tables: Sequence[str] = IMGNR_TABLES) -> int:
+    """
+    Get max imgnr over given tables in database file
+
+    Returns
+    -------
+    maxid if there are any entries in the tables, else return -1
+    """
+    if not os.path.isfile(file):
+        return -1
+
+    con = connect(file, readonly=True)
+    maxid = -1
+    for (table,) in con.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall():
+        if table in tables:
+            res = con.execute(f"SELECT MAX({cng.BBOX_DB_IMGRNR}) FROM {table}").fetchone()[0]
+            if res is not None:
+                maxid = max(maxid, res)
+    con.close()
+    return maxid
+
+
+def merge_databases(target: str, sources: Iterable[str], remove: bool = True) -> int:
+    """
+    Merge bbox tables from source databases (e.g. render farm shards) into target database.
+    Target database and its tables will be created if not existing.
+
+    Parameters
+    ----------
+    target : str
+        Database file to merge into
+    sources : Iterable[str]
+        Database files to merge from, tables that are missing in a source are skipped
+    remove : bool, optional
+        Remove source files after they are merged, by default True
+
+    Returns
+    -------
+    int
+        Number of rows merged into target
+    """
+    is_new = not os.path.isfile(target)
+    maker = DatabaseMaker(target)
+    if is_new:
+        for f in maker.table_create_funcs:
+            f()
+    else:
+        maker.create_manifest_table()
+        maker.create_pose_tables()
+        maker.create_metrics_table()
+        maker.create_bboxes_std_multi_table()
+    maker.close()
+
+    con = connect(target)
+    n_rows = 0
+    for source in sources:
+        con.execute("ATTACH DATABASE ? AS shard", (source,))
+        shard_tables = {
+            x[0] for x in con.execute("SELECT name FROM shard.sqlite_master WHERE type='table'")
+        }
+        # One transaction per shard, so a shard is either fully merged or not at all
+        with con:
+            for table in BBOX_TABLES:
+                if table in shard_tables:
+                    n_rows += con.execute(
+                        f"INSERT INTO main.{table} SELECT * FROM shard.{table}"
+                    ).rowcount
+            if cng.MANIFEST_DB_TABLE in shard_tables:
+                con.execute(
+                    f"INSERT OR REPLACE INTO main.{cng.MANIFEST_DB_TABLE} "
+                    f"SELECT * FROM shard.{cng.MANIFEST_DB_TABLE}"
+                )
+            for table in CONSTANT_TABLES:
+                if table in shard_tables:
+                    con.execute(f"INSERT OR IGNORE INTO main.{table} SELECT * FROM shard.{table}")
+            if cng.METRICS_DB_TABLE in shard_tables:
+                con.execute(
+                    f"INSERT INTO main.{cng.METRICS_DB_TABLE} SELECT * FROM shard.{cng.METRICS_DB_TABLE}"
+                )
+        con.execute("DETACH DATABASE shard")
+        if remove:
+            os.remove(source)
+    con.close()
+    return n_rows
+
+
+class JobManifest:
+    """
+    Job manifest of generation runs, stores state and RNG seed of every imgnr.
+
+    States go planned -> rendered -> labeled -> committed. Planned jobs are committed
+    right away, the other states are committed together with the labels, so after a crash every
+    job that is not committed has to be redone. Since the seed is stored, a job whose images
+    are already on disk only needs its labels to be extracted again.
+    """
+
+    def __init__(self, cursor: db.Cursor):
+        self.cursor = cursor
+
+    def plan(self, imgnrs: Sequence[int], seeds: Sequence[int]) -> None:
+        self.cursor.executemany(
+            f"INSERT INTO {cng.MANIFEST_DB_TABLE} VALUES (?, ?, ?)",
+            ((imgnr, seed, cng.JOB_PLANNED) for imgnr, seed in zip(imgnrs, seeds)),
+        )
+
+    def mark(self, imgnr: int, state: str) -> None:
+        self.cursor.execute(
+            f"UPDATE {cng.MANIFEST_DB_TABLE} SET {cng.MANIFEST_DB_STATE} = ? "
+            f"WHERE {cng.BBOX_DB_IMGRNR} = ?",
+            (state, imgnr),
+        )
+
+    def commit_labeled(self) -> None:
+        """
+        Marks labeled jobs as committed, call right before committing the labels
+        """
+        self.cursor.execute(
+            f"UPDATE {cng.MANIFEST_DB_TABLE} SET {cng.MANIFEST_DB_STATE} = ? "
+            f"WHERE {cng.MANIFEST_DB_STATE} = ?",
+            (cng.JOB_COMMITTED, cng.JOB_LABELED),
+        )
+
+    def unfinished(self) -> List[Tuple[int, int, str]]:
+        """
+        Returns
+        -------
+        List[Tuple[int, int, str]]
+            [(imgnr, seed, state), ...] of jobs that are not committed, sorted by imgnr
+        """
+        return self.cursor.execute(
+            f"SELECT {cng.BBOX_DB_IMGRNR}, {cng.MANIFEST_DB_SEED}, {cng.MANIFEST_DB_STATE} "
+            f"FROM {cng.MANIFEST_DB_TABLE} WHERE {cng.MANIFEST_DB_STATE} != ? "
+            f"ORDER BY {cng.BBOX_DB_IMGRNR}",
+            (cng.JOB_COMMITTED,),
+        ).fetchall()
+
+    def imgnrs(self) -> Set[int]:
+        return {
+            x[0] for x in self.cursor.execute(f"SELECT {cng.BBOX_DB_IMGRNR} FROM {cng.MANIFEST_DB_TABLE}")
+        }
+
+    def max_imgnr(self) -> int:
+        """
+        Returns
+        -------
+        max imgnr in manifest, -1 if empty
+        """
+        maxid = self.cursor.execute(
+            f"SELECT MAX({cng.BBOX_DB_IMGRNR}) FROM {cng.MANIFEST_DB_TABLE}"
+        ).fetchone()[0]
+        return -1 if maxid is None else maxid
+
+
+class MetricsRecorder:
+    """
+    Buffers per image timings of render_loop, rows are written to the metrics table together
+    with the labels. Every recorder is a run, runs are named by host, process and start time.
+
+    In pipelined mode, labels and commit are the time the render loop waits for them, not the
+    time the background thread spends on them.
+    """
+
+    def __init__(self, engine: str, samples: int, device: str):
+        self.run: str = f"{socket.gethostname()}-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}"
+        self.settings: Tuple[str, int, str] = (engine, samples, device)
+        self.rows: List[tuple] = []
+
+    def add(
+        self,
+        imgnr: int,
+        n_fish: int,
+        rendered: bool,
+        timings: Dict[str, float],
+        samples: Optional[int] = None,
+    ) -> None:
+        """
+        Parameters
+        ----------
+        timings : Dict[str, float]
+            Seconds spent in every stage in METRIC_STAGES
+        samples : Optional[int]
+            Samples of this image if they are picked per image, by default the run's samples
+        """
+        engine, run_samples, device = self.settings
+        self.rows.append(
+            (
+                self.run,
+                imgnr,
+                time.time(),
+                n_fish,
+                rendered,
+                engine,
+                run_samples if samples is None else samples,
+                device,
+                *(timings[stage] for stage in METRIC_STAGES),
+            )
+        )
+
+    def take(self) -> List[tuple]:
+        """Returns buffered rows and empties buffer"""
+        rows, self.rows = self.rows, []
+        return rows
+
+    @staticmethod
+    def write(cursor: db.Cursor, rows: Sequence[tuple]) -> None:
+        """Insert rows from take, does not commit"""
+        n_columns = 8 + len(METRIC_STAGES)
+        cursor.executemany(
+            f"INSERT INTO {cng.METRICS_DB_TABLE} VALUES ({', '.join('?' * n_columns)})", rows
+        )
+
+
+def summarize_metrics(file: str, run: Optional[str] = None) -> None:
+    """
+    Print throughput and p50/p95 of every stage per run
+
+    Throughput is images per second of wall time between the first and last image of the run,
+    the time the first image took is estimated by the median time per image
+    """
+    con = connect(file, readonly=True)
+    where, params = ("WHERE run = ?", (run,)) if run is not None else ("", ())
+    rows = con.execute(
+        f"SELECT run, finished, n_fish, rendered, engine, samples, device, "
+        f"{', '.join(f'{stage}_time' for stage in METRIC_STAGES)} "
+        f"FROM {cng.METRICS_DB_TABLE} {where} ORDER BY run, finished",
+        params,
+    ).fetchall()
+    con.close()
+    if not rows:
+        print("No metrics found")
+        return
+
+    runs: Dict[str, List[tuple]] = {}
+    for row in rows:
+        runs.setdefault(row[0], []).append(row)
+
+    for name, run_rows in runs.items():
+        _, finished, n_fish, rendered, engine, samples, device = zip(*(r[:7] for r in run_rows))
+        stages = np.array([r[7:] for r in run_rows], dtype=np.float64)
+        totals = stages.sum(axis=1)
+        wall = finished[-1] - finished[0] + np.median(totals)
+
+        print(f"Run {name}: {engine[0]}, {device[0]}, samples p50 {np.median(samples):.0f}")
+        print(
+            f"  {len(run_rows)} images ({sum(rendered)} rendered), {np.mean(n_fish):.1f} fish per "
+            f"image, {len(run_rows) / wall:.3f} images/s"
+        )
+        if len(totals) > 1:
+            print(
+                f"  First image {totals[0]:.3f} s, steady state p50 {np.median(totals[1:]):.3f} s "
+                "(time to first image with startup is printed by main.py)"
+            )
+        print(f"  {'stage':<12}{'p50 s':>10}{'p95 s':>10}{'mean s':>10}{'share':>8}")
+        for stage, times in zip((*METRIC_STAGES, "total"), (*stages.T, totals)):
+            p50, p95 = np.percentile(times, (50, 95))
+            share = times.sum() / totals.sum()
+            print(f"  {stage:<12}{p50:>10.3f}{p95:>10.3f}{times.mean():>10.3f}{share:>8.1%}")
+        render_share = stages[:, METRIC_STAGES.index("render")].sum() / totals.sum()
+        bound = "Render" if render_share >= 0.5 else "Python overhead"
+        print(f"  {bound} bound ({render_share:.1%} of time in render)\n")
+
+
+class LabelWriter:
+    """
+    Buffers label rows in preallocated arrays and writes them in bulk. Rows for every table
+    are written with one executemany per table in a single transaction when flushed.
+    """
+
+    def __init__(self, con: db.Connection, capacity: Optional[int] = None):
+        """
+        Parameters
+        ----------
+        con : db.Connection
+            Connection to write to, flush will commit on this connection
+        capacity : Optional[int]
+            Initial number of rows per table buffer, buffers grow when full.
+            Defaults to value in config file
+        """
+        self.con = con
+        self.capacity: int = cng.LABELWRITER_CAPACITY if capacity is None else capacity
+
+        # table -> (imgnrs, classes, values), values is (capacity, n_values)
+        self.buffers: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        self.sizes: Dict[str, int] = {}
+        self.statements: Dict[str, str] = {}  # Prepared insert statement per table
+
+    def _get_buffer(self, table: str, n_values: int, n_rows: int):
+        """
+        Get buffer for table, allocates or grows buffer if it cannot fit n_rows more rows
+        """
+        if table not in self.buffers:
+            # First two "?" are for image id and class respectively, rest are for values
+            self.statements[table] = f"INSERT INTO {table} VALUES ({','.join('?' * (n_values + 2))})"
+            self.buffers[table] = (
+                np.empty(self.capacity, dtype=np.int64),
+                np.empty(self.capacity, dtype=np.int64),
+                np.empty((self.capacity, n_values), dtype=np.float64),
+            )
+            self.sizes[table] = 0
+
+        imgnrs, classes, values = self.buffers[table]
+        size = self.sizes[table]
+        if size + n_rows > len(imgnrs):
+            new_capacity = max(2 * len(imgnrs), size + n_rows)
+            imgnrs = np.resize(imgnrs, new_capacity)
+            classes = np.resize(classes, new_capacity)
+            values = np.concatenate((values, np.empty((new_capacity - len(values), n_values))))
+            self.buffers[table] = (imgnrs, classes, values)
+
+        return self.buffers[table]
+
+    def add(self, table: str, imgnr: int, classes: np.ndarray, values: np.ndarray) -> None:
+        """Add rows of one image to buffer of table
+
+        Parameters
+        ----------
+        table : str
+            Table name in SQL database
+        imgnr : Union[int, np.ndarray]
+            imgnr of every row, or (n,) imgnrs if rows are of several images
+        classes : np.ndarray
+            (n,) numerical classes
+        values : np.ndarray
+            (n, n_values), values of row i are flattened if they are not already
+        """
+        n_rows = len(classes)
+        values = np.asarray(values).reshape(n_rows, -1)
+        imgnrs_buf, classes_buf, values_buf = self._get_buffer(table, values.shape[1], n_rows)
+
+        size = self.sizes[table]
+        imgnrs_buf[size : size + n_rows] = imgnr
+        classes_buf[size : size + n_rows] = classes
+        values_buf[size : size + n_rows] = values
+        self.sizes[table] = size + n_rows
+
+    def flush(self) -> int:
+        """
+        Write buffered rows and commit
+
+        Returns
+        -------
+        int
+            Number of rows written
+        """
+        n_rows = 0
+        with self.con:  # Single transaction, commits on exit
+            for table, (imgnrs, classes, values) in self.buffers.items():
+                size = self.sizes[table]
+                if size == 0:
+                    continue
+                values = values[:size]
+                if table not in FULL_PRECISION_TABLES:
+                    values = values.round(3)
+                rows = zip(imgnrs[:size].tolist(), classes[:size].tolist(), *values.T.tolist())
+                self.con.executemany(self.statements[table], rows)
+                self.sizes[table] = 0
+                n_rows += size
+        return n_rows
+
+
+def benchmark_labelwriter(n_imgs: int, n_objects: int) -> None:
+    """
+    Compare rows per second of LabelWriter against storing every image and bbox mode with its
+    own executemany, which is how DatadumpVisitor._db_store used to work
+    """
+    tables = {
+        cng.BBOX_DB_TABLE_CPS: 24,
+        cng.BBOX_DB_TABLE_XYZ: 3,
+        cng.BBOX_DB_TABLE_STD: 4,
+        cng.BBOX_DB_TABLE_FULL: 9,
+    }
+    rng = np.random.default_rng(42)
+    labels = {
+        table: [
+            (rng.integers(0, 6, n_objects), rng.normal(size=(n_objects, n_values)))
+            for _ in range(n_imgs)
+        ]
+        for table, n_values in tables.items()
+    }
+    n_rows = n_imgs * n_objects * len(tables)
+
+    def per_image_store(con: db.Connection) -> None:
+        cursor = con.cursor()
+        for i in range(n_imgs):
+            for table, n_values in tables.items():
+                classes, values = labels[table][i]
+                gen = ((i, class_, *points.ravel().round(3)) for class_, points in zip(classes, values))
+                sql_command = (
+                    f'INSERT INTO {table} VALUES {("?","?",*["?" for i in range(n_values)])}'
+                ).replace("'", "")
+                cursor.executemany(sql_command, gen)
+            if not i % cng.COMMIT_INTERVAL:
+                con.commit()
+        con.commit()
+
+    def labelwriter_store(con: db.Connection) -> None:
+        writer = LabelWriter(con)
+        for i in range(n_imgs):
+            for table in tables:
+                classes, values = labels[table][i]
+                writer.add(table, i, classes, values)
+            if not i % cng.COMMIT_INTERVAL:
+                writer.flush()
+        writer.flush()
+
+    for name, store in (("per image executemany", per_image_store), ("LabelWriter", labelwriter_store)):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            maker = DatabaseMaker(os.path.join(tmpdir, cng.BBOX_DB_FILE))
+            for f in maker.table_create_funcs:
+                f()
+            t0 = time.perf_counter()
+            store(maker.con)
+            elapsed = time.perf_counter() - t0
+            maker.close()
+        print(f"{name:>24}: {n_rows / elapsed:>12.0f} rows/s ({elapsed:.3f} s, {n_rows} rows)")
+
 
 if __name__ == "__main__":
-    # Create folder if not exist
-    # pathlib.Path(dirpath / cng.GENERATED_DATA_DIR).mkdir(parents=True, exist_ok=True)
-    db_ = DatabaseMaker()
-    # db_.create_bboxes_cps_table()
-    # db_.create_bboxes_xyz_table()
-    # db_.create_bboxes_std_table()
-    pass
+    parser = argparse.ArgumentParser(description="Database utilities for generated data")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_bench = subparsers.add_parser("bench", help="Benchmark LabelWriter against per image inserts")
+    parser_bench.add_argument("--imgs", help="Number of images, default 2000", type=int, default=2000)
+    parser_bench.add_argument("--objects", help="Objects per image, default 5", type=int, default=5)
+
+    parser_migrate = subparsers.add_parser(
+        "migrate", help="Add indexes and tables introduced after given databases were made"
+    )
+    parser_migrate.add_argument("files", help="Database files", nargs="+")
+
+    parser_metrics = subparsers.add_parser(
+        "metrics", help="Throughput and p50/p95 per stage of render runs"
+    )
+    parser_metrics.add_argument(
+        "file",
+        help=f"Database file, default: {GEN_DIR / cng.BBOX_DB_FILE}",
+        nargs="?",
+        default=str(GEN_DIR / cng.BBOX_DB_FILE),
+    )
+    parser_metrics.add_argument("--run", help="Only summarize given run", type=str)
+
+    args = parser.parse_args()
+    if args.command == "bench":
+        benchmark_labelwriter(args.imgs, args.objects)
+    elif args.command == "migrate":
+        # DatabaseMaker would create a new database for a mistyped path
+        missing = [file for file in args.files if not os.path.isfile(file)]
+        if missing:
+            parser.error(f"Database file(s) not found: {', '.join(missing)}")
+        for file in args.files:
+            print(f"Migrating {file}")
+            maker = DatabaseMaker(file)
+            maker.create_manifest_table()
+            maker.create_pose_tables()
+            maker.create_metrics_table()
+            maker.create_bboxes_std_multi_table()
+            maker.create_imgnr_indexes()
+    elif args.command == "metrics":
+        summarize_metrics(args.file, args.run)
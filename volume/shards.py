@@ -0,0 +1,407 @@
+"""
+Packed tar shards of rendered datasets
+
+Every image and its label rows become one sample in a tar shard, WebDataset style. Members of
+a sample share the key of the image, e.g. for img12 rendered in view mode all:
+    img12.L.png  img12.R.png  img12.C.png  img12.C_TOP.png
+    img12.bboxes_full.npy  img12.bboxes_std.npy  ...
+Images rendered from a single camera have no view, e.g. img12.png. Label members contain the
+rows of the table without imgnr, that is (n_rows, n_cols) float64 of class_ and values.
+
+Every shard shardNNNNNN.tar has an index shardNNNNNN.json with byte offset and size of every
+member, so ShardReader reads a sample by seeking to it instead of scanning the tar. The index is
+written last, a shard without index is incomplete and ignored. Shards are only ever appended,
+converting again converts every committed image that is in no shard index. Images merged or
+resumed later can thereby land in a later shard than images with higher imgnrs.
+
+Tar shards are plain tar files, they can be copied as a few large files and be read by any
+tar reader or WebDataset. Existing directories are converted with this file, it is NOT meant
+to be run through Blender:
+
+python shards.py generated_data
+
+Written by Naphat Amundsen
+"""
+
+import argparse
+import io
+import json
+import os
+import pathlib
+import re
+import tarfile
+from typing import BinaryIO, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+import config as cng
+from setup_db import BBOX_TABLES, connect
+
+
+def shard_paths(shard_dir: str) -> List[pathlib.Path]:
+    """Sorted index files of complete shards in shard directory"""
+    shard_dir = pathlib.Path(shard_dir)
+    if not shard_dir.is_dir():
+        return []
+    pattern = re.compile(r"^shard\d+\.json$")
+    return sorted(p for p in shard_dir.iterdir() if pattern.match(p.name))
+
+
+def sharded_imgnrs(shard_dir: str) -> Set[int]:
+    """imgnrs in the indexes of every complete shard"""
+    imgnrs: Set[int] = set()
+    for index_path in shard_paths(shard_dir):
+        with open(index_path) as f:
+            imgnrs.update(int(imgnr) for imgnr in json.load(f)["samples"])
+    return imgnrs
+
+
+def scan_images(img_dir: str, base_img_name: str) -> Dict[int, Dict[str, str]]:
+    """
+    Scan image directory once for images of every encoded format
+
+    Returns
+    -------
+    Dict[int, Dict[str, str]]
+        imgnr -> {member suffix: path}, member suffix is view and extension, e.g. L.png
+    """
+    extensions = "|".join(re.escape(ext) for ext in cng.ENCODE_FORMATS.values())
+    pattern = re.compile(rf"^{re.escape(base_img_name)}(\d+)(?:_([A-Z_]+))?({extensions})$")
+    found: Dict[int, Dict[str, str]] = {}
+    if not os.path.isdir(img_dir):
+        return found
+    for entry in os.scandir(img_dir):
+        match = pattern.match(entry.name)
+        if match:
+            imgnr, view, ext = match.groups()
+            suffix = ext[1:] if view is None else f"{view}{ext}"
+            found.setdefault(int(imgnr), {})[suffix] = entry.path
+    return found
+
+
+class ShardWriter:
+    """
+    Writes samples to tar shards of at most shard_size samples, see module docstring
+    """
+
+    def __init__(self, shard_dir: str, shard_size: int = cng.SHARD_SIZE):
+        self.shard_dir = pathlib.Path(shard_dir)
+        self.shard_dir.mkdir(parents=True, exist_ok=True)
+        self.shard_size: int = shard_size
+        self.n_shards: int = len(shard_paths(self.shard_dir))
+        self.sharded: Set[int] = sharded_imgnrs(self.shard_dir)
+
+        self.tar: Optional[tarfile.TarFile] = None
+        self.columns: Dict[str, List[str]] = {}  # Columns of label members, per table
+        self.imgnrs: List[int] = []  # Samples in current shard
+
+    @property
+    def tar_path(self) -> pathlib.Path:
+        return self.shard_dir / cng.SHARD_FILE.format(self.n_shards)
+
+    def add(
+        self,
+        imgnr: int,
+        files: Dict[str, bytes],
+        labels: Dict[str, np.ndarray],
+        columns: Dict[str, List[str]],
+    ) -> None:
+        """Add sample of imgnr to current shard, imgnr must not be sharded already
+
+        Parameters
+        ----------
+        imgnr : int
+        files : Dict[str, bytes]
+            Member suffix -> content, e.g. {"L.png": ..., "R.png": ...}
+        labels : Dict[str, np.ndarray]
+            Table -> (n_rows, n_cols) rows of imgnr without imgnr column
+        columns : Dict[str, List[str]]
+            Table -> names of columns in labels
+        """
+        if imgnr in self.sharded:
+            raise ValueError(f"imgnr {imgnr} is already sharded")
+        if self.tar is None:
+            # Written to temporary name, renamed when the shard is complete
+            self.tar = tarfile.open(str(self.tar_path) + ".tmp", "w")
+
+        key = f"{cng.IMAGE_NAME}{imgnr}"
+        members = list(files.items())
+        for table, rows in labels.items():
+            buffer = io.BytesIO()
+            np.save(buffer, np.asarray(rows, dtype=np.float64))
+            members.append((f"{table}.npy", buffer.getvalue()))
+            self.columns[table] = columns[table]
+
+        for suffix, data in members:
+            info = tarfile.TarInfo(f"{key}.{suffix}")
+            info.size = len(data)
+            self.tar.addfile(info, io.BytesIO(data))
+
+        self.imgnrs.append(imgnr)
+        self.sharded.add(imgnr)
+        if len(self.imgnrs) >= self.shard_size:
+            self.finish_shard()
+
+    def finish_shard(self) -> None:
+        """
+        Close current shard and write its index, does nothing if current shard is empty
+        """
+        if self.tar is None:
+            return
+        self.tar.close()
+        tmp = str(self.tar_path) + ".tmp"
+
+        # Offsets are read back from the headers that were written
+        samples: Dict[str, Dict[str, Tuple[int, int]]] = {}
+        with tarfile.open(tmp, "r") as tar:
+            for member in tar:
+                key, suffix = member.name.split(".", 1)
+                imgnr = key[len(cng.IMAGE_NAME) :]
+                samples.setdefault(imgnr, {})[suffix] = (member.offset_data, member.size)
+
+        os.replace(tmp, self.tar_path)
+        index_path = self.shard_dir / cng.SHARD_INDEX_FILE.format(self.n_shards)
+        with open(str(index_path) + ".tmp", "w") as f:
+            json.dump({"tar": self.tar_path.name, "columns": self.columns, "samples": samples}, f)
+        os.replace(str(index_path) + ".tmp", index_path)
+
+        self.tar = None
+        self.imgnrs = []
+        self.n_shards += 1
+
+    def close(self) -> None:
+        self.finish_shard()
+
+
+class ShardReader:
+    """
+    Random access to samples of tar shards by imgnr
+    """
+
+    def __init__(self, shard_dir: str):
+        self.shard_dir = pathlib.Path(shard_dir)
+        self.tar_names: List[str] = []
+        self.columns: Dict[str, List[str]] = {}
+        # imgnr -> (shard, {member suffix: (offset, size)})
+        self.samples: Dict[int, Tuple[int, Dict[str, Tuple[int, int]]]] = {}
+        for i, index_path in enumerate(shard_paths(self.shard_dir)):
+            with open(index_path) as f:
+                index = json.load(f)
+            self.tar_names.append(index["tar"])
+            self.columns.update(index["columns"])
+            for imgnr, members in index["samples"].items():
+                self.samples[int(imgnr)] = (i, {k: tuple(v) for k, v in members.items()})
+        self.files: Dict[int, BinaryIO] = {}  # Opened on first read
+
+    @property
+    def imgnrs(self) -> np.ndarray:
+        return np.array(sorted(self.samples), dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def __contains__(self, imgnr: int) -> bool:
+        return imgnr in self.samples
+
+    def read(self, imgnr: int, suffix: str) -> bytes:
+        """Content of one member of sample, e.g. suffix L.png"""
+        if imgnr not in self.samples:
+            raise KeyError(f"imgnr {imgnr} is not sharded")
+        shard, members = self.samples[imgnr]
+        offset, size = members[suffix]
+        if shard not in self.files:
+            self.files[shard] = open(self.shard_dir / self.tar_names[shard], "rb")
+        f = self.files[shard]
+        f.seek(offset)
+        return f.read(size)
+
+    def __getitem__(self, imgnr: int) -> Dict[str, bytes]:
+        """
+        Returns
+        -------
+        Dict[str, bytes]
+            Member suffix -> content of every member of sample
+        """
+        if imgnr not in self.samples:
+            raise KeyError(f"imgnr {imgnr} is not sharded")
+        return {suffix: self.read(imgnr, suffix) for suffix in self.samples[imgnr][1]}
+
+    def labels(self, imgnr: int, table: str = cng.BBOX_DB_TABLE_FULL) -> np.ndarray:
+        """
+        Returns
+        -------
+        np.ndarray
+            (n_rows, n_cols) rows of table of imgnr, columns are self.columns[table]
+        """
+        return np.load(io.BytesIO(self.read(imgnr, f"{table}.npy")))
+
+    def images(self, imgnr: int) -> Dict[str, bytes]:
+        """
+        Returns
+        -------
+        Dict[str, bytes]
+            Member suffix -> encoded image of every view
+        """
+        return {
+            suffix: self.read(imgnr, suffix)
+            for suffix in self.samples[imgnr][1]
+            if not suffix.endswith(".npy")
+        }
+
+    def close(self) -> None:
+        for f in self.files.values():
+            f.close()
+        self.files.clear()
+
+
+def ready_imgnrs(con, tables: Sequence[str]) -> Set[int]:
+    """
+    imgnrs of committed jobs, and of labeled images without job (labeled before the job
+    manifest existed). Images of jobs that are not committed are never ready.
+    """
+    existing = {x[0] for x in con.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    ready: Set[int] = set()
+    # Uses the imgnr indexes of the tables, see DatabaseMaker.create_imgnr_indexes
+    for table in tables:
+        if table in existing:
+            query = f"SELECT DISTINCT {cng.BBOX_DB_IMGRNR} FROM {table}"
+            ready.update(x[0] for x in con.execute(query))
+    if cng.MANIFEST_DB_TABLE in existing:
+        for imgnr, state in con.execute(
+            f"SELECT {cng.BBOX_DB_IMGRNR}, {cng.MANIFEST_DB_STATE} FROM {cng.MANIFEST_DB_TABLE}"
+        ):
+            if state == cng.JOB_COMMITTED:
+                ready.add(imgnr)
+            else:
+                ready.discard(imgnr)
+    return ready
+
+
+def fetch_rows(
+    con, table: str, imgnrs: Sequence[int], n_cols: int, chunk_size: int = 500
+) -> np.ndarray:
+    """
+    Rows of table of given imgnrs sorted by imgnr, fetched chunk_size imgnrs at a time
+
+    Returns
+    -------
+    np.ndarray
+        (n_rows, n_cols)
+    """
+    imgnrs = sorted(imgnrs)
+    chunks = []
+    for start in range(0, len(imgnrs), chunk_size):
+        chunk = imgnrs[start : start + chunk_size]
+        rows = con.execute(
+            f"SELECT * FROM {table} WHERE {cng.BBOX_DB_IMGRNR} IN ({','.join('?' * len(chunk))}) "
+            f"ORDER BY {cng.BBOX_DB_IMGRNR}",
+            chunk,
+        ).fetchall()
+        chunks.append(np.array(rows, dtype=np.float64).reshape(-1, n_cols))
+    return np.concatenate(chunks) if chunks else np.empty((0, n_cols))
+
+
+def convert_directory(
+    data_dir: str,
+    shard_dir: str,
+    shard_size: int = cng.SHARD_SIZE,
+    tables: Sequence[str] = BBOX_TABLES,
+    remove: bool = False,
+) -> Tuple[int, int]:
+    """
+    Convert images and labels of data directory that are in no shard, see ready_imgnrs. Images
+    of jobs that are not committed yet are left for a later conversion.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory of generated data
+    shard_dir : str
+        Directory of shards
+    shard_size : int, optional
+        Max images per shard
+    tables : Sequence[str], optional
+        Tables whose rows are included, tables missing in the database are skipped
+    remove : bool, optional
+        Remove image files once the shard they are in is complete
+
+    Returns
+    -------
+    Tuple[int, int]
+        Number of images and number of shards written
+    """
+    writer = ShardWriter(shard_dir, shard_size)
+    found = scan_images(os.path.join(data_dir, cng.IMAGE_DIR), cng.IMAGE_NAME)
+
+    con = connect(os.path.join(data_dir, cng.BBOX_DB_FILE), readonly=True)
+    ready = ready_imgnrs(con, BBOX_TABLES)
+    imgnrs = sorted(imgnr for imgnr in found if imgnr in ready and imgnr not in writer.sharded)
+    existing = {x[0] for x in con.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    tables = [table for table in tables if table in existing]
+    columns = {
+        table: [x[1] for x in con.execute(f"PRAGMA table_info({table})")][1:] for table in tables
+    }
+
+    n_shards = writer.n_shards
+    for start in range(0, len(imgnrs), shard_size):
+        chunk = imgnrs[start : start + shard_size]
+        # Labels of a chunk are fetched with one query per table
+        labels: Dict[str, Dict[int, np.ndarray]] = {}
+        for table in tables:
+            rows = fetch_rows(con, table, chunk, len(columns[table]) + 1)
+            starts = np.searchsorted(rows[:, 0], chunk, side="left")
+            ends = np.searchsorted(rows[:, 0], chunk, side="right")
+            labels[table] = {imgnr: rows[s:e, 1:] for imgnr, s, e in zip(chunk, starts, ends)}
+
+        for imgnr in chunk:
+            files = {}
+            for suffix, path in sorted(found[imgnr].items()):
+                with open(path, "rb") as f:
+                    files[suffix] = f.read()
+            writer.add(imgnr, files, {table: labels[table][imgnr] for table in tables}, columns)
+        writer.finish_shard()
+        print(f"Converted images {chunk[0]} to {chunk[-1]}")
+
+        # Only after the shard and its index are complete
+        if remove:
+            for imgnr in chunk:
+                for path in found[imgnr].values():
+                    os.remove(path)
+
+    con.close()
+    return len(imgnrs), writer.n_shards - n_shards
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert rendered images and labels to tar shards")
+    parser.add_argument(
+        "dir",
+        help=f"Directory of generated data, default: {cng.GENERATED_DATA_DIR}",
+        nargs="?",
+        default=cng.GENERATED_DATA_DIR,
+    )
+    parser.add_argument(
+        "--out", help=f"Output directory, default: <dir>/{cng.SHARD_DIR}", type=str
+    )
+    parser.add_argument(
+        "--tables",
+        help="Tables to include, default: every bbox table",
+        nargs="*",
+        default=BBOX_TABLES,
+    )
+    parser.add_argument(
+        "--shard-size",
+        help=f"Max images per shard, default: {cng.SHARD_SIZE}",
+        type=int,
+        default=cng.SHARD_SIZE,
+    )
+    parser.add_argument(
+        "--remove",
+        help="Remove image files once the shard they are in is complete",
+        action="store_true",
+    )
+    args = parser.parse_args()
+
+    shard_dir = args.out if args.out is not None else os.path.join(args.dir, cng.SHARD_DIR)
+    n_imgs, n_shards = convert_directory(args.dir, shard_dir, args.shard_size, args.tables, args.remove)
+    print(f"Converted {n_imgs} images into {n_shards} new shard(s) at {shard_dir}")
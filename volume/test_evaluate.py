@@ -0,0 +1,163 @@
+"""
+Tests matching and average precision of evaluate.py on axis aligned unit cubes, so IoUs and
+AP can be computed by hand. Two unit cubes shifted by d along one axis have IoU (1 - d) / (1 + d).
+It is NOT meant to be run through Blender:
+
+python -m pytest test_evaluate.py
+
+Written by Naphat Amundsen
+"""
+
+import sqlite3 as db
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import config as cng
+from evaluate import FULL_COLUMNS, average_precision, evaluate, match_chunk
+from setup_db import DatabaseMaker
+
+N_CLASSES = 6
+ORIGIN = np.zeros(3)
+DIMS = np.full(3, 2.0)  # Stored locations are used as they are
+
+
+def cube(imgnr: int, class_: int, x: float, score: Optional[float] = None) -> list:
+    """bboxes_full row of unit cube at (x, 0, 0), with confidence last if score is given"""
+    row = [imgnr, class_, x, 0.0, 0.0, 1.0, 1.0, 1.0, 0.0, 0.0, 0.0]
+    return row if score is None else row + [score]
+
+
+def match(preds, gts, iou_threshold=0.5, location=ORIGIN, dimensions=DIMS) -> list:
+    preds = np.array(preds, dtype=np.float64).reshape(-1, 12)
+    gts = np.array(gts, dtype=np.float64).reshape(-1, 11)
+    return match_chunk(preds, gts, iou_threshold, N_CLASSES, location, dimensions).tolist()
+
+
+def test_match_in_order_of_confidence():
+    # Both match the ground truth, IoU 0.667 and 1, the most confident one gets it
+    assert match([cube(0, 0, 0.2, 0.6), cube(0, 0, 0.0, 0.9)], [cube(0, 0, 0.0)]) == [False, True]
+    assert match([cube(0, 0, 0.2, 0.9), cube(0, 0, 0.0, 0.6)], [cube(0, 0, 0.0)]) == [True, False]
+
+
+def test_match_highest_iou():
+    # First prediction has IoU 0.538 with the box at 0 and 0.667 with the box at 0.5, taking
+    # the box at 0.5 leaves the box at 0 to the second prediction
+    preds = [cube(0, 0, 0.3, 0.9), cube(0, 0, 0.0, 0.8)]
+    assert match(preds, [cube(0, 0, 0.0), cube(0, 0, 0.5)]) == [True, True]
+
+
+def test_match_per_image_and_class():
+    preds = [cube(0, 1, 0.0, 0.9), cube(1, 0, 0.0, 0.9), cube(2, 0, 0.0, 0.9)]
+    gts = [cube(0, 0, 0.0), cube(2, 0, 0.0)]
+    assert match(preds, gts) == [False, False, True]
+
+
+def test_match_iou_threshold():
+    # IoU 1 / 3
+    preds, gts = [cube(0, 0, 0.5, 0.9)], [cube(0, 0, 0.0)]
+    assert match(preds, gts, iou_threshold=0.5) == [False]
+    assert match(preds, gts, iou_threshold=0.3) == [True]
+
+
+def test_match_spawnbox():
+    # Stored location 0.15 is 0.3 from the box at 0 in a spawnbox of dimensions 4 (IoU 0.538),
+    # and 0.6 in a spawnbox of dimensions 8 (IoU 0.25)
+    preds, gts = [cube(0, 0, 0.15, 0.9)], [cube(0, 0, 0.0)]
+    location = np.array([1.0, 2.0, 3.0])
+    assert match(preds, gts, location=location, dimensions=np.full(3, 4.0)) == [True]
+    assert match(preds, gts, location=location, dimensions=np.full(3, 8.0)) == [False]
+
+
+def test_match_empty():
+    assert match([], [cube(0, 0, 0.0)]) == []
+    assert match([cube(0, 0, 0.0, 0.9)], []) == [False]
+
+
+def test_average_precision():
+    # Precision 1, 1/2, 2/3, 1/2 at recall 1/3, 1/3, 2/3, 2/3, the envelope is 1, 2/3, 2/3, 1/2
+    # so AP = 1/3 * 1 + 1/3 * 2/3 = 5/9
+    scores = np.array([0.9, 0.8, 0.7, 0.6])
+    ap, recall = average_precision(scores, np.array([True, False, True, False]), 3)
+    assert ap == pytest.approx(5 / 9)
+    assert recall == pytest.approx(2 / 3)
+
+    # Precision 0, 1/2, 2/3 at recall 0, 1/2, 1, the envelope is 2/3 everywhere
+    ap, recall = average_precision(scores[:3], np.array([False, True, True]), 2)
+    assert ap == pytest.approx(2 / 3)
+    assert recall == pytest.approx(1.0)
+
+
+def test_average_precision_ties():
+    # Equal scores are one threshold, the order of tied predictions does not matter
+    scores = np.array([0.5, 0.5])
+    for tp in ([False, True], [True, False]):
+        ap, recall = average_precision(scores, np.array(tp), 1)
+        assert ap == pytest.approx(0.5)
+        assert recall == pytest.approx(1.0)
+
+
+def test_average_precision_empty():
+    assert np.isnan(average_precision(np.array([0.9]), np.array([False]), 0)).all()
+    assert average_precision(np.empty(0), np.empty(0, dtype=bool), 2) == (0.0, 0.0)
+
+
+def make_ground_truth(file: str, spawnbox: bool) -> None:
+    maker = DatabaseMaker(file)
+    maker.create_bboxes_full_table()
+    maker.create_pose_tables()
+    gts = [cube(0, 0, 0.0), cube(0, 0, 0.5), cube(1, 3, 0.0)]
+    maker.cursor.executemany(
+        f"INSERT INTO {cng.BBOX_DB_TABLE_FULL} VALUES ({', '.join('?' * 11)})", gts
+    )
+    if spawnbox:
+        maker.cursor.execute(
+            f"INSERT INTO {cng.SPAWNBOX_DB_TABLE} VALUES (?, 1, 2, 3, 4, 4, 4)", (cng.SPAWNBOX_OBJ,)
+        )
+    maker.con.commit()
+    maker.close()
+
+
+def write_predictions(file: str) -> None:
+    # Matches the box at 0 in the stored spawnbox of dimensions 4, see test_match_spawnbox
+    preds = [cube(0, 0, 0.15, 0.9), cube(1, 3, 0.3, 0.8)]
+    columns = (cng.BBOX_DB_IMGRNR, cng.BBOX_DB_CLASS, *FULL_COLUMNS, cng.EVAL_SCORE_COLUMN)
+    pd.DataFrame(preds, columns=columns).to_csv(file, index=False)
+
+
+def test_evaluate_stored_spawnbox(tmp_path):
+    gt_file, predfile = str(tmp_path / "gt.db"), str(tmp_path / "preds.csv")
+    make_ground_truth(gt_file, spawnbox=True)
+    write_predictions(predfile)
+
+    results = evaluate(gt_file, predfile)
+    # haddock: 1 of 2 found, mackerel: 0.3 from the box is 0.6 in dimensions 4 so it is missed
+    assert results["haddock"] == {"ap": 0.5, "recall": 0.5, "n_gt": 2, "n_pred": 1}
+    assert results["mackerel"] == {"ap": 0.0, "recall": 0.0, "n_gt": 1, "n_pred": 1}
+    assert np.isnan(results["hake"]["ap"])
+
+    # Given spawnbox is used instead of the stored one
+    results = evaluate(gt_file, predfile, spawnbox_dimensions=np.full(3, 8.0))
+    assert results["haddock"]["recall"] == 0.0
+
+
+def test_evaluate_without_spawnbox(tmp_path):
+    gt_file, predfile = str(tmp_path / "gt.db"), str(tmp_path / "preds.csv")
+    make_ground_truth(gt_file, spawnbox=False)
+    write_predictions(predfile)
+
+    with pytest.raises(ValueError, match="spawnbox"):
+        evaluate(gt_file, predfile)
+    results = evaluate(gt_file, predfile, spawnbox_location=ORIGIN, spawnbox_dimensions=DIMS)
+    assert results["haddock"]["recall"] == 0.5
+    assert results["mackerel"]["recall"] == 1.0
+
+    # Database from before spawnbox table existed
+    con = db.connect(gt_file)
+    con.execute(f"DROP TABLE {cng.SPAWNBOX_DB_TABLE}")
+    con.commit()
+    con.close()
+    with pytest.raises(ValueError, match="spawnbox"):
+        evaluate(gt_file, predfile)
@@ -0,0 +1,109 @@
+"""
+Tests the oriented box intersections and IoUs of iou3d.py against closed forms and Monte Carlo
+estimates. It is NOT meant to be run through Blender:
+
+python -m pytest test_iou3d.py
+
+Written by Naphat Amundsen
+"""
+
+from typing import Tuple
+
+import numpy as np
+
+from iou3d import (
+    box_volume,
+    decode_full,
+    euler_to_matrix,
+    intersection_volume,
+    iou_matrix,
+    paired_iou,
+)
+
+Boxes = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+def random_boxes(
+    rng: np.random.Generator, n: int, spread: float = 0.5, size: Tuple[float, float] = (0.1, 0.8)
+) -> Boxes:
+    return (
+        rng.uniform(-spread, spread, (n, 3)),
+        rng.uniform(*size, (n, 3)),
+        euler_to_matrix(rng.uniform(-7, 7, (n, 3))),
+    )
+
+
+def monte_carlo_intersection(
+    rng: np.random.Generator, a: Boxes, b: Boxes, n: int = 2_000_000
+) -> float:
+    """Volume of box a times the fraction of uniform points in box a that are inside box b"""
+    c, h, r = a
+    points = rng.uniform(-1, 1, (n, 3)) * h @ r.T + c
+    local = (points - b[0]) @ b[2]
+    return (np.abs(local) <= b[1]).all(-1).mean() * box_volume(h)
+
+
+def test_identical_boxes():
+    a = random_boxes(np.random.default_rng(0), 100)
+    np.testing.assert_allclose(paired_iou(a, a), 1)
+
+
+def test_disjoint_boxes():
+    a = random_boxes(np.random.default_rng(1), 100)
+    b = (a[0] + 10, a[1], a[2])
+    assert np.all(paired_iou(a, b) == 0)
+
+
+def test_axis_aligned_closed_form():
+    rng = np.random.default_rng(2)
+    eye = np.broadcast_to(np.eye(3), (100, 3, 3))
+    a, b = random_boxes(rng, 100), random_boxes(rng, 100)
+    a, b = (a[0], a[1], eye), (b[0], b[1], eye)
+    overlap = np.minimum(a[0] + a[1], b[0] + b[1]) - np.maximum(a[0] - a[1], b[0] - b[1])
+    inter = np.prod(np.clip(overlap, 0, None), axis=-1)
+    np.testing.assert_allclose(intersection_volume(*a, *b), inter, atol=1e-12)
+
+
+def test_square_box_rotated_90_degrees():
+    # Rotated about its square axis it is the same box
+    r90 = euler_to_matrix(np.array([[0, 0, np.pi / 2]]))
+    c, h = np.zeros((1, 3)), np.array([[1.0, 1.0, 0.5]])
+    np.testing.assert_allclose(paired_iou((c, h, np.eye(3)[None]), (c, h, r90)), 1)
+
+
+def test_cube_rotated_45_degrees():
+    # Intersection is an octagonal prism, octagon with inradius 1 times height 2
+    r45 = euler_to_matrix(np.array([[0, 0, np.pi / 4]]))
+    c, h = np.zeros((1, 3)), np.ones((1, 3))
+    octagon = 8 * (np.sqrt(2) - 1) * 2
+    np.testing.assert_allclose(intersection_volume(c, h, np.eye(3)[None], c, h, r45), [octagon])
+
+
+def test_random_boxes_monte_carlo():
+    rng = np.random.default_rng(3)
+    a, b = random_boxes(rng, 30), random_boxes(rng, 30)
+    exact = intersection_volume(*a, *b)
+    for i in range(30):
+        estimate = monte_carlo_intersection(
+            rng, tuple(x[i] for x in a), tuple(x[i] for x in b)
+        )
+        assert abs(exact[i] - estimate) < 5e-3, f"random pair {i}: {exact[i]} vs {estimate}"
+
+
+def test_iou_matrix():
+    rng = np.random.default_rng(4)
+    a, b = random_boxes(rng, 7), random_boxes(rng, 5)
+    mat = iou_matrix(a, b)
+    assert mat.shape == (7, 5)
+    np.testing.assert_allclose(mat, iou_matrix(b, a).T)
+    np.testing.assert_allclose(mat[3], paired_iou(tuple(x[[3] * 5] for x in a), b))
+
+
+def test_decode_full():
+    row = np.array([[0.5, -0.5, 0.0, 2.0, 1.0, 0.5, 0.25, 0.0, 1.0]])
+    c, h, r = decode_full(
+        row, spawnbox_location=np.array([1, 1, 1]), spawnbox_dimensions=np.array([4, 4, 4])
+    )
+    np.testing.assert_allclose(c, [[2, 0, 1]])
+    np.testing.assert_allclose(h, [[1, 0.5, 0.25]])
+    np.testing.assert_allclose(r, euler_to_matrix(np.array([[np.pi / 2, 0, 2 * np.pi]])))
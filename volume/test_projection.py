@@ -0,0 +1,187 @@
+"""
+Tests the vectorized 2D bounding boxes in derive.py against the per vertex
+camera_view_bounds_2d of generate.py, with a stubbed camera and mesh so Blender is not needed.
+It is NOT meant to be run through Blender:
+
+python -m pytest test_projection.py
+
+Written by Naphat Amundsen
+"""
+
+from typing import List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+import pytest
+
+from derive import bounds_to_camera_frames, project_to_camera_frame, project_to_camera_frames
+
+
+class Vector(NamedTuple):
+    """Stub of mathutils.Vector, with what camera_view_bounds_2d uses"""
+
+    x: float
+    y: float
+    z: float
+
+    def __neg__(self) -> "Vector":
+        return Vector(-self.x, -self.y, -self.z)
+
+    def __truediv__(self, value: float) -> "Vector":
+        return Vector(self.x / value, self.y / value, self.z / value)
+
+
+class Vertex(NamedTuple):
+    co: Vector
+
+
+class Camera(NamedTuple):
+    """Stub of bpy.types.Camera, view_frame returns corners at distance 1, as Blender does"""
+
+    type: str
+    half_width: float
+    half_height: float
+
+    def view_frame(self, scene=None) -> List[Vector]:
+        w, h = self.half_width, self.half_height
+        z = -1.0
+        return [Vector(w, h, z), Vector(w, -h, z), Vector(-w, -h, z), Vector(-w, h, z)]
+
+
+def camera_view_bounds_2d(camera: Camera, vertices: Sequence[Vertex]) -> Tuple[float, ...]:
+    """
+    Per vertex loop of generate.camera_view_bounds_2d as it is, with vertices already in camera
+    space
+    """
+    frame = [-v for v in camera.view_frame()[:3]]
+    camera_persp: bool = camera.type != "ORTHO"
+
+    lx = []
+    ly = []
+
+    for v in vertices:
+        co_local = v.co
+        z: float = -co_local.z
+
+        if camera_persp:
+            if z == 0.0:
+                lx.append(0.5)
+                ly.append(0.5)
+            else:
+                frame = [(v / (v.z / z)) for v in frame]
+
+        min_x, max_x = frame[1].x, frame[2].x
+        min_y, max_y = frame[0].y, frame[1].y
+
+        x = (co_local.x - min_x) / (max_x - min_x)
+        y = (co_local.y - min_y) / (max_y - min_y)
+
+        lx.append(x)
+        ly.append(y)
+
+    min_x = np.clip(min(lx), 0.0, 1.0)
+    max_x = np.clip(max(lx), 0.0, 1.0)
+    min_y = np.clip(min(ly), 0.0, 1.0)
+    max_y = np.clip(max(ly), 0.0, 1.0)
+
+    return (
+        round(min_x, 4),
+        round(1 - max_y, 4),
+        round((max_x - min_x), 4),
+        round((max_y - min_y), 4),
+    )
+
+
+def camera_params(camera: Camera) -> Tuple[np.ndarray, bool]:
+    """Frame and perspective flag as in generate.get_camera_params"""
+    frame = -np.array([tuple(v) for v in camera.view_frame()[:3]])
+    return frame, camera.type != "ORTHO"
+
+
+def mesh(co: np.ndarray) -> List[Vertex]:
+    return [Vertex(Vector(*map(float, point))) for point in co]
+
+
+def random_objects(rng: np.random.Generator, n_objects: int) -> List[np.ndarray]:
+    """Point clouds in front of the camera, in camera space"""
+    objects = []
+    for _ in range(n_objects):
+        center = rng.uniform((-1.5, -1.0, -8.0), (1.5, 1.0, -2.0))
+        objects.append(center + rng.normal(scale=0.4, size=(rng.integers(1, 30), 3)))
+    return objects
+
+
+PERSP = Camera("PERSP", 0.6, 0.4)
+ORTHO = Camera("ORTHO", 3.0, 2.0)
+
+
+@pytest.mark.parametrize("camera", (PERSP, ORTHO))
+def test_points_match_per_vertex(camera):
+    rng = np.random.default_rng(0)
+    co = random_objects(rng, 1)[0]
+    frame, persp = camera_params(camera)
+    x, y = project_to_camera_frame(co, frame, persp)
+    for point, px, py in zip(co, x, y):
+        # A single vertex mesh has a box of zero size at the projection of the vertex
+        box = camera_view_bounds_2d(camera, mesh(point[None]))
+        assert box[0] == round(np.clip(px, 0.0, 1.0), 4)
+        assert box[1] == round(1 - np.clip(py, 0.0, 1.0), 4)
+
+
+@pytest.mark.parametrize("camera", (PERSP, ORTHO))
+def test_boxes_match_per_vertex(camera):
+    rng = np.random.default_rng(1)
+    objects = random_objects(rng, 20)
+    frame, persp = camera_params(camera)
+    starts = np.cumsum([0] + [len(co) for co in objects[:-1]])
+
+    boxes = bounds_to_camera_frames(
+        np.concatenate(objects)[None], frame[None], np.array([persp]), starts
+    )[0]
+    reference = np.array([camera_view_bounds_2d(camera, mesh(co)) for co in objects])
+    np.testing.assert_allclose(boxes, reference, atol=1e-4)
+
+
+@pytest.mark.parametrize("camera", (PERSP, ORTHO))
+def test_camera_plane_match_per_vertex(camera):
+    rng = np.random.default_rng(2)
+    objects = random_objects(rng, 12)
+    # Vertices in the camera plane first, in the middle, several after another, and alone
+    objects[0][0, 2] = 0.0
+    objects[1][len(objects[1]) // 2, 2] = 0.0
+    objects[2][:3, 2] = 0.0
+    objects[3][1:4, 2] = 0.0
+    objects[4][:, 2] = 0.0
+    objects[5] = np.array([[0.3, -0.2, 0.0]])
+    frame, persp = camera_params(camera)
+    starts = np.cumsum([0] + [len(co) for co in objects[:-1]])
+
+    boxes = bounds_to_camera_frames(
+        np.concatenate(objects)[None], frame[None], np.array([persp]), starts
+    )[0]
+    reference = np.array([camera_view_bounds_2d(camera, mesh(co)) for co in objects])
+    np.testing.assert_allclose(boxes, reference, atol=1e-4)
+
+
+def test_stacked_cameras_match_per_camera():
+    rng = np.random.default_rng(3)
+    objects = random_objects(rng, 10)
+    objects[0][2, 2] = 0.0
+    cameras = (PERSP, ORTHO, Camera("PERSP", 0.3, 0.5))
+    frames, persps = zip(*(camera_params(camera) for camera in cameras))
+    starts = np.cumsum([0] + [len(co) for co in objects[:-1]])
+    co = np.concatenate(objects)
+
+    # Same points seen from differently placed cameras
+    offsets = rng.normal(scale=0.2, size=(len(cameras), 1, 3))
+    offsets[0] = 0.0  # Keeps the vertex in the camera plane of the first camera
+    stacked = co[None] + offsets
+    boxes = bounds_to_camera_frames(stacked, np.array(frames), np.array(persps), starts)
+    x, y = project_to_camera_frames(stacked, np.array(frames), np.array(persps))
+
+    for i, camera in enumerate(cameras):
+        points = np.split(stacked[i], starts[1:])
+        reference = np.array([camera_view_bounds_2d(camera, mesh(p)) for p in points])
+        np.testing.assert_allclose(boxes[i], reference, atol=1e-4)
+        xi, yi = project_to_camera_frame(stacked[i], frames[i], persps[i])
+        np.testing.assert_array_equal(x[i], xi)
+        np.testing.assert_array_equal(y[i], yi)
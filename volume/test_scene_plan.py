@@ -0,0 +1,109 @@
+"""
+Tests scene plans of scene_plan.py. A scene sampled in a batch must equal the scene sampled on
+its own from the same seed, which is what generate.generate_scene_from_seed does when resuming.
+It is NOT meant to be run through Blender:
+
+python -m pytest test_scene_plan.py
+
+Written by Naphat Amundsen
+"""
+
+import numpy as np
+import pytest
+
+import scene_plan as sp
+
+SPAWNBOX_LOCATION = np.array([0.0, 0.0, -10.0])
+SPAWNBOX_SCALE = np.array([4.0, 3.0, 2.0])
+SRC_CLASSES = [0, 1, 2, 2]
+SRC_CENTERS = np.zeros((len(SRC_CLASSES), 3))
+SRC_HALF = np.array([[0.5, 0.2, 0.2], [0.4, 0.15, 0.2], [0.6, 0.2, 0.25], [0.3, 0.1, 0.1]])
+
+# Perspective camera at the origin looking along negative z, frame as in get_camera_params
+FRAME = -np.array([[0.6, 0.4, -1.0], [0.6, -0.4, -1.0], [-0.6, -0.4, -1.0]])
+CAMERA_PARAMS = (np.eye(4), FRAME, True)
+
+
+def sample(imgnrs, seeds, rejectors=(), nspawnrange=(1, 8), max_tries=100):
+    return sp.sample_scene_plan(
+        imgnrs,
+        seeds,
+        nspawnrange,
+        SRC_CLASSES,
+        SPAWNBOX_LOCATION,
+        SPAWNBOX_SCALE,
+        rejectors,
+        max_tries,
+    )
+
+
+def all_rejectors():
+    return [
+        sp.min_distance_rejector(1.0),
+        sp.overlap_rejector(SRC_CENTERS, SRC_HALF, 0.1),
+        sp.occlusion_rejector(CAMERA_PARAMS, SRC_CENTERS, SRC_HALF, 0.5),
+    ]
+
+
+@pytest.mark.parametrize("rejectors", ((), all_rejectors()))
+def test_batch_equals_single_scenes(rejectors):
+    imgnrs = list(range(30))
+    seeds = [sp.seed_for_imgnr(7, imgnr) for imgnr in imgnrs]
+    plan, _ = sample(imgnrs, seeds, rejectors)
+    index = sp.plan_index(plan)
+
+    for imgnr, seed in zip(imgnrs, seeds):
+        single, _ = sample([imgnr], [seed], rejectors)
+        np.testing.assert_array_equal(plan[index[imgnr]], single)
+
+
+def test_no_min_distance_violations():
+    imgnrs = list(range(50))
+    seeds = [sp.seed_for_imgnr(3, imgnr) for imgnr in imgnrs]
+    plan, acceptance = sample(imgnrs, seeds, [sp.min_distance_rejector(1.0)])
+    assert acceptance < 1.0  # Some fish had to be resampled
+
+    for rows in sp.plan_index(plan).values():
+        locs = plan["location"][rows]
+        dists = np.linalg.norm(locs[:, None] - locs[None], axis=-1)
+        assert np.all(dists[np.triu_indices(len(locs), k=1)] >= 1.0)
+
+
+def test_acceptance_rate():
+    imgnrs = list(range(20))
+    seeds = list(range(20))
+    plan, acceptance = sample(imgnrs, seeds)
+    assert acceptance == 1.0
+
+    # Rejects every fish once, so every fish is drawn twice
+    calls = []
+
+    def reject_once(locs, rots, srcs, scales, valid):
+        calls.append(1)
+        return valid if len(calls) == 1 else np.zeros_like(valid)
+
+    resampled, acceptance = sample(imgnrs, seeds, [reject_once])
+    assert acceptance == 0.5
+    assert len(resampled) == len(plan)
+    np.testing.assert_array_equal(resampled["src"], plan["src"])
+    assert not np.array_equal(resampled["location"], plan["location"])
+
+
+def test_empty_batch():
+    for rejectors in ((), all_rejectors()):
+        plan, acceptance = sample([], [], rejectors)
+        assert plan.dtype == sp.SCENE_PLAN_DTYPE
+        assert len(plan) == 0
+        assert acceptance == 1.0
+        assert sp.plan_index(plan) == {}
+
+
+def test_plan_rows():
+    imgnrs = [5, 6, 9]
+    plan, _ = sample(imgnrs, [1, 2, 3])
+    assert np.all(np.diff(plan["imgnr"]) >= 0)
+    assert set(plan["imgnr"]) <= set(imgnrs)
+    np.testing.assert_array_equal(plan["class_"], np.array(SRC_CLASSES)[plan["src"]])
+    low = SPAWNBOX_LOCATION - SPAWNBOX_SCALE
+    high = SPAWNBOX_LOCATION + SPAWNBOX_SCALE
+    assert np.all((plan["location"] >= low) & (plan["location"] <= high))
@@ -0,0 +1,80 @@
+"""
+Tests the unique key of bboxes_std_multi in setup_db.py, for new tables, merged shards and
+migrated tables. It is NOT meant to be run through Blender:
+
+python -m pytest test_setup_db.py
+
+Written by Naphat Amundsen
+"""
+
+import sqlite3 as db
+
+import pytest
+
+import config as cng
+from setup_db import DatabaseMaker, merge_databases
+
+TABLE = cng.BBOX_DB_TABLE_STD_MULTI
+ROWS = [(0, 1, 0, 0, 0.1, 0.2, 0.3, 0.4), (0, 1, 1, 0, 0.1, 0.2, 0.3, 0.4)]
+
+
+def make_database(file: str) -> None:
+    maker = DatabaseMaker(file)
+    for f in maker.table_create_funcs:
+        f()
+    maker.cursor.executemany(f"INSERT INTO {TABLE} VALUES ({', '.join('?' * 8)})", ROWS)
+    maker.con.commit()
+    maker.close()
+
+
+def count_rows(file: str) -> int:
+    con = db.connect(file)
+    n_rows = con.execute(f"SELECT COUNT(*) FROM {TABLE}").fetchone()[0]
+    con.close()
+    return n_rows
+
+
+def test_duplicate_insert(tmp_path):
+    file = str(tmp_path / "data.db")
+    make_database(file)
+    con = db.connect(file)
+    with pytest.raises(db.IntegrityError):
+        con.execute(f"INSERT INTO {TABLE} VALUES ({', '.join('?' * 8)})", ROWS[1])
+    con.close()
+    assert count_rows(file) == len(ROWS)
+
+
+def test_duplicate_merge(tmp_path):
+    target, shard = str(tmp_path / "data.db"), str(tmp_path / "shard.db")
+    make_database(shard)
+    assert merge_databases(target, [shard], remove=False) == len(ROWS)
+    # Merging the same shard again fails and leaves target as it was
+    with pytest.raises(db.IntegrityError):
+        merge_databases(target, [shard], remove=False)
+    assert count_rows(target) == len(ROWS)
+
+
+def test_migrate(tmp_path):
+    file = str(tmp_path / "data.db")
+    con = db.connect(file)
+    # Table as it was made before the unique index
+    con.execute(
+        f"CREATE TABLE {TABLE} ({cng.BBOX_DB_IMGRNR} INTEGER, {cng.BBOX_DB_CLASS} INTEGER, "
+        "camera INTEGER, object INTEGER, x REAL, y REAL, w REAL, h REAL)"
+    )
+    con.executemany(f"INSERT INTO {TABLE} VALUES ({', '.join('?' * 8)})", ROWS + ROWS[:1])
+    con.commit()
+
+    maker = DatabaseMaker(file)
+    with pytest.raises(ValueError, match="duplicates"):
+        maker.create_bboxes_std_multi_table()
+    maker.close()
+
+    con.execute(f"DELETE FROM {TABLE} WHERE rowid = 3")
+    con.commit()
+    con.close()
+    maker = DatabaseMaker(file)
+    maker.create_bboxes_std_multi_table()
+    with pytest.raises(db.IntegrityError):
+        maker.cursor.execute(f"INSERT INTO {TABLE} VALUES ({', '.join('?' * 8)})", ROWS[0])
+    maker.close()
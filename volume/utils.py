@@ -13,7 +13,7 @@ Written by Naphat Amundsen
 """
 
 import bpy
-from typing import Callable, Optional, Union, Tuple, Any
+from typing import Callable, List, Optional, Union, Tuple, Any
 import config as cng
 import argparse
 import sys
@@ -144,6 +144,60 @@ def unused_remover(block) -> None:
             block.remove(obj)
 
 
+class DatablockRegistry:
+    """
+    Keeps track of datablocks created when setting up scenes, so they can be removed without
+    sweeping through every datablock in the blend file
+    """
+
+    def __init__(self):
+        self.meshes: List[bpy.types.Mesh] = []
+        self.materials: List[bpy.types.Material] = []
+        self.lights: List[bpy.types.Light] = []
+
+    def register(self, block: bpy.types.ID) -> None:
+        """
+        Register mesh, material or light. Objects are given by their data
+        """
+        if isinstance(block, bpy.types.Object):
+            block = block.data
+
+        if isinstance(block, bpy.types.Mesh):
+            self.meshes.append(block)
+        elif isinstance(block, bpy.types.Material):
+            self.materials.append(block)
+        elif isinstance(block, bpy.types.Light):
+            self.lights.append(block)
+        else:
+            raise TypeError(f"Cannot register datablock of type {type(block)}")
+
+    def free(self) -> Tuple[int, int]:
+        """
+        Remove registered datablocks that have no users left. Registry is emptied afterwards,
+        datablocks that still have users are not tracked anymore and are counted as leaked.
+
+        Returns
+        -------
+        Tuple[int, int]
+            Number of freed and leaked datablocks
+        """
+        freed = 0
+        leaked = 0
+        # IMPORTANT: Same order as in rm_collection, meshes "uses" materials and so on
+        for blocks in (self.meshes, self.materials, self.lights):
+            unused = [block for block in blocks if block.users == 0]
+            if unused:
+                bpy.data.batch_remove(unused)
+            freed += len(unused)
+            leaked += len(blocks) - len(unused)
+            blocks.clear()
+
+        if leaked > 0:
+            print(f"{red('WARNING:')} {leaked} registered datablocks still have users after clear")
+
+        return freed, leaked
+
+
 def select_collection(
     collection: Union[bpy.types.Collection, str], deselect_first: bool = True
 ) -> list:
@@ -181,9 +235,14 @@ def rm_collection(
     materials: bool = True,
     meshes: bool = True,
     lights: bool = True,
-) -> None:
+    registry: Optional[DatablockRegistry] = None,
+) -> int:
     """Remove objects in given collection and unused materials, meshes and lights
 
+    If a registry is given, only the datablocks in the registry are removed, which is
+    independent of the size of the blend file. Else every unused material, mesh and light in
+    the blend file is removed.
+
     Parameters
     ----------
     collection : Union[bpy.types.Collection, str]
@@ -194,10 +253,23 @@ def rm_collection(
         remove meshes bound to objects, by default True
     lights : bool, optional
         remove lights bound to objeects, by default True
+    registry : Optional[DatablockRegistry], optional
+        registry of datablocks to remove, materials, meshes and lights options are ignored
+        if given, by default None
+
+    Returns
+    -------
+    int
+        Number of freed datablocks (objects not included), only counted when registry is given
     """
     if isinstance(collection, str):
         collection: bpy.types.Collection = bpy.data.collections[collection]
 
+    if registry is not None:
+        bpy.data.batch_remove(tuple(collection.objects))
+        freed, _ = registry.free()
+        return freed
+
     for obj in collection.objects:
         bpy.data.objects.remove(obj, do_unlink=True)
 
@@ -211,6 +283,8 @@ def rm_collection(
     if lights:
         unused_remover(bpy.data.lights)
 
+    return 0
+
 
 def render_and_save(filepath: str, fileformat: Optional[str] = None) -> dict:
     """Captures image from camera and dumps to file